@@ -1,13 +1,32 @@
 """
 Module that extends setuptools functionality for building hybrid C++ and CUDA extension for Python wrapper modules.
 """
+import sys
+
 from .build_ext import BuildExtension, fix_dll
-from .extension import CppExtension, CUDAExtension, CUDA_HOME, CUDNN_HOME
+from .build_history import BuildHistoryCommand
+from .fatbin import FatbinReportCommand
+from .extension import CppExtension, CUDAExtension, get_cuda_home, get_cudnn_home
 from .find_cuda import find_cuda_home, find_cuda_home_path
+from .jit import load
 
 __version__ = '0.1.8'
 __all__ = [
-    'BuildExtension', 'CppExtension', 'CUDAExtension',
+    'BuildExtension', 'BuildHistoryCommand', 'CppExtension', 'CUDAExtension', 'FatbinReportCommand',
     'find_cuda_home', 'find_cuda_home_path',
-    'fix_dll', 'nvml'
+    'fix_dll', 'load', 'nvml'
 ]
+
+
+def __getattr__(name: str):
+    # `CUDA_HOME` and `CUDNN_HOME` are resolved on first access, see `get_cuda_home`.
+    if name == 'CUDA_HOME':
+        return get_cuda_home()
+    if name == 'CUDNN_HOME':
+        return get_cudnn_home()
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
+if sys.version_info < (3, 7):
+    # No module `__getattr__` (PEP 562) before Python 3.7, see `extension`.
+    from .extension import CUDA_HOME, CUDNN_HOME
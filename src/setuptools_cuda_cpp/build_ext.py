@@ -1,17 +1,39 @@
 import collections
 import copy
+import functools
+import json
 import os
 import re
 import shlex
+import shutil
 import subprocess
 import sys
+import sysconfig
+import time
 import warnings
 from distutils.command.build_ext import build_ext
+from distutils.dep_util import newer_group
+from distutils.errors import DistutilsError
 from pathlib import Path
-from typing import List, Optional, Collection
-
-from .extension import CUDA_HOME
-from .ninja_build import is_ninja_available, _write_ninja_file_and_compile_objects
+from typing import List, Optional, Collection, Tuple
+
+from .build_history import BuildHistory, default_history_file
+from .extension import get_cuda_home, _add_cuda_paths
+from .extension_cache import ExtensionCache, DEFAULT_MAX_SIZE as EXTENSION_CACHE_MAX_SIZE, portable_path, \
+    default_cache_directory as default_extension_cache_directory, fingerprint as extension_fingerprint
+from .fatbin import FATBIN_REPORT, analyze_extension, check_size_budget, format_fatbin_report, gencode_targets, \
+    parse_size
+from .incremental import DEPFILE_SUFFIX, is_up_to_date, read_depfile, record_command
+from .scheduler import _compile_objects_with_scheduler
+from .nvcc_profile import merge_nvcc_time_profiles, format_nvcc_time_report, nvcc_time_flags, NVCC_TIME_PROFILE
+from .progress import edge_finished, edge_started, progress_callback
+from .nvml import INVENTORY_ENVIRONMENT, get_arch_list, get_device_capability_str, load_inventory, minimal_arch_list
+from .object_cache import ObjectCache, DEFAULT_MAX_SIZE, default_cache_directory, launcher_command
+from .ninja_build import is_ninja_available, _write_ninja_file_and_compile_objects, _write_ninja_file_for_objects, \
+    _write_ninja_file_and_compile_graphs, _run_ninja_build, _get_num_workers, _get_nvcc_threads, \
+    _nvcc_generates_dependencies, _read_ninja_deps
+from .toolchain import host_lto_supported, probe_toolchain
+from .unity import unity_sources
 from .utils import _is_cuda_file, IS_WINDOWS
 
 COMMON_MSVC_FLAGS = ['/MD', '/wd4819', '/wd4251', '/wd4244', '/wd4267', '/wd4275', '/wd4018', '/wd4190', '/EHsc']
@@ -28,6 +50,24 @@ COMMON_NVCC_FLAGS = [
     '-D__CUDA_NO_HALF2_OPERATORS__',
     '--expt-relaxed-constexpr'
 ]
+# Note: keep combined names ("arch1+arch2") above single names, otherwise
+# string replacement may not do the right thing
+CUDA_NAMED_ARCHES = collections.OrderedDict([
+    ('Kepler+Tesla', '3.7'),
+    ('Kepler', '3.0;3.5+PTX'),
+    ('Maxwell+Tegra', '5.3'),
+    ('Maxwell', '5.0;5.2+PTX'),
+    ('Pascal', '6.0;6.1+PTX'),
+    ('Volta', '7.0+PTX'),
+    ('Turing', '7.5+PTX'),
+    ('Ampere', '8.0;8.6+PTX'),
+    ('Ada', '8.9+PTX'),
+    ('Hopper', '9.0+PTX'),
+    ('Blackwell', '10.0;12.0+PTX'),
+])
+# Used when nvcc can not list its arches (before CUDA 11.0)
+CUDA_SUPPORTED_ARCHES = ['3.0', '3.5', '3.7', '5.0', '5.2', '5.3', '6.0', '6.1', '6.2',
+                         '7.0', '7.2', '7.5', '8.0', '8.6', '8.9', '9.0']
 
 
 class BuildExtension(build_ext, object):
@@ -47,13 +87,106 @@ class BuildExtension(build_ext, object):
     ``use_ninja`` (bool): If ``use_ninja`` is ``True`` (default), then we
     attempt to build using the Ninja backend. Ninja greatly speeds up
     compilation compared to the standard ``setuptools.build_ext``.
-    Fallbacks to the standard distutils backend if Ninja is not available.
+    Fallbacks to a built-in scheduler that runs the same compile commands on a
+    pool of ``MAX_JOBS`` workers if Ninja is not available (or to the standard
+    distutils backend on Windows).
+
+    On Unix the Ninja backend also links the extensions, so an unchanged
+    extension is not relinked. Every extension keeps its ninja file and its
+    ninja state in its own directory of ``build_temp``, so ninja (which
+    tracks the headers and the command lines) skips the extensions that are
+    up to date. Pass ``--force`` to rebuild them anyway.
+
+    ``single_graph`` (bool): If ``single_graph`` is ``True`` (default ``False``)
+    and the Ninja backend is used, the compile and link edges of every
+    extension are collected into one ninja graph that is run once. This keeps
+    all the workers busy across extension boundaries instead of building the
+    extensions one after another.
+
+    ``object_cache`` (bool or path): If ``object_cache`` is given (default
+    ``False``), the objects compiled on Unix are stored in (and restored from)
+    a content-addressed cache, in that directory or in
+    ``~/.cache/setuptools_cuda_cpp/objects`` when it is ``True``. The entries
+    are keyed on the preprocessed source, the compile flags, the compiler and
+    the CUDA toolkit version. Least recently used entries are evicted above
+    ``object_cache_max_size`` bytes (default 5 GiB).
+
+    ``build_history`` (bool or path): If ``build_history`` is given (default
+    ``False``), the durations of every compile and link run by ninja are
+    appended to that file, or to ``build/build_history.jsonl`` when it is
+    ``True``. The ``build_history`` command
+    (:class:`setuptools_cuda_cpp.BuildHistoryCommand`) reports the slowest
+    objects and the ones that got slower than in their previous builds.
+
+    ``nvcc_time_profile`` (bool): If ``nvcc_time_profile`` is ``True`` (default
+    ``False``), nvcc reports the time of each of its phases (``--time``) for
+    every CUDA object on Unix. After the build the timings are merged into
+    ``build_temp/nvcc_time.json`` and the slowest sources are printed with the
+    time of every phase per target architecture.
+
+    ``nvcc_threads`` (bool or int): On Unix with CUDA 11.2 or newer, nvcc is
+    given ``--threads N`` to compile the targets of a source in parallel. If
+    ``nvcc_threads`` is ``True`` (default), N is picked from the number of
+    targets and the cores left idle by the parallel jobs, ``False`` disables
+    it and an int sets N. The ``nvcc_threads`` argument of
+    :func:`CUDAExtension`, or ``--threads`` in its nvcc flags, overrides it.
+
+    ``linker`` (str): The linker of the extensions on Unix, passed as
+    ``-fuse-ld=<linker>`` (e.g. ``'mold'``, ``'lld'``, ``'gold'``). By default
+    (``'auto'``) the first of mold and lld found on PATH, and usable by the
+    host compiler, is used. ``None`` keeps the compiler's default linker, as
+    does a ``-fuse-ld`` in the ``extra_link_args`` of an extension.
+
+    ``split_debug_info`` (bool): If ``split_debug_info`` is ``True`` (default
+    ``False``), the host code is compiled with ``-gsplit-dwarf`` on Unix, so
+    its debug info stays in ``.dwo`` files instead of going through the link,
+    and linked with ``--gdb-index`` when the linker supports it (gold, lld,
+    mold). ``separate_debug_file`` (bool) moves the debug info left in the
+    extensions to a ``<extension>.debug`` file next to them, referenced by a
+    debuglink (Linux, needs ``objcopy``).
+
+    ``lto`` (bool): If ``lto`` is ``True`` (default ``False``), the host
+    sources are compiled and linked with ``-flto`` and the CUDA sources with
+    relocatable device code and ``-dlto``, device linked with ``-dlto``
+    before the final link. Each part is only enabled if the toolchain
+    supports it (a host compiler accepting ``-flto``, CUDA 11.2 or newer),
+    with a warning otherwise.
+
+    ``extension_cache`` (bool or path): If ``extension_cache`` is given
+    (default ``False``), the built extensions are stored in (and restored
+    from) a cache, in that directory (e.g. on a shared filesystem) or in
+    ``~/.cache/setuptools_cuda_cpp/artifacts`` when it is ``True``, so the
+    extensions whose inputs did not change are neither compiled nor linked.
+    An extension is keyed on its sources and the headers they include, its
+    flags (including the ``nvcc`` and ``nvcc_dlink`` ones), libraries, the
+    compilers and CUDA toolkit versions and the Python ABI. Unix only, least
+    recently used entries are evicted above ``extension_cache_max_size``
+    bytes (default 5 GiB).
+
+    ``fatbin_report`` (bool or path): If ``fatbin_report`` is given (default
+    ``False``), the CUDA fatbinaries of the built extensions are analyzed on
+    Linux: the size of their device code per architecture and their largest
+    kernels are printed, along with the ``-gencode`` targets missing from
+    them, and the reports are written to that JSON file (or to
+    ``build_temp/fatbin_report.json`` when it is ``True``). The build fails
+    if the device code of an extension exceeds ``fatbin_size_budget`` (bytes,
+    or a size such as ``'50M'``).
+
+    ``progress`` (callable, bool or path): If ``progress`` is given (default
+    ``None``), the compiles and links report progress events as they start
+    and finish (edge counts, command, exit status, duration and diagnostics,
+    see :mod:`setuptools_cuda_cpp.progress`): to that callable, as JSON lines
+    appended to that file, or as JSON lines on stderr when it is ``True``.
+    With ninja they are parsed from its status output as it is printed.
 
     .. note::
         By default, the Ninja backend uses #CPUS + 2 workers to build the
-        extension. This may use up too many resources on some systems. One
-        can control the number of workers by setting the `MAX_JOBS` environment
-        variable to a non-negative number.
+        extension, #CPUS being capped by the cgroup CPU quota and the workers
+        by the available memory (``CXX_JOB_MEMORY_MB`` per job, 512 by
+        default). The CUDA compiles run in a ninja pool sized from the
+        available memory (``CUDA_JOB_MEMORY_MB`` per nvcc thread, 2048 by
+        default). One can control the number of workers by setting the
+        `MAX_JOBS` environment variable to a non-negative number.
     '''
 
     @classmethod
@@ -71,32 +204,92 @@ class BuildExtension(build_ext, object):
         return cls_with_options
 
     def __init__(self, *args, **kwargs) -> None:
-        super(BuildExtension, self).__init__(*args, **kwargs)
+        # The options are read below: with older setuptools (e.g. on Python 3.6) the constructor of the distutils
+        # command comes first in the MRO, and it takes no keyword arguments.
+        super(BuildExtension, self).__init__(*args)
         self.no_python_abi_suffix = kwargs.get("no_python_abi_suffix", False)
 
         self.use_ninja = kwargs.get('use_ninja', False)
+        self.use_scheduler = False
         if self.use_ninja:
             # Test if we can use ninja. Fallback otherwise.
             msg = ()
             if not is_ninja_available():
-                warnings.warn('Attempted to use ninja as the build_cuda_ext backend but we could not find ninja.'
-                              ' Falling back to using the slow distutils backend.')
+                if IS_WINDOWS:
+                    warnings.warn('Attempted to use ninja as the build_cuda_ext backend but we could not find ninja.'
+                                  ' Falling back to using the slow distutils backend.')
+                else:
+                    warnings.warn('Attempted to use ninja as the build_cuda_ext backend but we could not find ninja.'
+                                  ' Falling back to using the built-in parallel scheduler.')
+                    self.use_scheduler = True
                 self.use_ninja = False
-
-    def finalize_options(self) -> None:
-        super().finalize_options()
-        if self.use_ninja:
-            self.force = True
+        self.single_graph = kwargs.get('single_graph', False)
+        self.object_cache = kwargs.get('object_cache', False)
+        self.object_cache_max_size = kwargs.get('object_cache_max_size', DEFAULT_MAX_SIZE)
+        self._object_cache = None
+        self.build_history = kwargs.get('build_history', False)
+        self.nvcc_time_profile = kwargs.get('nvcc_time_profile', False)
+        self.nvcc_threads = kwargs.get('nvcc_threads', True)
+        self._build_history = None
+        # Extension being built by `build_extension`, the ninja files collected for the single graph and the
+        # pending objects of the extension whose ninja file is completed by its link.
+        self._building_extension = None
+        self._ninja_build_files = None
+        self._ninja_objects = None
+        self.lto = kwargs.get('lto', False)
+        self.linker = kwargs.get('linker', 'auto')
+        self.split_debug_info = kwargs.get('split_debug_info', False)
+        self.separate_debug_file = kwargs.get('separate_debug_file', False)
+        # LTO kinds the toolchain supports, checked by `build_extensions`, and the CUDA objects compiled by distutils
+        # for the device link of the extension being built.
+        self._host_lto = False
+        self._device_lto = False
+        self._device_objects = []
+        self.extension_cache = kwargs.get('extension_cache', False)
+        self.extension_cache_max_size = kwargs.get('extension_cache_max_size', EXTENSION_CACHE_MAX_SIZE)
+        # Fingerprints of the extensions built (not restored) by `build_extension`, stored once they are built.
+        self._extension_cache = None
+        self._extension_fingerprints = {}
+        self.fatbin_report = kwargs.get('fatbin_report', False)
+        self.fatbin_size_budget = kwargs.get('fatbin_size_budget', None)
+        self.progress = kwargs.get('progress', None)
+        self._progress = progress_callback(self.progress)
+        # Compiles reported by the distutils backend.
+        self._num_spawned = 0
 
     def build_extensions(self) -> None:
+        if self.object_cache and self.compiler.compiler_type != 'msvc':
+            object_cache_dir = default_cache_directory() if self.object_cache is True else Path(self.object_cache)
+            stats_file = Path(self.build_temp).absolute() / 'object_cache.stats'
+            stats_file.parent.mkdir(parents=True, exist_ok=True)
+            stats_file.write_text('')
+            self._object_cache = ObjectCache(object_cache_dir, self.object_cache_max_size, stats_file)
+        if self.extension_cache and self.compiler.compiler_type != 'msvc':
+            extension_cache_dir = default_extension_cache_directory() if self.extension_cache is True \
+                else Path(self.extension_cache)
+            self._extension_cache = ExtensionCache(extension_cache_dir, self.extension_cache_max_size)
+        if self.build_history:
+            history_file = default_history_file(self.build_temp) if self.build_history is True \
+                else Path(self.build_history)
+            self._build_history = BuildHistory(history_file, root=Path(self.build_temp))
+        if self.use_ninja and self.force:
+            # Without their ninja log entries, every output is out of date.
+            build_temp = Path(self.build_temp)
+            for build_directory in [build_temp] + [build_temp / ext.name for ext in self.extensions]:
+                ninja_log = build_directory / '.ninja_log'
+                if ninja_log.exists():
+                    ninja_log.unlink()
+        if self.lto:
+            self._check_lto_support()
         self.compiler.src_extensions += ['.cu', '.cuh']
         # Save the original _compile method for later.
         if self.compiler.compiler_type == 'msvc':
             self.compiler._cpp_extensions += ['.cu', '.cuh']
             original_compile = self.compiler.compile
-            original_spawn = self.compiler.spawn
         else:
             original_compile = self.compiler._compile
+        original_spawn = self.compiler.spawn
+        original_link_shared_object = self.compiler.link_shared_object
 
         def append_std14_if_no_std_present(cflags) -> None:
             # NVCC does not allow multiple -std to be passed, so we avoid
@@ -122,6 +315,115 @@ class BuildExtension(build_ext, object):
 
             return cflags
 
+        def ninja_output_dir(output_dir):
+            output_dir = Path(output_dir).absolute()
+            if self._building_extension is not None:
+                # Every extension gets its own directory, so its ninja file and ninja state are not overwritten
+                # by the other extensions, and the extensions sharing a source file do not share its object.
+                output_dir = output_dir / self._building_extension.name
+            return output_dir
+
+        def ninja_compile_objects(**kwargs):
+            if self._object_cache is not None and self.compiler.compiler_type != 'msvc':
+                kwargs['launcher'] = [shlex.quote(arg) for arg in launcher_command(self._object_cache)]
+            if self.nvcc_time_profile and self.compiler.compiler_type != 'msvc':
+                kwargs['cuda_time_profile'] = True
+            precompiled_header = getattr(self._building_extension, 'precompiled_header', None)
+            if precompiled_header is not None and self.compiler.compiler_type != 'msvc':
+                kwargs['precompiled_header'] = precompiled_header
+            if self.use_scheduler:
+                depends = getattr(self._building_extension, 'depends', None) or []
+                _compile_objects_with_scheduler(**kwargs, depends=depends, force=self.compiler.force,
+                                                progress=self._progress)
+            elif self._building_extension is not None and self.compiler.compiler_type != 'msvc':
+                # The objects are built along with the link, see unix_ninja_link_shared_object.
+                # Copy the objects, distutils appends the extra objects of the extension to them.
+                self._ninja_objects = dict(kwargs, objects=list(kwargs['objects']))
+            elif self._ninja_build_files is None:
+                _write_ninja_file_and_compile_objects(**kwargs, history=self._build_history, progress=self._progress)
+            else:
+                self._ninja_build_files.append(_write_ninja_file_for_objects(**kwargs, subninja=True))
+
+        def unix_ninja_link_shared_object(objects, output_filename, *args, **kwargs):
+            ninja_objects, self._ninja_objects = self._ninja_objects, None
+            if ninja_objects is None:
+                return original_link_shared_object(objects, output_filename, *args, **kwargs)
+
+            # Let distutils assemble the link command, but record it instead of spawning it.
+            commands = []
+            force = self.compiler.force
+            try:
+                self.compiler.spawn = commands.append
+                # The objects do not exist yet, so distutils can not tell if they are newer.
+                self.compiler.force = True
+                original_link_shared_object(objects, output_filename, *args, **kwargs)
+            finally:
+                self.compiler.spawn = original_spawn
+                self.compiler.force = force
+
+            command = commands[0]
+            output_index = command.index('-o')
+            library_target = command[output_index + 1]
+            link_args = command[1:output_index] + command[output_index + 2:]
+            # The compiled objects (and the device link object) are the inputs of the ninja link edge.
+            compiled_objects = set(ninja_objects['objects'])
+            ldflags = [arg for arg in link_args if arg not in objects]
+            link_objects = [obj for obj in objects if obj not in compiled_objects]
+
+            build_directory = ninja_objects['build_directory']
+            build_file_path = _write_ninja_file_for_objects(
+                **ninja_objects,
+                ldflags=[shlex.quote(f) for f in ldflags],
+                library_target=str(Path(library_target).absolute()),
+                linker=shlex.quote(command[0]),
+                link_objects=link_objects,
+                subninja=self._ninja_build_files is not None)
+            if self._ninja_build_files is not None:
+                self._ninja_build_files.append(build_file_path)
+                return
+            if ninja_objects['verbose']:
+                print('Compiling and linking objects...', file=sys.stderr)
+            _run_ninja_build(
+                build_directory,
+                ninja_objects['verbose'],
+                error_prefix=f'Error building extension {self._building_extension.name}',
+                history=self._build_history,
+                progress=self._progress)
+
+        def incremental_spawn(command, obj, spawn) -> None:
+            # Like ninja, only compile the objects whose command line, source or headers changed.
+            depends = getattr(self._building_extension, 'depends', None) or []
+            if not self.compiler.force and is_up_to_date(obj, command, depends):
+                return
+            if self._progress is None:
+                spawn(command)
+            else:
+                self._num_spawned += 1
+                self._progress(edge_started(self._num_spawned, None, " ".join(map(shlex.quote, command))))
+                start = time.perf_counter()
+                status = 1
+                try:
+                    spawn(command)
+                    status = 0
+                finally:
+                    # The compiler prints its diagnostics itself.
+                    self._progress(edge_finished(self._num_spawned, None, " ".join(map(shlex.quote, command)), status,
+                                                 time.perf_counter() - start, None))
+            record_command(obj, command)
+
+        def unix_dlink_link_shared_object(objects, output_filename, *args, **kwargs):
+            # The ninja files and the scheduler device link the CUDA objects themselves, distutils does it here.
+            device_objects, self._device_objects = self._device_objects, []
+            extra_compile_args = getattr(self._building_extension, 'extra_compile_args', None)
+            if device_objects and isinstance(extra_compile_args, dict) and 'nvcc_dlink' in extra_compile_args:
+                devlink_out = str(Path(device_objects[0]).parent / 'dlink.o')
+                if self.compiler.force or newer_group(device_objects, devlink_out):
+                    nvcc = str(get_cuda_home() / 'bin' / 'nvcc')
+                    original_spawn([nvcc] + device_objects + ['-o', devlink_out] +
+                                   unix_cuda_flags(extra_compile_args['nvcc_dlink']))
+                objects = list(objects) + [devlink_out]
+            return original_link_shared_object(objects, output_filename, *args, **kwargs)
+
         def convert_to_absolute_paths_inplace(paths):
             # Helper function. See Note [Absolute include_dirs]
             if paths is not None:
@@ -134,19 +436,33 @@ class BuildExtension(build_ext, object):
             original_compiler = self.compiler.compiler_so
             try:
                 if _is_cuda_file(src):
-                    nvcc = [str(CUDA_HOME / 'bin' / 'nvcc')]
+                    nvcc = [str(get_cuda_home() / 'bin' / 'nvcc')]
                     self.compiler.set_executable('compiler_so', nvcc)
                     if isinstance(cflags, dict):
                         cflags = cflags['nvcc']
                     cflags = unix_cuda_flags(cflags)
-                elif isinstance(cflags, dict):
-                    cflags = cflags['cxx']
+                    self._device_objects.append(obj)
+                    # distutils compiles one object at a time.
+                    self._append_nvcc_threads(cflags, num_cuda_sources=1, num_workers=1)
+                    if self.nvcc_time_profile:
+                        cflags += nvcc_time_flags(obj)
+                    if _nvcc_generates_dependencies():
+                        cflags += ['--generate-dependencies-with-compile', '--dependency-output', obj + DEPFILE_SUFFIX]
+                else:
+                    if isinstance(cflags, dict):
+                        cflags = cflags['cxx']
+                    cflags = cflags + ['-MMD', '-MF', obj + DEPFILE_SUFFIX]
                 append_std14_if_no_std_present(cflags)
 
+                spawn = original_spawn
+                if self._object_cache is not None:
+                    spawn = functools.partial(self._object_cache.compile, spawn=original_spawn)
+                self.compiler.spawn = functools.partial(incremental_spawn, obj=obj, spawn=spawn)
                 original_compile(obj, src, ext, cc_args, cflags, pp_opts)
             finally:
-                # Put the original compiler back in place.
+                # Put the original compiler and spawn back in place.
                 self.compiler.set_executable('compiler_so', original_compiler)
+                self.compiler.spawn = original_spawn
 
         def unix_wrap_ninja_compile(sources,
                                     output_dir=None,
@@ -156,7 +472,7 @@ class BuildExtension(build_ext, object):
                                     extra_preargs=None,
                                     extra_postargs=None,
                                     depends=None):
-            r"""Compiles sources by outputting a ninja file and running it."""
+            r"""Compiles sources by outputting a ninja file and running it (or with the built-in scheduler)."""
             # NB: I copied some lines from self.compiler (which is an instance
             # of distutils.UnixCCompiler). See the following link.
             # https://github.com/python/cpython/blob/f03a8f8d5001963ad5b5b28dbd95497e9cc15596/Lib/distutils/ccompiler.py#L564-L567
@@ -168,7 +484,7 @@ class BuildExtension(build_ext, object):
 
             # Use absolute path for output_dir so that the object file paths
             # (`objects`) get generated with absolute paths.
-            output_dir = Path(output_dir).absolute()
+            output_dir = ninja_output_dir(output_dir)
 
             # See Note [Absolute include_dirs]
             convert_to_absolute_paths_inplace(self.compiler.include_dirs)
@@ -177,6 +493,11 @@ class BuildExtension(build_ext, object):
                 self.compiler._setup_compile(str(output_dir), macros,
                                              include_dirs, sources,
                                              depends, extra_postargs)
+            unity_build = getattr(self._building_extension, 'unity_build', 0)
+            if unity_build:
+                sources, objects = unity_sources(sources, objects, unity_build,
+                                                 self._building_extension.unity_exclude, output_dir / 'unity',
+                                                 self.compiler.obj_extension)
             common_cflags = self.compiler._get_cc_args(pp_opts, debug, extra_preargs)
             extra_cc_cflags = self.compiler.compiler_so[1:]
             with_cuda = any(map(_is_cuda_file, sources))
@@ -199,6 +520,8 @@ class BuildExtension(build_ext, object):
                 else:
                     cuda_post_cflags = list(extra_postargs)
                 cuda_post_cflags = unix_cuda_flags(cuda_post_cflags)
+                self._append_nvcc_threads(cuda_post_cflags, sum(map(_is_cuda_file, sources)),
+                                          _get_num_workers(verbose=False))
                 append_std14_if_no_std_present(cuda_post_cflags)
                 cuda_cflags = [shlex.quote(f) for f in cuda_cflags]
                 cuda_post_cflags = [shlex.quote(f) for f in cuda_post_cflags]
@@ -208,7 +531,7 @@ class BuildExtension(build_ext, object):
             else:
                 cuda_dlink_post_cflags = None
 
-            _write_ninja_file_and_compile_objects(
+            ninja_compile_objects(
                 sources=sources,
                 objects=objects,
                 cflags=[shlex.quote(f) for f in extra_cc_cflags + common_cflags],
@@ -217,7 +540,7 @@ class BuildExtension(build_ext, object):
                 cuda_post_cflags=cuda_post_cflags,
                 cuda_dlink_post_cflags=cuda_dlink_post_cflags,
                 build_directory=output_dir,
-                verbose=True,
+                verbose=bool(self.verbose),
                 with_cuda=with_cuda)
 
             # Return *all* object filenames, not just the ones we just built.
@@ -263,7 +586,7 @@ class BuildExtension(build_ext, object):
                     src = src_list[0]
                     obj = obj_list[0]
                     if _is_cuda_file(src):
-                        nvcc = str(CUDA_HOME / 'bin' / 'nvcc')
+                        nvcc = str(get_cuda_home() / 'bin' / 'nvcc')
                         if isinstance(self.cflags, dict):
                             cflags = self.cflags['nvcc']
                         elif isinstance(self.cflags, list):
@@ -305,7 +628,7 @@ class BuildExtension(build_ext, object):
 
             if not self.compiler.initialized:
                 self.compiler.initialize()
-            output_dir = Path(output_dir).absolute()
+            output_dir = ninja_output_dir(output_dir)
 
             # Note [Absolute include_dirs]
             # Convert relative path in self.compiler.include_dirs to absolute path if any,
@@ -374,7 +697,7 @@ class BuildExtension(build_ext, object):
             else:
                 cuda_dlink_post_cflags = None
 
-            _write_ninja_file_and_compile_objects(
+            ninja_compile_objects(
                 sources=sources,
                 objects=objects,
                 cflags=cflags,
@@ -383,7 +706,7 @@ class BuildExtension(build_ext, object):
                 cuda_post_cflags=cuda_post_cflags,
                 cuda_dlink_post_cflags=cuda_dlink_post_cflags,
                 build_directory=output_dir,
-                verbose=True,
+                verbose=bool(self.verbose),
                 with_cuda=with_cuda)
 
             # Return *all* object filenames, not just the ones we just built.
@@ -399,10 +722,250 @@ class BuildExtension(build_ext, object):
         else:
             if self.use_ninja:
                 self.compiler.compile = unix_wrap_ninja_compile
+                self.compiler.link_shared_object = unix_ninja_link_shared_object
+            elif self.use_scheduler:
+                self.compiler.compile = unix_wrap_ninja_compile
             else:
                 self.compiler._compile = unix_wrap_single_compile
+                self.compiler.link_shared_object = unix_dlink_link_shared_object
+
+        if self.use_ninja and self.single_graph:
+            self._build_extensions_single_graph()
+        else:
+            build_ext.build_extensions(self)
+
+        if self._object_cache is not None:
+            hits, misses = self._object_cache.read_stats()
+            print(f'Object cache: {hits} hits, {misses} misses', file=sys.stderr)
+            self._object_cache.trim()
+
+        if self.separate_debug_file and sys.platform.startswith('linux'):
+            for ext in self.extensions:
+                _separate_debug_file(Path(self.get_ext_fullpath(ext.name)))
+
+        if self._extension_cache is not None:
+            for ext in self.extensions:
+                if ext.name in self._extension_fingerprints:
+                    self._extension_cache.store(self._extension_fingerprints.pop(ext.name),
+                                                self._extension_dependencies(ext), self._extension_files(ext))
+            print(f'Extension cache: {self._extension_cache.hits} hits, {self._extension_cache.misses} misses',
+                  file=sys.stderr)
+            self._extension_cache.trim()
+
+        if (self.fatbin_report or self.fatbin_size_budget is not None) and sys.platform.startswith('linux'):
+            self._report_fatbins()
+
+        if self.nvcc_time_profile and self.compiler.compiler_type != 'msvc':
+            build_temp = Path(self.build_temp).absolute()
+            report = format_nvcc_time_report(merge_nvcc_time_profiles(build_temp))
+            if report:
+                print(f'nvcc phase times (see {build_temp / NVCC_TIME_PROFILE}):', file=sys.stderr)
+                print('\n'.join(report), file=sys.stderr)
+
+    def build_extension(self, ext) -> None:
+        if self.lto:
+            self._add_lto_flags(ext)
+        if self.linker and self.compiler.compiler_type != 'msvc':
+            self._add_linker_flags(ext)
+        if self.split_debug_info and self.compiler.compiler_type != 'msvc':
+            self._add_split_debug_info_flags(ext)
+        _add_cuda_paths(ext)
+        if getattr(ext, 'unity_build', 0) and (self.compiler.compiler_type == 'msvc'
+                                               or not (self.use_ninja or self.use_scheduler)):
+            self.warn(f'unity_build is ignored for extension {ext.name}: it requires the ninja backend (or its '
+                      f'scheduler fallback) and a Unix compiler, the sources are compiled one by one.')
+        if self._extension_cache is not None:
+            key = self._extension_fingerprint(ext)
+            if not self.force and self._extension_cache.restore(key, self._extension_files(ext)):
+                print(f'Restored extension {ext.name} from the extension cache', file=sys.stderr)
+                return
+            self._extension_fingerprints[ext.name] = key
+        self._building_extension = ext
+        # Ninja (or `incremental` for the other Unix backends) decides what is out of date from the headers and the
+        # command lines of the objects, instead of the timestamps of the sources distutils compares with the
+        # extension. The link is still skipped by distutils when no object changed.
+        force = self.force
+        if self.use_ninja or self.compiler.compiler_type != 'msvc':
+            self.force = True
+        try:
+            super(BuildExtension, self).build_extension(ext)
+        finally:
+            self._building_extension = None
+            self.force = force
+
+    def _report_fatbins(self) -> None:
+        reports = []
+        for ext in self.extensions:
+            library = Path(self.get_ext_fullpath(ext.name))
+            if not any(map(_is_cuda_file, ext.sources)) or not library.exists():
+                continue
+            # The targets nvcc was given, by the extension or by `_get_cuda_arch_flags`.
+            extra_compile_args = ext.extra_compile_args
+            cuda_flags = list(extra_compile_args.get('nvcc', [])) if isinstance(extra_compile_args, dict) else []
+            expected_targets = gencode_targets(cuda_flags + _get_cuda_arch_flags(cuda_flags))
+            reports.append(dict(analyze_extension(library, expected_targets), extension=ext.name))
+        for report in reports:
+            print('\n'.join(format_fatbin_report(report)), file=sys.stderr)
+        if self.fatbin_report:
+            report_file = Path(self.build_temp) / FATBIN_REPORT if self.fatbin_report is True \
+                else Path(self.fatbin_report)
+            report_file.parent.mkdir(parents=True, exist_ok=True)
+            report_file.write_text(json.dumps(reports, indent=1))
+        budget = self.fatbin_size_budget
+        errors = check_size_budget(reports, parse_size(budget) if isinstance(budget, str) else budget)
+        if errors:
+            raise DistutilsError('\n'.join(errors))
+
+    def _extension_fingerprint(self, ext) -> str:
+        # Everything but the headers, which the cache checks against the ones recorded by each build.
+        from . import __version__
+        with_cuda = any(map(_is_cuda_file, ext.sources))
+        extra_compile_args = ext.extra_compile_args
+        cuda_flags = extra_compile_args.get('nvcc', []) if isinstance(extra_compile_args, dict) else None
+        toolchain = probe_toolchain()
+        return extension_fingerprint({
+            'version': __version__,
+            'name': ext.name,
+            'sources': {portable_path(source): self._extension_cache.file_hash(source) for source in ext.sources},
+            'extra_objects': [self._extension_cache.file_hash(obj) for obj in ext.extra_objects or []],
+            'include_dirs': [portable_path(path) for path in ext.include_dirs],
+            'library_dirs': [portable_path(path) for path in ext.library_dirs],
+            'extension': {attribute: getattr(ext, attribute, None) for attribute in (
+                'define_macros', 'undef_macros', 'libraries', 'runtime_library_dirs', 'extra_compile_args',
+                'extra_link_args', 'export_symbols', 'language', 'unity_build', 'unity_exclude',
+                'precompiled_header', 'dlink_libraries')},
+            'cuda_arch_flags': _get_cuda_arch_flags(cuda_flags) if with_cuda else None,
+            'compiler': [self.compiler.compiler_so, self.compiler.linker_so, toolchain.cxx, toolchain.cxx_version],
+            'cuda': [toolchain.nvcc, toolchain.cuda_version] if with_cuda else None,
+            'python': [sysconfig.get_config_var('EXT_SUFFIX'), sys.implementation.cache_tag],
+            'options': [self.debug, self.no_python_abi_suffix, self.separate_debug_file, self._host_lto,
+                        self._device_lto],
+        })
+
+    def _extension_files(self, ext) -> List[Path]:
+        library = Path(self.get_ext_fullpath(ext.name))
+        return [library, library.with_name(library.name + '.debug')]
+
+    def _extension_dependencies(self, ext) -> List[str]:
+        r'''
+        Returns the sources and the headers of the objects of ``ext``, from the depfiles of its objects or the deps
+        log of ninja.
+        '''
+        build_temp = Path(self.build_temp).absolute()
+        # The ninja and scheduler objects are in a directory per extension, see `ninja_output_dir`.
+        depfiles = list((build_temp / ext.name).rglob('*.d'))
+        depfiles += [Path(obj + DEPFILE_SUFFIX) for obj in self.compiler.object_filenames(ext.sources,
+                                                                                           output_dir=str(build_temp))]
+        dependencies = list(ext.sources)
+        for depfile in depfiles:
+            if depfile.exists():
+                dependencies += read_depfile(depfile)
+        for build_directory in (build_temp / ext.name, build_temp):
+            if (build_directory / '.ninja_deps').exists():
+                dependencies += _read_ninja_deps(build_directory, output_directory=build_temp / ext.name)
+        return [portable_path(path) for path in dependencies]
+
+    def _check_lto_support(self) -> None:
+        if self.compiler.compiler_type == 'msvc':
+            warnings.warn('LTO is not supported with MSVC, building without it.')
+            return
+        self._host_lto = host_lto_supported()
+        if not self._host_lto:
+            warnings.warn('The host compiler does not support -flto, building the host code without LTO.')
+        cuda_version = probe_toolchain().cuda_version
+        # nvcc supports -dlto since CUDA 11.2.
+        self._device_lto = cuda_version is not None and cuda_version >= (11, 2)
+        if not self._device_lto and any(_is_cuda_file(source) for ext in self.extensions for source in ext.sources):
+            warnings.warn('Device LTO (-dlto) requires CUDA 11.2 or newer, building the device code without it.')
+
+    def _add_lto_flags(self, ext) -> None:
+        # Host LTO for the C++ objects and the link, and device LTO for the CUDA objects, which needs relocatable
+        # device code and a device link with -dlto.
+        extra_compile_args = _extra_compile_args_dict(ext)
+        if self._host_lto:
+            cxx = extra_compile_args.setdefault('cxx', [])
+            if '-flto' not in cxx:
+                cxx.append('-flto')
+            if '-flto' not in ext.extra_link_args:
+                ext.extra_link_args = list(ext.extra_link_args) + ['-flto']
+        if self._device_lto and any(map(_is_cuda_file, ext.sources)):
+            nvcc = extra_compile_args.setdefault('nvcc', [])
+            if not any(flag.startswith(('-rdc', '--relocatable-device-code', '-dc')) for flag in nvcc):
+                nvcc.append('-rdc=true')
+            if '-dlto' not in nvcc:
+                nvcc.append('-dlto')
+            nvcc_dlink = extra_compile_args.setdefault('nvcc_dlink', [])
+            if '-dlto' not in nvcc_dlink:
+                nvcc_dlink.append('-dlto')
+            if getattr(ext, 'cuda_paths_pending', False):
+                # `_add_cuda_paths` adds -dlink and the device libraries.
+                ext.dlink = True
+            elif '-dlink' not in nvcc_dlink:
+                nvcc_dlink.append('-dlink')
+        ext.extra_compile_args = extra_compile_args
+
+    def _add_linker_flags(self, ext) -> None:
+        # The flag is part of the link command, so ninja relinks the extensions when the linker changes.
+        if any(arg.startswith('-fuse-ld=') for arg in ext.extra_link_args):
+            return
+        linker = probe_toolchain().fast_linker if self.linker == 'auto' else self.linker
+        if linker is not None:
+            ext.extra_link_args = list(ext.extra_link_args) + [f'-fuse-ld={linker}']
+
+    def _add_split_debug_info_flags(self, ext) -> None:
+        # The host debug info stays in .dwo files next to the objects instead of going through the link. The
+        # linkers other than GNU ld also write a .gdb_index, so gdb does not have to read all the .dwo files.
+        extra_compile_args = _extra_compile_args_dict(ext)
+        cxx = extra_compile_args.setdefault('cxx', [])
+        if '-gsplit-dwarf' not in cxx:
+            cxx.append('-gsplit-dwarf')
+        ext.extra_compile_args = extra_compile_args
+        linker = next((arg[len('-fuse-ld='):] for arg in ext.extra_link_args if arg.startswith('-fuse-ld=')), None)
+        if linker in ('gold', 'lld', 'mold') and '-Wl,--gdb-index' not in ext.extra_link_args:
+            ext.extra_link_args = list(ext.extra_link_args) + ['-Wl,--gdb-index']
+
+    def _append_nvcc_threads(self, cflags, num_cuda_sources, num_workers) -> None:
+        # nvcc compiles the targets of one source one after the other unless given --threads (CUDA 11.2+).
+        if any(flag in ('-t', '--threads') or flag.startswith(('-t=', '--threads=')) for flag in cflags):
+            return
+        threads = getattr(self._building_extension, 'nvcc_threads', None)
+        if threads is None:
+            if self.nvcc_threads is False:
+                return
+            cuda_version = probe_toolchain().cuda_version
+            if cuda_version is None or cuda_version < (11, 2):
+                return
+            threads = _get_nvcc_threads(cflags, num_cuda_sources, num_workers) \
+                if self.nvcc_threads is True else self.nvcc_threads
+        if threads != 1:
+            cflags.extend(['--threads', str(threads)])
+
+    def _build_extensions_single_graph(self) -> None:
+        # Each extension only emits its ninja file, then a single ninja run builds all of them. The
+        # MSVC links are not part of the ninja files, so they are recorded and run afterwards.
+        self._ninja_build_files = []
+        deferred_links = []
+        original_link_shared_object = self.compiler.link_shared_object
+
+        def defer_link_shared_object(*args, **kwargs):
+            deferred_links.append(functools.partial(original_link_shared_object, *args, **kwargs))
 
-        build_ext.build_extensions(self)
+        if self.compiler.compiler_type == 'msvc':
+            self.compiler.link_shared_object = defer_link_shared_object
+        try:
+            # The extensions are collected one after another, ninja already builds them in parallel.
+            self.check_extensions_list(self.extensions)
+            self._build_extensions_serial()
+        finally:
+            self.compiler.link_shared_object = original_link_shared_object
+            build_files, self._ninja_build_files = self._ninja_build_files, None
+
+        if build_files:
+            _write_ninja_file_and_compile_graphs(build_files, Path(self.build_temp).absolute(),
+                                                 verbose=bool(self.verbose), history=self._build_history,
+                                                 progress=self._progress)
+        for link in deferred_links:
+            link()
 
     def get_ext_filename(self, ext_name):
         # Get the original shared library name. For Python 3, this name will be
@@ -438,6 +1001,13 @@ def _get_cuda_arch_flags(cflags: Optional[List[str]] = None) -> List[str]:
     For an added "+PTX", an additional
     ``-gencode=arch=compute_xx,code=compute_xx`` is added.
 
+    The archs are read from the ``CUDA_ARCH_LIST`` environment variable, e.g.
+    ``"8.0;8.6;9.0+PTX"`` or ``"Ampere;Hopper"``, otherwise from the fleet
+    inventory files named by ``CUDA_DEVICE_INVENTORY`` (the fewest archs that
+    run on all the devices listed, see ``nvml.minimal_arch_list``), and
+    otherwise from the visible GPUs (through NVML). Without any of them, nvcc
+    uses its default arch.
+
     See select_compute_arch.cmake for corresponding named and supported arches
     when building with CMake.
     '''
@@ -448,64 +1018,91 @@ def _get_cuda_arch_flags(cflags: Optional[List[str]] = None) -> List[str]:
             if 'arch' in flag:
                 return []
 
-    return []
-    # Note: keep combined names ("arch1+arch2") above single names, otherwise
-    # string replacement may not do the right thing
-    named_arches = collections.OrderedDict([
-        ('Kepler+Tesla', '3.7'),
-        ('Kepler', '3.0;3.5+PTX'),
-        ('Maxwell+Tegra', '5.3'),
-        ('Maxwell', '5.0;5.2+PTX'),
-        ('Pascal', '6.0;6.1+PTX'),
-        ('Volta', '7.0+PTX'),
-        ('Turing', '7.5+PTX'),
-        ('Ampere', '8.0;8.6+PTX'),
-        ('Ada', '8.9+PTX'),
-        ('Hopper', '9.0+PTX'),
-    ])
-
-    supported_arches = ['3.0', '3.5', '3.7', '5.0', '5.2', '5.3', '6.0', '6.1', '6.2',
-                        '7.0', '7.2', '7.5', '8.0', '8.6', '8.9', '9.0']
-    valid_arch_strings = supported_arches + [s + "+PTX" for s in supported_arches]
-
-    # The default is sm_30 for CUDA 9.x and 10.x
-    # First check for an env var (same as used by the main setup.py)
-    # Can be one or more architectures, e.g. "6.1" or "3.5;5.2;6.0;6.1;7.0+PTX"
-    # See cmake/Modules_CUDA_fix/upstream/FindCUDA/select_compute_arch.cmake
-
-    # If not given, determine what's best for the GPU / CUDA version that can be found
-    arch_list = []
-    try:
-        # the assumption is that the extension should run on any of the currently visible cards,
-        # which could be of different types - therefore all archs for visible cards should be included
-        supported_sm = [int(arch.split('_')[1]) for arch in get_arch_list() if 'sm_' in arch]
-        max_supported_sm = max((sm // 10, sm % 10) for sm in supported_sm)
-        for cap in get_device_capability_str():
-            capability = (int(cap[0]), int(cap[2]))
-            # Capability of the device may be higher than what's supported by the user's
-            # NVCC, causing compilation error. User's NVCC is expected to match the one
-            # used to build pytorch, so we use the maximum supported capability of pytorch
-            # to clamp the capability.
-            capability = min(max_supported_sm, capability)
-            arch = f'{capability[0]}.{capability[1]}'
-            if arch not in arch_list:
-                arch_list.append(arch)
-        arch_list = sorted(arch_list)
+    return list(_resolve_cuda_arch_flags(os.environ.get('CUDA_ARCH_LIST'), os.environ.get(INVENTORY_ENVIRONMENT)))
+
+
+@functools.lru_cache()
+def _resolve_cuda_arch_flags(arch_list_env: Optional[str], inventory_env: Optional[str] = None) -> Tuple[str, ...]:
+    # Resolved once per process and arch list, as every compile of every extension asks for the flags.
+    supported_arches = [_sm_to_arch(sm) for sm in get_arch_list()] or CUDA_SUPPORTED_ARCHES
+    supported_arches = [arch for arch in supported_arches if arch is not None]
+
+    if arch_list_env:
+        arch_list_env = arch_list_env.strip()
+        for named_arch, archval in CUDA_NAMED_ARCHES.items():
+            arch_list_env = arch_list_env.replace(named_arch, archval)
+        arch_list = [arch for arch in re.split(r'[;,\s]+', arch_list_env) if arch]
+    else:
+        if inventory_env:
+            # A build machine without GPU, the extension should run on any of the devices of the fleet
+            capabilities = minimal_arch_list('{}.{}'.format(*device.capability)
+                                             for device in load_inventory(inventory_env))
+        else:
+            # the assumption is that the extension should run on any of the currently visible cards,
+            # which could be of different types - therefore all archs for visible cards should be included
+            try:
+                capabilities = get_device_capability_str()
+            except Exception:
+                # No pynvml or no driver (e.g. a build machine without GPU)
+                return ()
+        max_supported = max(supported_arches, key=_arch_key)
+        # Capability of the device may be higher than what's supported by the user's
+        # NVCC, causing compilation error, so we clamp it to the newest supported arch.
+        arch_list = sorted({min(cap, max_supported, key=_arch_key) for cap in capabilities}, key=_arch_key)
+        if not arch_list:
+            return ()
         arch_list[-1] += '+PTX'
-    except subprocess.CalledProcessError:
-        return []
 
-    flags = []
-    for arch in arch_list:
-        if arch not in valid_arch_strings:
+    flags = {}
+    for arch in sorted(set(arch_list), key=_arch_key):
+        real_arch = arch[:-len('+PTX')] if arch.endswith('+PTX') else arch
+        if real_arch not in supported_arches:
             raise ValueError(f"Unknown CUDA arch ({arch}) or GPU not supported")
-        else:
-            num = arch[0] + arch[2]
-            flags.append(f'-gencode=arch=compute_{num},code=sm_{num}')
-            if arch.endswith('+PTX'):
-                flags.append(f'-gencode=arch=compute_{num},code=compute_{num}')
+        num = real_arch.replace('.', '')
+        flags[f'-gencode=arch=compute_{num},code=sm_{num}'] = None
+        if arch.endswith('+PTX'):
+            flags[f'-gencode=arch=compute_{num},code=compute_{num}'] = None
 
-    return sorted(list(set(flags)))
+    return tuple(flags)
+
+
+def _sm_to_arch(sm: str) -> Optional[str]:
+    # "sm_86" -> "8.6", "sm_90a" -> "9.0a"
+    match = re.fullmatch(r'sm_(\d+)(\d)([a-z]?)', sm)
+    return f'{match.group(1)}.{match.group(2)}{match.group(3)}' if match else None
+
+
+def _arch_key(arch: str) -> Tuple[int, int, str]:
+    match = re.match(r'(\d+)\.(\d+)(.*)', arch)
+    if match is None:
+        return 0, 0, arch
+    return int(match.group(1)), int(match.group(2)), match.group(3)
+
+
+def _extra_compile_args_dict(ext) -> dict:
+    # The extra_compile_args of an extension can be a list used for all the compilers.
+    extra_compile_args = ext.extra_compile_args
+    if not isinstance(extra_compile_args, dict):
+        extra_compile_args = {'cxx': list(extra_compile_args or []), 'nvcc': list(extra_compile_args or [])}
+    return extra_compile_args
+
+
+def _separate_debug_file(library: Path) -> None:
+    r'''
+    Moves the debug info of ``library`` to ``<library>.debug``, which the library then references with a
+    ``.gnu_debuglink`` section. Does nothing if the library was not linked again since its debug info was moved.
+    '''
+    debug_file = library.with_name(library.name + '.debug')
+    if not library.exists() or (debug_file.exists() and debug_file.stat().st_mtime >= library.stat().st_mtime):
+        return
+    objcopy = shutil.which('objcopy')
+    if objcopy is None:
+        warnings.warn('objcopy was not found, the debug info is left in the extensions.')
+        return
+    subprocess.check_call([objcopy, '--only-keep-debug', str(library), str(debug_file)])
+    subprocess.check_call([objcopy, '--strip-debug', f'--add-gnu-debuglink={debug_file}', str(library)])
+    # Newer than the stripped library, until the next link.
+    os.utime(str(debug_file))
 
 
 def _nt_quote_args(args: Optional[List[str]]) -> List[str]:
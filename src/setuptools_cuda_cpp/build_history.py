@@ -0,0 +1,153 @@
+r"""
+Persistent record of how long every object took to compile (and every extension to link), to spot build regressions.
+"""
+import json
+import statistics
+import time
+from distutils.core import Command
+from distutils.errors import DistutilsError, DistutilsOptionError
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+DEFAULT_THRESHOLD = 0.2
+# Number of previous builds a duration is compared with.
+HISTORY_LENGTH = 10
+
+
+class BuildHistory:
+    r'''
+    Build durations appended as JSON lines to ``path``, one record per ninja edge of every build:
+    ``{"build": <start of the build>, "target": <name>, "kind": "compile" | "dlink" | "link", "seconds": <duration>}``.
+
+    The targets are named relative to ``root`` (the ``build_temp`` directory) when they are inside it, so they keep
+    their names across builds; the extensions themselves are named after their file.
+    '''
+
+    def __init__(self, path: Path, root: Optional[Path] = None, build: Optional[float] = None) -> None:
+        self.path = Path(path)
+        self.root = Path(root).absolute() if root is not None else None
+        self.build = build if build is not None else time.time()
+
+    def record(self, durations: Iterable[Tuple[str, float]]) -> None:
+        r'''Appends the ``(output path, seconds)`` durations of the current build.'''
+        lines = []
+        for output, seconds in durations:
+            target = self._target_name(output)
+            lines.append(json.dumps({'build': self.build, 'target': target, 'kind': _target_kind(target),
+                                     'seconds': round(seconds, 3)}))
+        if not lines:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self.path.open('a') as history_file:
+            history_file.write('\n'.join(lines) + '\n')
+
+    def load(self) -> List[dict]:
+        if not self.path.exists():
+            return []
+        with self.path.open() as history_file:
+            return [json.loads(line) for line in history_file if line.strip()]
+
+    def report(self, top: int = 10, threshold: float = DEFAULT_THRESHOLD) -> Tuple[List[str], List[str]]:
+        r'''
+        Returns the report lines of the ``top`` slowest targets of the last build, and the lines of the targets
+        whose duration in the last build exceeds the median of their previous builds by more than ``threshold``.
+        '''
+        durations: Dict[str, List[Tuple[float, float]]] = {}
+        for record in self.load():
+            durations.setdefault(record['target'], []).append((record['build'], record['seconds']))
+        if not durations:
+            return [], []
+        last_build = max(build for samples in durations.values() for build, _ in samples)
+
+        latest = {}
+        regressions = []
+        for target, samples in durations.items():
+            samples.sort()
+            build, seconds = samples[-1]
+            if build != last_build:
+                continue
+            latest[target] = seconds
+            previous = [seconds for _, seconds in samples[:-1][-HISTORY_LENGTH:]]
+            if previous:
+                baseline = statistics.median(previous)
+                if baseline > 0 and seconds > baseline * (1 + threshold):
+                    regressions.append((seconds / baseline, target, baseline, seconds))
+
+        slowest = sorted(latest.items(), key=lambda item: item[1], reverse=True)[:top]
+        slowest_lines = [f'{seconds:10.2f}s  {_target_kind(target):8} {target}' for target, seconds in slowest]
+        regression_lines = [f'{seconds:10.2f}s  (was {baseline:.2f}s, +{(ratio - 1) * 100:.0f}%)  {target}'
+                            for ratio, target, baseline, seconds in sorted(regressions, reverse=True)]
+        return slowest_lines, regression_lines
+
+    def _target_name(self, output: str) -> str:
+        path = Path(output).absolute()
+        if self.root is not None:
+            try:
+                return path.relative_to(self.root).as_posix()
+            except ValueError:
+                pass
+        return path.name
+
+
+def _target_kind(target: str) -> str:
+    if Path(target).name == 'dlink.o':
+        return 'dlink'
+    if Path(target).suffix in ('.o', '.obj'):
+        return 'compile'
+    return 'link'
+
+
+def default_history_file(build_temp: str) -> Path:
+    return Path(build_temp).absolute().parent / 'build_history.jsonl'
+
+
+class BuildHistoryCommand(Command):
+    r'''
+    Reports the slowest objects of the last build and the ones that became slower than in their previous builds.
+
+    The history is written by :class:`BuildExtension` when it is given the ``build_history`` option, e.g.
+    ``python setup.py build_ext build_history --threshold 0.3``.
+    '''
+
+    description = 'report the slowest objects and the build time regressions of the extensions'
+    user_options = [
+        ('history-file=', None, 'build history file (default: "build/build_history.jsonl")'),
+        ('top=', None, 'number of slowest objects to report (default: 10)'),
+        ('threshold=', None,
+         f'relative increase over the median of the previous builds reported as a regression (default: '
+         f'{DEFAULT_THRESHOLD})'),
+        ('strict', None, 'fail if any regression is found'),
+    ]
+    boolean_options = ['strict']
+
+    def initialize_options(self) -> None:
+        self.history_file = None
+        self.top = 10
+        self.threshold = DEFAULT_THRESHOLD
+        self.strict = False
+        self.build_temp = None
+
+    def finalize_options(self) -> None:
+        self.set_undefined_options('build_ext', ('build_temp', 'build_temp'))
+        if self.history_file is None:
+            self.history_file = default_history_file(self.build_temp)
+        try:
+            self.top = int(self.top)
+            self.threshold = float(self.threshold)
+        except ValueError as e:
+            raise DistutilsOptionError(f'invalid build_history option: {e}')
+
+    def run(self) -> None:
+        slowest, regressions = BuildHistory(Path(self.history_file)).report(self.top, self.threshold)
+        if not slowest:
+            print(f'No build history in {self.history_file}')
+            return
+        print('Slowest targets of the last build:')
+        print('\n'.join(slowest))
+        if regressions:
+            print(f'Targets more than {self.threshold * 100:.0f}% slower than in their previous builds:')
+            print('\n'.join(regressions))
+            if self.strict:
+                raise DistutilsError(f'{len(regressions)} build time regressions found')
+        else:
+            print('No build time regressions.')
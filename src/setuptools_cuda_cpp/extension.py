@@ -1,15 +1,44 @@
+import functools
 import os
+import sys
 from pathlib import Path
-from typing import List, Iterable
+from typing import List, Iterable, Optional
 
 import setuptools
 
 from .find_cuda import find_cuda_home_path
-from .utils import IS_WINDOWS, PathLike
+from .unity import DEFAULT_UNITY_BATCH_SIZE
+from .utils import IS_WINDOWS, PathLike, lstr
 
-CUDA_HOME = find_cuda_home_path()
-cudnn_path = os.environ.get('CUDNN_HOME') or os.environ.get('CUDNN_PATH')
-CUDNN_HOME = Path(cudnn_path) if cudnn_path is not None else None
+
+@functools.lru_cache()
+def get_cuda_home() -> Path:
+    r'''
+    Returns the CUDA toolkit root, looked up (see :func:`find_cuda_home_path`) on the first call only, so importing
+    the package and the metadata-only builds never search for it.
+    '''
+    return find_cuda_home_path()
+
+
+@functools.lru_cache()
+def get_cudnn_home() -> Optional[Path]:
+    cudnn_path = os.environ.get('CUDNN_HOME') or os.environ.get('CUDNN_PATH')
+    return Path(cudnn_path) if cudnn_path is not None else None
+
+
+def __getattr__(name: str):
+    # `CUDA_HOME` and `CUDNN_HOME` are resolved on first access.
+    if name == 'CUDA_HOME':
+        return get_cuda_home()
+    if name == 'CUDNN_HOME':
+        return get_cudnn_home()
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
+if sys.version_info < (3, 7):
+    # No module `__getattr__` (PEP 562) before Python 3.7, the names are resolved on import as they used to be.
+    CUDA_HOME = get_cuda_home()
+    CUDNN_HOME = get_cudnn_home()
 
 
 def CppExtension(name: str, sources: Iterable[PathLike], *args, **kwargs):
@@ -21,6 +50,9 @@ def CppExtension(name: str, sources: Iterable[PathLike], *args, **kwargs):
                     CppExtension(
                         name='extension',
                         sources=['extension.cpp'],
+                        unity_build=16,
+                        unity_exclude=['special.cpp'],
+                        precompiled_header='common.h',
                         extra_compile_args=['-g']),
                 ],
                 cmdclass={
@@ -43,6 +75,7 @@ def CUDAExtension(name: str, sources: Iterable[PathLike], *args, **kwargs):
         ...                 sources=['extension.cpp', 'extension_kernel.cu'],
         ...                 dlink=True,
         ...                 dlink_libraries=["dlink_lib"],
+        ...                 nvcc_threads=4,
         ...                 extra_compile_args={'cxx': ['-g'],
         ...                                     'nvcc': ['-O2', '-rdc=true']})
         ...     ],
@@ -50,35 +83,49 @@ def CUDAExtension(name: str, sources: Iterable[PathLike], *args, **kwargs):
         ...         'build_ext': BuildExtension
         ...     })
     """
-    library_dirs = list(kwargs.get('library_dirs', []))
-    library_dirs += cuda_library_paths()
-    kwargs['library_dirs'] = library_dirs
-
     libraries = list(kwargs.get('libraries', []))
     if not any(map(lambda s: s.startswith('cudart'), libraries)):
         libraries.append('cudart')
     kwargs['libraries'] = libraries
 
-    include_dirs = list(kwargs.get('include_dirs', []))
-    include_dirs += cuda_include_paths()
-    kwargs['include_dirs'] = include_dirs
-
     kwargs['language'] = 'c++'
 
-    dlink_libraries = list(kwargs.get('dlink_libraries', []))
-    if (kwargs.get('dlink', False)) or len(dlink_libraries) > 0:
-        extra_compile_args = kwargs.get('extra_compile_args', {})
+    dlink_libraries = list(kwargs.pop('dlink_libraries', []))
+    dlink = kwargs.pop('dlink', False) or len(dlink_libraries) > 0
+    # Overrides the `--threads` of nvcc chosen by BuildExtension (0 lets nvcc use all the cores).
+    nvcc_threads = kwargs.pop('nvcc_threads', None)
+
+    extension = _prepare_extension(name, sources, *args, **kwargs)
+    # The CUDA toolkit paths are only added when the extension is built, see `_add_cuda_paths`.
+    extension.cuda_paths_pending = True
+    extension.dlink = dlink
+    extension.dlink_libraries = dlink_libraries
+    extension.nvcc_threads = nvcc_threads
+    return extension
+
+
+def _add_cuda_paths(extension: setuptools.Extension) -> None:
+    r'''
+    Adds the CUDA toolkit (and cuDNN) include and library paths, and the device link flags, to an extension made by
+    :func:`CUDAExtension`. Does nothing for the other extensions, or if it was already done.
+    '''
+    if not getattr(extension, 'cuda_paths_pending', False):
+        return
+    extension.cuda_paths_pending = False
+    extension.library_dirs = list(extension.library_dirs) + lstr(cuda_library_paths())
+    extension.include_dirs = list(extension.include_dirs) + lstr(cuda_include_paths())
+
+    if extension.dlink:
+        extra_compile_args = extension.extra_compile_args or {}
 
         extra_compile_args_dlink = list(extra_compile_args.get('nvcc_dlink', []))
         extra_compile_args_dlink += ['-dlink']
-        extra_compile_args_dlink += [f'-L{x}' for x in library_dirs]
-        extra_compile_args_dlink += [f'-l{x}' for x in dlink_libraries]
+        extra_compile_args_dlink += [f'-L{x}' for x in extension.library_dirs]
+        extra_compile_args_dlink += [f'-l{x}' for x in extension.dlink_libraries]
 
         extra_compile_args['nvcc_dlink'] = extra_compile_args_dlink
 
-        kwargs['extra_compile_args'] = extra_compile_args
-
-    return _prepare_extension(name, sources, *args, **kwargs)
+        extension.extra_compile_args = extra_compile_args
 
 
 def _prepare_extension(name: str, sources: Iterable[PathLike], *args, **kwargs):
@@ -87,36 +134,47 @@ def _prepare_extension(name: str, sources: Iterable[PathLike], *args, **kwargs):
     kwargs['library_dirs'] = list(map(str, kwargs.get('library_dirs', [])))
     kwargs['libraries'] = list(map(str, kwargs.get('libraries', [])))
     kwargs['include_dirs'] = list(map(str, kwargs.get('include_dirs', [])))
+    # Unity build: the batch size (True for the default one) and the sources compiled on their own.
+    unity_build = kwargs.pop('unity_build', False)
+    unity_exclude = list(map(str, kwargs.pop('unity_exclude', [])))
+    precompiled_header = kwargs.pop('precompiled_header', None)
 
-    return setuptools.Extension(name, sources, *args, **kwargs)
+    extension = setuptools.Extension(name, sources, *args, **kwargs)
+    # Batch size of the unity build, 0 for none. Only the ninja backend (and its scheduler fallback) on Unix supports
+    # it, BuildExtension warns and ignores it otherwise.
+    extension.unity_build = DEFAULT_UNITY_BATCH_SIZE if unity_build is True else int(unity_build or 0)
+    extension.unity_exclude = unity_exclude
+    extension.precompiled_header = str(precompiled_header) if precompiled_header is not None else None
+    return extension
 
 
 def cuda_include_paths() -> List[Path]:
     paths = []
-    cuda_home_include = CUDA_HOME / 'include'
+    cuda_home_include = get_cuda_home() / 'include'
     # if we have the Debian/Ubuntu packages for cuda, we get /usr as cuda home.
     # but gcc doesn't like having /usr/include passed explicitly
     if cuda_home_include != Path('/usr/include'):
         paths.append(cuda_home_include)
-    if CUDNN_HOME is not None:
-        paths.append(CUDNN_HOME / 'include')
+    if get_cudnn_home() is not None:
+        paths.append(get_cudnn_home() / 'include')
     return paths
 
 
 def cuda_library_paths() -> List[Path]:
     paths = []
+    cuda_home = get_cuda_home()
     if IS_WINDOWS:
         lib_dir = 'lib/x64'
     else:
         lib_dir = 'lib64'
-        if not (CUDA_HOME / lib_dir).exists() and (CUDA_HOME / 'lib').exists():
+        if not (cuda_home / lib_dir).exists() and (cuda_home / 'lib').exists():
             # 64-bit CUDA may be installed in 'lib' (see e.g. gh-16955)
             # Note that it's also possible both don't exist (see
             # _find_cuda_home) - in that case we stay with 'lib64'.
             lib_dir = 'lib'
-    paths.append(CUDA_HOME / lib_dir)
+    paths.append(cuda_home / lib_dir)
 
-    if CUDNN_HOME is not None:
-        paths.append(CUDNN_HOME / lib_dir)
+    if get_cudnn_home() is not None:
+        paths.append(get_cudnn_home() / lib_dir)
 
     return paths
@@ -0,0 +1,145 @@
+r"""
+Cache of whole built extensions, to skip the compile and the link of the extensions whose inputs did not change (e.g.
+in CI, where every commit rebuilds the same extensions from a fresh checkout).
+
+An extension is looked up in two steps, like the direct mode of ccache: its fingerprint (sources, flags, libraries,
+toolchain and Python ABI, see :func:`fingerprint`) selects the builds of the same sources, and each build records the
+headers its sources included with their content hash, so the build whose headers are unchanged is restored. The
+lookup only hashes files, it never runs a compiler.
+
+The cache can live on a shared filesystem: entries are written aside and renamed into place.
+"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+DEFAULT_MAX_SIZE = 5 * 1024 ** 3
+DEPENDENCIES_NAME = 'dependencies.json'
+
+
+def default_cache_directory() -> Path:
+    cache_home = os.environ.get('XDG_CACHE_HOME') or Path.home() / '.cache'
+    return Path(cache_home) / 'setuptools_cuda_cpp' / 'artifacts'
+
+
+def fingerprint(inputs: dict) -> str:
+    r'''Returns the fingerprint of the (JSON serializable) ``inputs`` of an extension.'''
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def portable_path(path: str) -> str:
+    r'''Returns ``path`` relative to the working directory if it is inside, so checkouts in other places share keys.'''
+    absolute = os.path.abspath(path)
+    relative = os.path.relpath(absolute)
+    return absolute if relative.startswith(os.pardir) else relative
+
+
+class ExtensionCache:
+    r'''
+    On-disk cache of built extensions (and their side files, e.g. their separate debug info), with a size cap and
+    least recently used eviction.
+    '''
+
+    def __init__(self, directory: Path, max_size: int = DEFAULT_MAX_SIZE) -> None:
+        self.directory = Path(directory)
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._hashes: Dict[Tuple[str, int, int], str] = {}
+
+    def restore(self, key: str, files: Iterable[Path]) -> bool:
+        r'''
+        Restores the ``files`` of the build of fingerprint ``key`` whose dependencies are unchanged. Returns ``False``
+        if there is none.
+        '''
+        files = list(files)
+        for entry in self._entries(key):
+            try:
+                dependencies = json.loads((entry / DEPENDENCIES_NAME).read_text())
+            except (OSError, ValueError):
+                continue
+            if any(self.file_hash(path) != file_hash for path, file_hash in dependencies.items()):
+                continue
+            try:
+                for file in files:
+                    if not (entry / file.name).exists():
+                        continue
+                    file.parent.mkdir(parents=True, exist_ok=True)
+                    # Copy aside and rename, a running interpreter may have the previous file mapped.
+                    fd, tmp_path = tempfile.mkstemp(dir=str(file.parent))
+                    os.close(fd)
+                    shutil.copy2(str(entry / file.name), tmp_path)
+                    os.replace(tmp_path, str(file))
+            except OSError:
+                continue
+            # Refresh the entry, the eviction removes the least recently used ones first.
+            os.utime(str(entry))
+            self.hits += 1
+            return True
+        self.misses += 1
+        return False
+
+    def store(self, key: str, dependencies: Iterable[str], files: Iterable[Path]) -> None:
+        r'''Stores the built ``files`` under the fingerprint ``key``, along with the hashes of their ``dependencies``.'''
+        dependency_hashes = {}
+        for path in sorted(set(dependencies)):
+            file_hash = self.file_hash(path)
+            if file_hash is None:
+                return
+            dependency_hashes[path] = file_hash
+        entry = self.directory / key[:2] / key / fingerprint(dependency_hashes)
+        if entry.exists():
+            return
+        entry.parent.mkdir(parents=True, exist_ok=True)
+        tmp_entry = Path(tempfile.mkdtemp(prefix='.', dir=str(entry.parent)))
+        try:
+            for file in files:
+                if file.exists():
+                    shutil.copy2(str(file), str(tmp_entry / file.name))
+            (tmp_entry / DEPENDENCIES_NAME).write_text(json.dumps(dependency_hashes, indent=1))
+            os.rename(str(tmp_entry), str(entry))
+        except OSError:
+            # e.g. another build stored the same entry meanwhile.
+            shutil.rmtree(str(tmp_entry), ignore_errors=True)
+
+    def file_hash(self, path: str) -> Optional[str]:
+        r'''Returns the sha256 of the content of ``path`` (``None`` if it does not exist), memoized on its stat.'''
+        try:
+            stat = os.stat(path)
+            identity = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+            if identity not in self._hashes:
+                with open(path, 'rb') as file:
+                    self._hashes[identity] = hashlib.sha256(file.read()).hexdigest()
+            return self._hashes[identity]
+        except OSError:
+            return None
+
+    def trim(self) -> None:
+        r'''Removes the least recently used entries until the cache fits in ``max_size``.'''
+        entries = []
+        total_size = 0
+        for entry in self.directory.glob('*/*/*'):
+            try:
+                size = sum(file.stat().st_size for file in entry.iterdir())
+                entries.append((entry.stat().st_mtime, size, entry))
+            except OSError:
+                continue
+            total_size += size
+        for _, size, entry in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            shutil.rmtree(str(entry), ignore_errors=True)
+            total_size -= size
+
+    def _entries(self, key: str) -> List[Path]:
+        # The most recently used builds first.
+        try:
+            entries = [entry for entry in (self.directory / key[:2] / key).iterdir()
+                       if entry.is_dir() and not entry.name.startswith('.')]
+            return sorted(entries, key=lambda entry: entry.stat().st_mtime, reverse=True)
+        except OSError:
+            return []
@@ -0,0 +1,330 @@
+r"""
+Size analysis of the CUDA fatbinaries embedded in built extensions, to find the architectures and kernels that make
+the wheels large.
+
+The ELF sections ``.nv_fatbin`` (and ``__nv_relfatbin`` for relocatable device code) of an extension hold fatbinary
+containers, each a list of entries: a cubin (``sm_XY``) or a PTX (``compute_XY``) per ``-gencode`` target of every
+CUDA source. The entries may be LZ4 compressed. The cubins are ELF files themselves, with a ``.text.<kernel>`` section
+per kernel. Everything is parsed in pure Python, so it runs without the CUDA toolkit (e.g. on a built wheel)::
+
+    python -m setuptools_cuda_cpp.fatbin my_ext.so --budget 50M --json report.json
+"""
+import argparse
+import json
+import mmap
+import os
+import re
+import struct
+import sys
+from collections import defaultdict
+from distutils.core import Command
+from distutils.errors import DistutilsError, DistutilsOptionError
+from pathlib import Path
+from typing import Dict, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+
+FATBIN_SECTIONS = ('.nv_fatbin', '__nv_relfatbin')
+FATBIN_MAGIC = 0xBA55ED50
+FATBIN_REPORT = 'fatbin_report.json'
+ELF_MAGIC = b'\x7fELF'
+# Kinds of the fatbinary entries.
+_KIND_PTX = 1
+_KIND_CUBIN = 2
+_FLAG_COMPRESSED = 0x2000
+# Container header: magic, version, header size, size of the entries.
+_CONTAINER_HEADER = struct.Struct('<IHHQ')
+# Entry header: kind, version, header size, padded payload size, compressed size, unknown, minor and major version,
+# architecture, name offset and length, flags, unknown, decompressed size.
+_ENTRY_HEADER = struct.Struct('<HHIQIIHHIIIQQQ')
+_SIZE_UNITS = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+
+
+class FatbinEntry(NamedTuple):
+    kind: str
+    arch: str
+    size: int
+    uncompressed_size: int
+    compressed: bool
+    kernels: Dict[str, int]
+
+
+def analyze_extension(path: Path, expected_targets: Optional[Sequence[str]] = None) -> dict:
+    r'''
+    Returns the fatbinary report of the extension at ``path``: its entries, their total size and the size per
+    architecture. If the ``expected_targets`` (see :func:`gencode_targets`) are given, the report also lists the ones
+    missing from the extension and the ones it has on top of them (e.g. from a linked static library). Raises a
+    ``ValueError`` if the file is not an ELF file.
+    '''
+    path = Path(path)
+    with path.open('rb') as library_file:
+        # An empty file can not be mapped.
+        if os.fstat(library_file.fileno()).st_size == 0:
+            raise ValueError(f'{path} is empty, not an ELF file')
+        if library_file.read(len(ELF_MAGIC)) != ELF_MAGIC:
+            raise ValueError(f'{path} is not an ELF file (e.g. a Linux shared library)')
+        with mmap.mmap(library_file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            entries = [entry for name, section in elf_sections(data) if name in FATBIN_SECTIONS
+                       for entry in read_fatbin_entries(section)]
+    architectures = defaultdict(int)
+    for entry in entries:
+        architectures[entry.arch] += entry.size
+    report = {
+        'path': str(path),
+        'total_size': sum(entry.size for entry in entries),
+        'architectures': dict(sorted(architectures.items())),
+        'entries': [entry._asdict() for entry in entries],
+    }
+    if expected_targets is not None:
+        report['expected_targets'] = sorted(set(expected_targets))
+        report['missing_targets'] = sorted(set(expected_targets) - set(architectures))
+        report['unexpected_targets'] = sorted(set(architectures) - set(expected_targets))
+    return report
+
+
+def format_fatbin_report(report: dict, top: int = 10) -> List[str]:
+    r'''Returns the table of a report of :func:`analyze_extension`, with its ``top`` largest kernels.'''
+    lines = [f'{report["path"]}: {_format_size(report["total_size"])} of device code '
+             f'in {len(report["entries"])} fatbinary entries']
+    counts = defaultdict(int)
+    for entry in report['entries']:
+        counts[entry['arch']] += 1
+    for arch, size in sorted(report['architectures'].items(), key=lambda item: item[1], reverse=True):
+        lines.append(f'{_format_size(size):>12}  {arch:14} {counts[arch]} entries')
+    kernels = defaultdict(int)
+    for entry in report['entries']:
+        for kernel, size in entry['kernels'].items():
+            kernels[(kernel, entry['arch'])] += size
+    if kernels:
+        lines.append('Largest kernels (uncompressed):')
+        for (kernel, arch), size in sorted(kernels.items(), key=lambda item: item[1], reverse=True)[:top]:
+            lines.append(f'{_format_size(size):>12}  {arch:14} {kernel}')
+    if report.get('missing_targets'):
+        lines.append(f'Missing -gencode targets: {", ".join(report["missing_targets"])}')
+    if report.get('unexpected_targets'):
+        lines.append(f'Targets not in the -gencode flags: {", ".join(report["unexpected_targets"])}')
+    return lines
+
+
+def gencode_targets(cuda_flags: Sequence[str]) -> List[str]:
+    r'''
+    Returns the fatbinary entries the nvcc ``cuda_flags`` (e.g. from ``_get_cuda_arch_flags``) embed: ``sm_XY`` for
+    the cubins and ``compute_XY`` for the PTX.
+    '''
+    targets = []
+    flags = ' '.join(cuda_flags)
+    for match in re.finditer(r'(?:-gencode[= ]|--generate-code[= ])arch=(compute_\w+),code=(\[[^\]]*\]|\S+)', flags):
+        codes = match.group(2).strip('[]').replace('"', '')
+        targets += [code for code in codes.split(',') if code]
+    for match in re.finditer(r'(?:^|\s)(?:-arch|--gpu-architecture)[= ](sm|compute)_(\w+)', flags):
+        # "-arch=sm_XY" embeds the cubin of sm_XY and the PTX of compute_XY.
+        targets += [f'sm_{match.group(2)}', f'compute_{match.group(2)}'] if match.group(1) == 'sm' \
+            else [f'compute_{match.group(2)}']
+    return targets
+
+
+def parse_size(size: str) -> int:
+    r'''Returns the bytes of a size such as ``52428800``, ``50M`` or ``1.5G``.'''
+    match = re.fullmatch(r'\s*([\d.]+)\s*([KMG]?)i?B?\s*', str(size), re.IGNORECASE)
+    if match is None:
+        raise ValueError(f'invalid size: {size!r}')
+    return int(float(match.group(1)) * _SIZE_UNITS[match.group(2).upper()])
+
+
+def elf_sections(data) -> Iterator[Tuple[str, bytes]]:
+    r'''Yields the name and content of the sections of the ELF file ``data`` (32 or 64 bits, either endianness).'''
+    if data[:len(ELF_MAGIC)] != ELF_MAGIC:
+        raise ValueError('not an ELF file')
+    is_64_bits = data[4] == 2
+    endian = '<' if data[5] == 1 else '>'
+    if is_64_bits:
+        (section_offset,) = struct.unpack_from(endian + 'Q', data, 0x28)
+        section_size, num_sections, names_index = struct.unpack_from(endian + 'HHH', data, 0x3A)
+        section_header = struct.Struct(endian + 'IIQQQQ')
+    else:
+        (section_offset,) = struct.unpack_from(endian + 'I', data, 0x20)
+        section_size, num_sections, names_index = struct.unpack_from(endian + 'HHH', data, 0x2E)
+        section_header = struct.Struct(endian + 'IIIIII')
+    sections = [section_header.unpack_from(data, section_offset + index * section_size)
+                for index in range(num_sections)]
+    if not sections:
+        return
+    _, _, _, _, names_offset, names_size = sections[names_index]
+    names = data[names_offset:names_offset + names_size]
+    for name_offset, section_type, _, _, offset, size in sections:
+        # SHT_NOBITS sections (.bss) have no content in the file.
+        if section_type == 8:
+            continue
+        name = names[name_offset:names.find(b'\0', name_offset)].decode('utf-8', 'replace')
+        yield name, data[offset:offset + size]
+
+
+def read_fatbin_entries(section: bytes) -> List[FatbinEntry]:
+    r'''Returns the entries of the fatbinary containers of a ``.nv_fatbin`` section.'''
+    entries = []
+    offset = 0
+    while offset + _CONTAINER_HEADER.size <= len(section):
+        magic, _, header_size, fat_size = _CONTAINER_HEADER.unpack_from(section, offset)
+        if magic != FATBIN_MAGIC:
+            # The containers are aligned, skip the padding.
+            offset += 8
+            continue
+        entry_offset, end = offset + header_size, offset + header_size + fat_size
+        while entry_offset + _ENTRY_HEADER.size <= end:
+            entry = _read_entry(section, entry_offset)
+            if entry is None:
+                break
+            entries.append(entry[0])
+            entry_offset += entry[1]
+        offset = end
+    return entries
+
+
+def _read_entry(section: bytes, offset: int) -> Optional[Tuple[FatbinEntry, int]]:
+    (kind, _, header_size, payload_size, compressed_size, _, _, _, arch, _, _, flags, _,
+     decompressed_size) = _ENTRY_HEADER.unpack_from(section, offset)
+    if kind not in (_KIND_PTX, _KIND_CUBIN) or header_size < _ENTRY_HEADER.size:
+        return None
+    compressed = bool(flags & _FLAG_COMPRESSED) and compressed_size > 0
+    payload = section[offset + header_size:offset + header_size + (compressed_size if compressed else payload_size)]
+    kernels = {}
+    if kind == _KIND_CUBIN:
+        try:
+            cubin = _lz4_decompress(payload, decompressed_size) if compressed else payload
+            kernels = {name[len('.text.'):]: len(content) for name, content in elf_sections(cubin)
+                       if name.startswith('.text.')}
+        except (ValueError, IndexError, struct.error):
+            # e.g. a compression this parser does not know, the entry is still reported as a whole.
+            kernels = {}
+    entry = FatbinEntry(kind='cubin' if kind == _KIND_CUBIN else 'ptx',
+                        arch=f'{"sm" if kind == _KIND_CUBIN else "compute"}_{arch}',
+                        size=header_size + payload_size,
+                        uncompressed_size=decompressed_size if compressed else payload_size,
+                        compressed=compressed,
+                        kernels=kernels)
+    return entry, header_size + payload_size
+
+
+def _lz4_decompress(data: bytes, size: int) -> bytes:
+    # LZ4 block format: sequences of literals followed by a match copied from the output already decompressed.
+    output = bytearray()
+    index = 0
+    while index < len(data):
+        token = data[index]
+        index += 1
+        literals = token >> 4
+        if literals == 15:
+            while True:
+                byte = data[index]
+                index += 1
+                literals += byte
+                if byte != 255:
+                    break
+        output += data[index:index + literals]
+        index += literals
+        if index >= len(data) or len(output) >= size:
+            break
+        match_offset = data[index] | data[index + 1] << 8
+        index += 2
+        match_length = token & 15
+        if match_length == 15:
+            while True:
+                byte = data[index]
+                index += 1
+                match_length += byte
+                if byte != 255:
+                    break
+        match_length += 4
+        start = len(output) - match_offset
+        if match_offset == 0 or start < 0:
+            raise ValueError('invalid LZ4 block')
+        if match_offset >= match_length:
+            output += output[start:start + match_length]
+        else:
+            for position in range(start, start + match_length):
+                output.append(output[position])
+    return bytes(output[:size])
+
+
+def _format_size(size: int) -> str:
+    for unit in ('B', 'KiB', 'MiB'):
+        if size < 1024:
+            return f'{size:.1f} {unit}' if unit != 'B' else f'{size} B'
+        size /= 1024
+    return f'{size:.1f} GiB'
+
+
+def check_size_budget(reports: List[dict], budget: Optional[int]) -> List[str]:
+    r'''Returns the errors of the extensions whose device code exceeds ``budget`` bytes.'''
+    if budget is None:
+        return []
+    return [f'{report["path"]}: {_format_size(report["total_size"])} of device code exceeds the budget of '
+            f'{_format_size(budget)}' for report in reports if report['total_size'] > budget]
+
+
+class FatbinReportCommand(Command):
+    r'''
+    Reports the size of the device code of the built extensions per architecture and kernel, e.g.
+    ``python setup.py build_ext fatbin_report --budget 50M``.
+    '''
+
+    description = 'report the size of the CUDA fatbinaries of the built extensions'
+    user_options = [
+        ('budget=', None, 'maximum size of the device code of an extension, e.g. "50M" (default: none)'),
+        ('json=', None, 'write the reports to this JSON file'),
+        ('top=', None, 'number of largest kernels to report (default: 10)'),
+    ]
+
+    def initialize_options(self) -> None:
+        self.budget = None
+        self.json = None
+        self.top = 10
+
+    def finalize_options(self) -> None:
+        try:
+            self.budget = parse_size(self.budget) if self.budget is not None else None
+            self.top = int(self.top)
+        except ValueError as e:
+            raise DistutilsOptionError(f'invalid fatbin_report option: {e}')
+
+    def run(self) -> None:
+        build_ext = self.get_finalized_command('build_ext')
+        reports = []
+        for ext in build_ext.extensions:
+            path = Path(build_ext.get_ext_fullpath(ext.name))
+            if path.exists():
+                try:
+                    reports.append(dict(analyze_extension(path), extension=ext.name))
+                except ValueError as e:
+                    raise DistutilsError(f'can not analyze extension {ext.name}: {e}')
+        for report in reports:
+            print('\n'.join(format_fatbin_report(report, self.top)))
+        if self.json is not None:
+            Path(self.json).write_text(json.dumps(reports, indent=1))
+        errors = check_size_budget(reports, self.budget)
+        if errors:
+            raise DistutilsError('\n'.join(errors))
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Report the size of the CUDA fatbinaries of built extensions.')
+    parser.add_argument('libraries', nargs='+', type=Path)
+    parser.add_argument('--budget', type=parse_size, default=None,
+                        help='maximum size of the device code of a library, e.g. "50M"')
+    parser.add_argument('--json', type=Path, default=None, help='write the reports to this JSON file')
+    parser.add_argument('--top', type=int, default=10, help='number of largest kernels to report')
+    args = parser.parse_args(argv)
+    try:
+        reports = [analyze_extension(library) for library in args.libraries]
+    except ValueError as e:
+        parser.error(str(e))
+    for report in reports:
+        print('\n'.join(format_fatbin_report(report, args.top)))
+    if args.json is not None:
+        args.json.write_text(json.dumps(reports, indent=1))
+    errors = check_size_budget(reports, args.budget)
+    for error in errors:
+        print(error, file=sys.stderr)
+    return 1 if errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,13 +1,17 @@
+import functools
 import glob
 import os
+import re
+import shutil
 import subprocess
 from pathlib import Path
+from typing import Optional, Tuple
 
-from .utils import IS_WINDOWS, SUBPROCESS_DECODE_ARGS, which
+from .utils import IS_WINDOWS, SUBPROCESS_DECODE_ARGS
 
 
 def find_cuda_home() -> str:
-    return str(find_cuda_home_path)
+    return str(find_cuda_home_path())
 
 
 def find_cuda_home_path() -> Path:
@@ -20,18 +24,30 @@ def find_cuda_home_path() -> Path:
     return cuda_home
 
 
+@functools.lru_cache()
+def get_cuda_version(cuda_home: Path) -> Optional[Tuple[int, int]]:
+    r'''
+    Returns the ``(major, minor)`` version of the CUDA toolkit installed in ``cuda_home``, or ``None`` if its nvcc
+    can not report it.
+    '''
+    try:
+        output = subprocess.check_output([str(cuda_home / 'bin' / 'nvcc'), '--version'], stderr=subprocess.DEVNULL)
+    except Exception:
+        return None
+    match = re.search(r'release (\d+)\.(\d+)', output.decode(*SUBPROCESS_DECODE_ARGS))
+    if match is None:
+        return None
+    return int(match.group(1)), int(match.group(2))
+
+
 def _find_cuda_home_path() -> Path:
     cuda_home = os.environ.get('CUDA_HOME') or os.environ.get('CUDA_PATH')
     if cuda_home is not None:
         return Path(cuda_home)
 
-    try:
-        with Path(os.devnull).open('w') as devnull:
-            nvcc_path = subprocess.check_output([which, 'nvcc'], stderr=devnull).decode(*SUBPROCESS_DECODE_ARGS).rstrip(
-                '\r\n')
-            return Path(nvcc_path).parent.parent
-    except Exception:
-        pass
+    nvcc_path = shutil.which('nvcc')
+    if nvcc_path is not None:
+        return Path(nvcc_path).parent.parent
 
     if IS_WINDOWS:
         cuda_homes = glob.glob('C:/Program Files/NVIDIA GPU Computing Toolkit/CUDA/v*.*')
@@ -0,0 +1,65 @@
+r"""
+Incremental compiles for the backends without ninja (the built-in scheduler and distutils), like ninja does them: an
+object is compiled again only if its command line, its source or one of the headers listed in its depfile changed.
+
+The hash of the command line of every object is kept next to it in ``<object>.cmd``, and the depfile written by the
+compiler (``-MMD``, or ``--dependency-output`` for nvcc) in ``<object>.d``.
+"""
+import hashlib
+import os
+import re
+from pathlib import Path
+from typing import Iterable, List, Sequence, Union
+
+COMMAND_HASH_SUFFIX = '.cmd'
+DEPFILE_SUFFIX = '.d'
+
+Command = Union[str, Sequence[str]]
+
+
+def is_up_to_date(obj: str, command: Command, depends: Iterable[str] = (), depfile: bool = True) -> bool:
+    r'''
+    Returns ``True`` if ``obj`` was built by ``command`` and is newer than its source and headers (read from its
+    depfile, unless ``depfile`` is ``False``) and than the ``depends`` files.
+    '''
+    obj_path = Path(obj)
+    command_hash_path = Path(obj + COMMAND_HASH_SUFFIX)
+    depfile_path = Path(obj + DEPFILE_SUFFIX)
+    if not obj_path.exists() or not command_hash_path.exists() or (depfile and not depfile_path.exists()):
+        return False
+    if command_hash_path.read_text().strip() != _command_hash(command):
+        return False
+    obj_mtime = obj_path.stat().st_mtime_ns
+    dependencies = read_depfile(depfile_path) if depfile else []
+    for dependency in dependencies + list(depends):
+        try:
+            if os.stat(dependency).st_mtime_ns > obj_mtime:
+                return False
+        except OSError:
+            # A removed header, the source must be compiled again to find out.
+            return False
+    return True
+
+
+def record_command(obj: str, command: Command) -> None:
+    r'''Records that ``obj`` was compiled by ``command``, once the compile succeeded.'''
+    Path(obj + COMMAND_HASH_SUFFIX).write_text(_command_hash(command) + '\n')
+
+
+def read_depfile(depfile: Path) -> List[str]:
+    r'''Returns the prerequisites of the Makefile rules of ``depfile`` (as written by ``-MMD``).'''
+    dependencies = []
+    text = depfile.read_text().replace('\\\n', ' ')
+    for line in text.splitlines():
+        # "<target>: <prerequisites>", the spaces in the paths are escaped.
+        match = re.match(r'((?:\\ |[^:\s]|:(?!\s))+):(?:\s+|$)(.*)', line)
+        if match is None:
+            continue
+        dependencies += [path.replace('\\ ', ' ') for path in re.findall(r'(?:\\ |\S)+', match.group(2))]
+    return dependencies
+
+
+def _command_hash(command: Command) -> str:
+    if not isinstance(command, str):
+        command = '\0'.join(command)
+    return hashlib.sha256(command.encode()).hexdigest()
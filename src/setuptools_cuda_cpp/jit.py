@@ -0,0 +1,225 @@
+r"""
+Just-in-time builds: :func:`load` compiles an extension at runtime with the same backend as :class:`BuildExtension`
+and imports it.
+
+Every build has its own directory in the cache, named after a hash of the sources, the flags and the toolchain, so an
+unchanged extension is imported from the cache without running any compiler. A lock file serializes the processes
+that build the same extension at the same time, the others wait for it and import its result.
+"""
+import contextlib
+import hashlib
+import importlib.util
+import json
+import os
+import sys
+import sysconfig
+import tempfile
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+import setuptools
+
+from .build_ext import BuildExtension
+from .extension import CppExtension, CUDAExtension
+from .incremental import read_depfile
+from .ninja_build import _read_ninja_deps
+from .toolchain import probe_toolchain
+from .utils import IS_WINDOWS, _is_cuda_file
+
+PathLike = Union[str, os.PathLike]
+
+MANIFEST_NAME = 'manifest.json'
+LOCK_NAME = 'lock'
+# Bumped when the layout of the build directories changes.
+_JIT_VERSION = 1
+# Options of BuildExtension that do not change the built extension.
+_UNHASHED_OPTIONS = ('use_ninja', 'single_graph', 'object_cache', 'object_cache_max_size', 'build_history',
+                     'nvcc_time_profile', 'nvcc_threads', 'progress')
+# Identity (inode, modification time and size) of the libraries imported by `_import_module`.
+_imported_libraries: Dict[str, Tuple[int, int, int]] = {}
+
+
+def default_jit_directory() -> Path:
+    cache_home = os.environ.get('XDG_CACHE_HOME') or Path.home() / '.cache'
+    return Path(cache_home) / 'setuptools_cuda_cpp' / 'extensions'
+
+
+def load(name: str,
+         sources: Sequence[PathLike],
+         extra_cflags: Optional[List[str]] = None,
+         extra_cuda_cflags: Optional[List[str]] = None,
+         extra_ldflags: Optional[List[str]] = None,
+         extra_include_paths: Optional[List[PathLike]] = None,
+         with_cuda: Optional[bool] = None,
+         build_directory: Optional[PathLike] = None,
+         verbose: bool = False,
+         **build_options):
+    r'''
+    Builds the extension ``name`` from ``sources`` (if it is not in the cache yet) and returns the imported module.
+
+    The extension is a :func:`CUDAExtension` if ``with_cuda`` is ``True`` or, by default, if one of the sources is a
+    CUDA source, and a :func:`CppExtension` otherwise. ``extra_cflags`` and ``extra_cuda_cflags`` are its C++ and
+    nvcc flags, ``extra_ldflags`` its link flags. It is built with the ninja backend in a subdirectory of
+    ``build_directory`` (by default ``~/.cache/setuptools_cuda_cpp/extensions``), with the ``build_options`` of
+    :class:`BuildExtension` (e.g. ``object_cache=True``).
+
+    The subdirectory is named after a hash of the sources, the flags, the options and the toolchain. It keeps the
+    headers the sources included along with the extension, so the extension is built again (incrementally) only when
+    one of them changes. A process can not reload a native module: if the extension is rebuilt after this process
+    imported it, an ``ImportError`` is raised and the new build is used by the next processes.
+
+    Example:
+        >>> module = load('my_ext', ['my_ext.cpp', 'my_kernels.cu'], extra_cuda_cflags=['-O3'])
+    '''
+    sources = [str(Path(source).absolute()) for source in sources]
+    if with_cuda is None:
+        with_cuda = any(map(_is_cuda_file, sources))
+    extension_kwargs = {
+        'include_dirs': [str(Path(path).absolute()) for path in extra_include_paths or []],
+        'extra_compile_args': {'cxx': list(extra_cflags or [])},
+        'extra_link_args': list(extra_ldflags or []),
+    }
+    if with_cuda:
+        extension_kwargs['extra_compile_args']['nvcc'] = list(extra_cuda_cflags or [])
+    build_options = dict({'use_ninja': True}, **build_options)
+
+    build_hash = _build_hash(name, sources, extension_kwargs, with_cuda, build_options)
+    directory = Path(build_directory or default_jit_directory()) / f'{name}_{build_hash}'
+    library = _cached_library(directory)
+    if library is None:
+        directory.mkdir(parents=True, exist_ok=True)
+        with _file_lock(directory / LOCK_NAME):
+            # Another process may have built it while this one was waiting for the lock.
+            library = _cached_library(directory)
+            if library is None:
+                extension = (CUDAExtension if with_cuda else CppExtension)(name, sources, **extension_kwargs)
+                library = _build(extension, directory, verbose, build_options)
+    elif verbose:
+        print(f'Loading extension {name} from {library}...', file=sys.stderr)
+    return _import_module(name, library)
+
+
+def _build_hash(name: str, sources: List[str], extension_kwargs: dict, with_cuda: bool, build_options: dict) -> str:
+    # The headers are not part of the hash, they are checked against the manifest of the build, see _cached_library.
+    sources_hash = {}
+    for source in sources:
+        sources_hash[source] = hashlib.sha256(Path(source).read_bytes()).hexdigest()
+    key = {
+        'version': _JIT_VERSION,
+        'name': name,
+        'sources': sources_hash,
+        'extension': extension_kwargs,
+        'with_cuda': with_cuda,
+        'options': {option: repr(value) for option, value in sorted(build_options.items())
+                    if option not in _UNHASHED_OPTIONS},
+        'toolchain': probe_toolchain()._asdict(),
+        'environment': {var: os.environ.get(var) for var in ('CUDA_ARCH_LIST', 'CUDA_DEVICE_INVENTORY', 'CXX', 'CC')},
+        'python': sysconfig.get_config_var('EXT_SUFFIX'),
+    }
+    return hashlib.sha256(json.dumps(key, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+
+def _cached_library(directory: Path) -> Optional[Path]:
+    r'''
+    Returns the extension built in ``directory`` if it is up to date: the files its manifest lists (the sources and the
+    headers they included) have not changed since it was built.
+    '''
+    try:
+        manifest = json.loads((directory / MANIFEST_NAME).read_text())
+        library = directory / manifest['library']
+        if not library.exists():
+            return None
+        for path, mtime in manifest['dependencies'].items():
+            if os.stat(path).st_mtime_ns != mtime:
+                return None
+    except (OSError, ValueError, KeyError):
+        return None
+    return library
+
+
+def _build(extension: setuptools.Extension, directory: Path, verbose: bool, build_options: dict) -> Path:
+    build_temp = directory / 'build'
+    distribution = setuptools.Distribution({
+        'name': extension.name,
+        'ext_modules': [extension],
+        'cmdclass': {'build_ext': BuildExtension.with_options(**build_options)},
+    })
+    distribution.verbose = int(verbose)
+    command = distribution.get_command_obj('build_ext')
+    command.build_lib = str(directory)
+    command.build_temp = str(build_temp)
+    command.inplace = False
+    if verbose:
+        print(f'Building extension {extension.name} in {directory}...', file=sys.stderr)
+    distribution.run_command('build_ext')
+
+    library = Path(command.get_ext_fullpath(extension.name))
+    # The headers of the sources are in the depfiles of the objects, or in the deps log of ninja that consumes them.
+    dependencies = set(extension.sources)
+    for depfile in build_temp.rglob('*.d'):
+        dependencies.update(str(Path(path).absolute()) for path in read_depfile(depfile))
+    for ninja_deps in build_temp.rglob('.ninja_deps'):
+        dependencies.update(_read_ninja_deps(ninja_deps.parent))
+    manifest = {
+        'library': str(library.relative_to(directory)),
+        'dependencies': {path: os.stat(path).st_mtime_ns for path in sorted(dependencies) if os.path.exists(path)},
+    }
+    _write_atomically(directory / MANIFEST_NAME, json.dumps(manifest, indent=1))
+    return library
+
+
+def _import_module(name: str, library: Path):
+    module = sys.modules.get(name)
+    if module is not None and getattr(module, '__file__', None) == str(library):
+        imported_library = _imported_libraries.get(str(library))
+        if imported_library is not None and imported_library != _library_identity(library):
+            raise ImportError(f'The extension {name} was rebuilt after this process imported it, and a native module '
+                              f'can not be reloaded: restart the interpreter to use the new build of {library}.')
+        return module
+    spec = importlib.util.spec_from_file_location(name, str(library))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    sys.modules[name] = module
+    _imported_libraries[str(library)] = _library_identity(library)
+    return module
+
+
+def _library_identity(library: Path) -> Tuple[int, int, int]:
+    stat = os.stat(str(library))
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
+@contextlib.contextmanager
+def _file_lock(path: Path) -> Iterator[None]:
+    r'''Holds an exclusive lock on ``path`` (created if needed), waiting for the other processes holding it.'''
+    with open(str(path), 'a+') as lock_file:
+        if IS_WINDOWS:
+            import msvcrt
+            lock_file.seek(0)
+            while True:
+                try:
+                    # Retries for 10 seconds before raising.
+                    msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    continue
+            try:
+                yield
+            finally:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+
+def _write_atomically(path: Path, content: str) -> None:
+    # Readers never see a partial manifest, they do not take the lock.
+    fd, tmp_path = tempfile.mkstemp(dir=str(path.parent))
+    with os.fdopen(fd, 'w') as tmp_file:
+        tmp_file.write(content)
+    os.replace(tmp_path, str(path))
@@ -1,11 +1,25 @@
 import os
+import re
+import shlex
 import subprocess
 import sys
 from pathlib import Path
-from typing import List, Optional
+from typing import AbstractSet, Dict, Iterable, List, Optional, Set, Tuple
 
-from .extension import CUDA_HOME
-from .utils import IS_WINDOWS, SUBPROCESS_DECODE_ARGS, _is_cuda_file
+from .extension import get_cuda_home
+from .nvcc_profile import NVCC_TIME_SUFFIX
+from .progress import NINJA_STATUS, NINJA_STATUS_RE, NinjaStatusParser, ProgressCallback, stream_lines
+from .resources import available_cpus, available_memory
+from .toolchain import probe_toolchain
+from .utils import IS_WINDOWS, SUBPROCESS_DECODE_ARGS, _is_cuda_file, _write_if_changed
+
+# Estimated peak memory of a host compile and of an nvcc compile per thread, overridable by the environment variables
+# of the same name.
+CXX_JOB_MEMORY_MB = 512
+CUDA_JOB_MEMORY_MB = 2048
+
+# An entry of the .ninja_log: start and end (in milliseconds since ninja started), mtime and output.
+NinjaLogEntry = Tuple[str, str, str, str]
 
 
 def is_ninja_available():
@@ -13,12 +27,7 @@ def is_ninja_available():
     Returns ``True`` if the `ninja <https://ninja-build.org/>`_ build system is
     available on the system, ``False`` otherwise.
     '''
-    try:
-        subprocess.check_output('ninja --version'.split())
-    except Exception as e:
-        return False
-    else:
-        return True
+    return probe_toolchain().ninja is not None
 
 
 def verify_ninja_availability():
@@ -40,7 +49,63 @@ def _write_ninja_file_and_compile_objects(
         cuda_dlink_post_cflags,
         build_directory: Path,
         verbose: bool,
-        with_cuda: Optional[bool]) -> None:
+        with_cuda: Optional[bool],
+        launcher: Optional[List[str]] = None,
+        cuda_time_profile: bool = False,
+        precompiled_header: Optional[str] = None,
+        history=None,
+        progress: Optional[ProgressCallback] = None) -> None:
+    _write_ninja_file_for_objects(
+        sources=sources,
+        objects=objects,
+        cflags=cflags,
+        post_cflags=post_cflags,
+        cuda_cflags=cuda_cflags,
+        cuda_post_cflags=cuda_post_cflags,
+        cuda_dlink_post_cflags=cuda_dlink_post_cflags,
+        build_directory=build_directory,
+        verbose=verbose,
+        with_cuda=with_cuda,
+        launcher=launcher,
+        cuda_time_profile=cuda_time_profile,
+        precompiled_header=precompiled_header)
+    if verbose:
+        print('Compiling objects...', file=sys.stderr)
+    _run_ninja_build(
+        build_directory,
+        verbose,
+        # It would be better if we could tell users the name of the extension
+        # that failed to build but there isn't a good way to get it here.
+        error_prefix='Error compiling objects for extension',
+        history=history,
+        progress=progress)
+
+
+def _write_ninja_file_for_objects(
+        sources: List[str],
+        objects,
+        cflags,
+        post_cflags,
+        cuda_cflags,
+        cuda_post_cflags,
+        cuda_dlink_post_cflags,
+        build_directory: Path,
+        verbose: bool,
+        with_cuda: Optional[bool],
+        ldflags=None,
+        library_target: Optional[str] = None,
+        linker: Optional[str] = None,
+        link_objects: Optional[List[str]] = None,
+        launcher: Optional[List[str]] = None,
+        cuda_time_profile: bool = False,
+        precompiled_header: Optional[str] = None,
+        subninja: bool = False) -> Path:
+    r"""
+    Writes the ninja file compiling ``objects`` into ``build_directory`` without running it.
+
+    If ``library_target`` is given the ninja file also links the objects into it. If ``subninja`` is ``True`` the file
+    is meant to be part of :func:`_write_ninja_file_and_compile_graphs`, which declares the shared pools.
+    """
     verify_ninja_availability()
     # compiler = Path(os.environ.get('CXX', 'cl') if IS_WINDOWS else os.environ.get('CXX', 'c++'))
     if with_cuda is None:
@@ -57,17 +122,48 @@ def _write_ninja_file_and_compile_objects(
         cuda_dlink_post_cflags=cuda_dlink_post_cflags,
         sources=sources,
         objects=objects,
-        ldflags=None,
-        library_target=None,
-        with_cuda=with_cuda)
+        ldflags=ldflags,
+        library_target=library_target,
+        with_cuda=with_cuda,
+        linker=linker,
+        link_objects=link_objects,
+        launcher=launcher,
+        cuda_time_profile=cuda_time_profile,
+        precompiled_header=precompiled_header,
+        declare_pools=not subninja)
+    return build_file_path
+
+
+def _write_ninja_file_and_compile_graphs(build_files: List[Path], build_directory: Path, verbose: bool,
+                                         history=None, progress: Optional[ProgressCallback] = None) -> None:
+    r"""
+    Builds several ninja files at once.
+
+    Every file in ``build_files`` is included as a ``subninja`` of a single top level graph placed in
+    ``build_directory``, so one ninja process schedules the edges of all of them together.
+    """
+    build_file_path = build_directory / 'build.ninja'
     if verbose:
-        print('Compiling objects...', file=sys.stderr)
-    _run_ninja_build(
-        build_directory,
-        verbose,
-        # It would be better if we could tell users the name of the extension
-        # that failed to build but there isn't a good way to get it here.
-        error_prefix='Error compiling objects for extension')
+        print(f'Emitting ninja build file {build_file_path}...', file=sys.stderr)
+    build_directory.mkdir(parents=True, exist_ok=True)
+    # Pools are global to the graph, the CUDA compiles of all the extensions share the most restrictive one.
+    cuda_pool_depths = [int(depth) for path in build_files
+                        for depth in re.findall(r'^cuda_pool_depth = (\d+)$', Path(path).read_text(), re.MULTILINE)]
+    with build_file_path.open('w') as build_file:
+        # Version 1.3 is required for the `deps` directive.
+        build_file.write('ninja_required_version = 1.3\n\n')
+        if cuda_pool_depths:
+            build_file.write(f'pool cuda_pool\n  depth = {min(cuda_pool_depths)}\n\n')
+        for path in build_files:
+            # Each subninja has its own scope, so the per extension rules and flags do not clash.
+            subninja_path = str(Path(path).absolute()).replace(' ', '$ ')
+            if IS_WINDOWS:
+                subninja_path = subninja_path.replace(':', '$:')
+            build_file.write(f'subninja {subninja_path}\n')
+    if verbose:
+        print(f'Building {len(build_files)} extensions...', file=sys.stderr)
+    _run_ninja_build(build_directory, verbose, error_prefix='Error building extensions', history=history,
+                     progress=progress)
 
 
 def _write_ninja_file(path,
@@ -80,7 +176,13 @@ def _write_ninja_file(path,
                       objects,
                       ldflags,
                       library_target,
-                      with_cuda) -> None:
+                      with_cuda,
+                      linker=None,
+                      link_objects=None,
+                      launcher=None,
+                      cuda_time_profile=False,
+                      precompiled_header=None,
+                      declare_pools=True) -> None:
     r"""Write a ninja file that does the desired compiling and linking.
 
     `path`: Where to write this file
@@ -95,6 +197,18 @@ def _write_ninja_file(path,
     `library_target`: Name of the output library. Can be None; in that case,
                       we do no linking.
     `with_cuda`: If we should be compiling with CUDA.
+    `linker`: Executable used to link `library_target`. Can be None; in that
+              case, $cxx links it.
+    `link_objects`: list of additional objects, not built by this file, to
+                    link into `library_target`. Can be None.
+    `launcher`: list of arguments prefixed to the compile commands (e.g. the
+                object cache launcher). Can be None.
+    `cuda_time_profile`: If nvcc should write the time of its phases next to
+                         every CUDA object (see nvcc_profile).
+    `precompiled_header`: Header precompiled once and used by every host
+                          compile (not on Windows). Can be None.
+    `declare_pools`: If the file declares the `cuda_pool` its CUDA compiles run
+                     in. Otherwise the including ninja file declares it.
     """
 
     def sanitize_flags(flags):
@@ -117,9 +231,13 @@ def _write_ninja_file(path,
     compiler = Path(os.environ.get('CXX', 'cl') if IS_WINDOWS else os.environ.get('CXX', 'c++'))
     # Version 1.3 is required for the `deps` directive.
     config = ['ninja_required_version = 1.3', f'cxx = {compiler}']
+    cuda_pool_depth = None
     if with_cuda:
-        nvcc = str(CUDA_HOME / 'bin' / 'nvcc')
+        nvcc = str(get_cuda_home() / 'bin' / 'nvcc')
         config.append(f'nvcc = {nvcc}')
+        cuda_pool_depth = _get_cuda_pool_depth(cuda_post_cflags)
+        if cuda_pool_depth is not None:
+            config.append(f'cuda_pool_depth = {cuda_pool_depth}')
 
     flags = [f'cflags = {" ".join(cflags)}', f'post_cflags = {" ".join(post_cflags)}']
     if with_cuda:
@@ -127,6 +245,24 @@ def _write_ninja_file(path,
         flags.append(f'cuda_post_cflags = {" ".join(cuda_post_cflags)}')
     flags.append(f'cuda_dlink_post_cflags = {" ".join(cuda_dlink_post_cflags)}')
     flags.append(f'ldflags = {" ".join(ldflags)}')
+    flags.append(f'launcher = {" ".join(sanitize_flags(launcher))}')
+
+    # The precompiled header is built from a wrapper including the declared header, next to which the compiler finds
+    # it when the host sources are compiled with `-include <wrapper>` (and falls back to the wrapper if it can not
+    # use it). Its depfile and command line make ninja rebuild it when its headers or the flags change.
+    pch_rule, pch, pch_output = [], [], None
+    if precompiled_header is not None and not IS_WINDOWS:
+        pch_wrapper = Path(path).parent.absolute() / 'pch' / Path(precompiled_header).name
+        _write_if_changed(pch_wrapper, f'#include "{Path(precompiled_header).absolute().as_posix()}"\n')
+        # clang looks for "<header>.pch", gcc for "<header>.gch".
+        pch_suffix = '.pch' if 'clang' in (probe_toolchain().cxx_version or '') else '.gch'
+        pch_output = str(pch_wrapper).replace(' ', '$ ') + pch_suffix
+        pch_rule = ['rule pch']
+        pch_rule.append('  command = $cxx -x c++-header -MMD -MF $out.d $cflags -c $in -o $out $post_cflags')
+        pch_rule.append('  depfile = $out.d')
+        pch_rule.append('  deps = gcc')
+        pch = [f'build {pch_output}: pch {str(pch_wrapper).replace(" ", "$ ")}']
+        flags.append(f'pch_cflags = -include {shlex.quote(str(pch_wrapper))}')
 
     # Turn into absolute paths, so we can emit them into the ninja build
     # file wherever it is.
@@ -139,10 +275,11 @@ def _write_ninja_file(path,
             '  command = cl /showIncludes $cflags -c $in /Fo$out $post_cflags')
         compile_rule.append('  deps = msvc')
     else:
-        compile_rule.append(
-            '  command = $cxx -MMD -MF $out.d $cflags -c $in -o $out $post_cflags')
+        compile_command = '$launcher $cxx -MMD -MF $out.d $cflags $pch_cflags -c $in -o $out $post_cflags'
+        compile_rule.append(f'  command = {_restat_command(compile_command)}')
         compile_rule.append('  depfile = $out.d')
         compile_rule.append('  deps = gcc')
+        compile_rule.append('  restat = 1')
 
     # Emit one build rule per source to enable incremental build.
     build = []
@@ -154,39 +291,76 @@ def _write_ninja_file(path,
             object_file = object_file.replace(':', '$:')
         source_file = source_file.replace(" ", "$ ")
         object_file = object_file.replace(" ", "$ ")
-        build.append(f'build {object_file}: {rule} {source_file}')
-
-    if cuda_dlink_post_cflags:
+        # The objects are rebuilt along with the precompiled header they were compiled with.
+        implicit_inputs = f' | {pch_output}' if rule == 'compile' and pch_output is not None else ''
+        build.append(f'build {object_file}: {rule} {source_file}{implicit_inputs}')
+
+    # Only the CUDA objects have device code (the nvcc flags, and so -rdc, are the same for all of them), so changing
+    # a host source does not rerun the device link.
+    device_objects = [obj for source, obj in zip(sources, objects) if _is_cuda_file(source)] if with_cuda else []
+    if cuda_dlink_post_cflags and device_objects:
         devlink_out = str(Path(objects[0]).parent / 'dlink.o')
         devlink_rule = ['rule cuda_devlink']
-        devlink_rule.append('  command = $nvcc $in -o $out $cuda_dlink_post_cflags')
-        devlink = [f'build {devlink_out}: cuda_devlink {" ".join(objects)}']
+        if IS_WINDOWS:
+            devlink_rule.append('  command = $nvcc $in -o $out $cuda_dlink_post_cflags')
+        else:
+            devlink_rule.append(f'  command = {_restat_command("$nvcc $in -o $out $cuda_dlink_post_cflags")}')
+            devlink_rule.append('  restat = 1')
+        device_objects = [obj.replace(':', '$:') if IS_WINDOWS else obj for obj in device_objects]
+        devlink = [f'build {devlink_out}: cuda_devlink {" ".join(obj.replace(" ", "$ ") for obj in device_objects)}']
         objects += [devlink_out]
     else:
         devlink_rule, devlink = [], []
 
     if library_target is not None:
+        if linker is not None:
+            config.append(f'ld = {linker}')
         link_rule = ['rule link']
         if IS_WINDOWS:
-            cl_paths = subprocess.check_output(['where', 'cl']).decode(*SUBPROCESS_DECODE_ARGS).split('\r\n')
-            if len(cl_paths) >= 1:
-                cl_path = str(Path(cl_paths[0]).parent).replace(':', '$:')
+            cl = probe_toolchain().cl
+            if cl is not None:
+                cl_path = str(Path(cl).parent).replace(':', '$:')
             else:
                 raise RuntimeError("MSVC is required to load C++ extensions")
             link_rule.append(f'  command = "{Path(cl_path) / "link.exe"}" $in /nologo $ldflags /out:$out')
         else:
-            link_rule.append('  command = $cxx $in $ldflags -o $out')
+            link_rule.append(f'  command = {"$ld" if linker is not None else "$cxx"} $in $ldflags -o $out')
 
-        link = [f'build {library_target}: link {" ".join(objects)}']
+        link_inputs = [str(Path(file).absolute()) for file in objects + list(link_objects or [])]
+        if IS_WINDOWS:
+            library_target = library_target.replace(':', '$:')
+            link_inputs = [file.replace(':', '$:') for file in link_inputs]
+        library_target = library_target.replace(' ', '$ ')
+        link_inputs = [file.replace(' ', '$ ') for file in link_inputs]
+        link = [f'build {library_target}: link {" ".join(link_inputs)}']
 
         default = [f'default {library_target}']
     else:
         link_rule, link, default = [], [], []
 
     # 'Blocks' should be separated by newlines, for visual benefit.
-    blocks = [config, flags, compile_rule]
+    blocks = [config, flags, compile_rule, pch_rule, pch]
     if with_cuda:
-        cuda_compile_rule = ['rule cuda_compile', '  command = $nvcc $cuda_cflags -c $in -o $out $cuda_post_cflags']
+        cuda_compile_rule = ['rule cuda_compile']
+        nvcc_gendeps = ''
+        if _nvcc_generates_dependencies():
+            cuda_compile_rule.append('  depfile = $out.d')
+            cuda_compile_rule.append('  deps = gcc')
+            nvcc_gendeps = ' --generate-dependencies-with-compile --dependency-output $out.d'
+        if cuda_time_profile:
+            nvcc_gendeps += f' --time $out{NVCC_TIME_SUFFIX}'
+        cuda_compile_command = f'$launcher $nvcc{nvcc_gendeps} $cuda_cflags -c $in -o $out $cuda_post_cflags'
+        if IS_WINDOWS:
+            cuda_compile_rule.append(f'  command = {cuda_compile_command}')
+        else:
+            cuda_compile_rule.append(f'  command = {_restat_command(cuda_compile_command)}')
+            cuda_compile_rule.append('  restat = 1')
+        if cuda_pool_depth is not None:
+            # nvcc (cicc, ptxas) takes several GB per job, limit the parallel CUDA compiles to the available memory
+            # without limiting the host compiles.
+            if declare_pools:
+                blocks.append(['pool cuda_pool', f'  depth = {cuda_pool_depth}'])
+            cuda_compile_rule.append('  pool = cuda_pool')
         blocks.append(cuda_compile_rule)
     blocks += [devlink_rule, link_rule, build, devlink, link, default]
     with path.open('w') as build_file:
@@ -195,17 +369,36 @@ def _write_ninja_file(path,
             build_file.write(f'{lines}\n\n')
 
 
+def _restat_command(command: str) -> str:
+    # The previous output is put back when the command rebuilds it unchanged (e.g. a comment was edited, or the object
+    # cache restored the same object), so with `restat` ninja does not run the edges depending on it: the device link
+    # and the link.
+    return f'mv -f $out $out.prev 2>/dev/null; {command} && ' \
+           f'(cmp -s $out $out.prev && mv -f $out.prev $out || rm -f $out.prev)'
+
+
+def _nvcc_generates_dependencies() -> bool:
+    # nvcc can write the headers of the objects in a depfile since CUDA 10.2.
+    cuda_version = probe_toolchain().cuda_version
+    return cuda_version is not None and cuda_version >= (10, 2)
+
+
 PLAT_TO_VCVARS = {
     'win32': 'x86',
     'win-amd64': 'x86_amd64',
 }
 
 
-def _run_ninja_build(build_directory: Path, verbose: bool, error_prefix: str) -> None:
+def _run_ninja_build(build_directory: Path, verbose: bool, error_prefix: str, history=None,
+                     progress: Optional[ProgressCallback] = None) -> None:
+    r'''
+    Runs ninja in ``build_directory``. If a :class:`BuildHistory` ``history`` is given, the durations of the edges
+    ninja ran are recorded in it. If a ``progress`` callback is given, it gets the progress events of the edges as
+    ninja reports them.
+    '''
     command = ['ninja', '-v']
-    num_workers = _get_num_workers(verbose)
-    if num_workers is not None:
-        command.extend(['-j', str(num_workers)])
+    ninja_log_entries = _ninja_log_entries(build_directory)
+    command.extend(['-j', str(_get_num_workers(verbose))])
     env = os.environ.copy()
     # Try to activate the vc env for the users
     if IS_WINDOWS and 'VSCMD_ARG_TGT_ARCH' not in env:
@@ -221,6 +414,11 @@ def _run_ninja_build(build_directory: Path, verbose: bool, error_prefix: str) ->
             if uk not in vc_env:
                 vc_env[uk] = v
         env = vc_env
+    if progress is not None or not verbose:
+        _run_ninja_with_status(command, build_directory, env, verbose, error_prefix, ninja_log_entries, progress)
+        if history is not None:
+            history.record(_read_ninja_log(build_directory, ninja_log_entries))
+        return
     try:
         sys.stdout.flush()
         sys.stderr.flush()
@@ -254,17 +452,157 @@ def _run_ninja_build(build_directory: Path, verbose: bool, error_prefix: str) ->
         if hasattr(error, 'output') and error.output:  # type: ignore[union-attr]
             message += f": {error.output.decode(*SUBPROCESS_DECODE_ARGS)}"  # type: ignore[union-attr]
         raise RuntimeError(message) from e
+    if history is not None:
+        history.record(_read_ninja_log(build_directory, ninja_log_entries))
+
+
+def _run_ninja_with_status(command: List[str], build_directory: Path, env: Dict[str, str], verbose: bool,
+                           error_prefix: str, ninja_log_entries: AbstractSet[NinjaLogEntry],
+                           progress: Optional[ProgressCallback]) -> None:
+    # Parses the output of ninja as it comes, instead of holding all of it, and only keeps the failures.
+    parser = NinjaStatusParser(build_directory, ninja_log_entries)
+    sys.stdout.flush()
+    sys.stderr.flush()
+    with subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, cwd=str(build_directory),
+                          env=dict(env, NINJA_STATUS=NINJA_STATUS)) as process:
+        for line in stream_lines(process.stdout, SUBPROCESS_DECODE_ARGS):
+            events = parser.idle() if line is None else parser.feed(line)
+            for event in events:
+                if progress is not None:
+                    progress(event)
+            if verbose and line is not None:
+                # Ninja's default status.
+                print(NINJA_STATUS_RE.sub(r'[\2/\3] \5', line), flush=True)
+        for event in parser.idle():
+            if progress is not None:
+                progress(event)
+    if process.returncode != 0:
+        message = '\n'.join(parser.failures + parser.messages)
+        raise RuntimeError(f'{error_prefix}: {message}' if message else error_prefix)
+
+
+def _ninja_log_size(build_directory: Path) -> int:
+    try:
+        return (build_directory / '.ninja_log').stat().st_size
+    except OSError:
+        return 0
+
+
+def _ninja_log_entries(build_directory: Path) -> Set[NinjaLogEntry]:
+    r'''Returns the ``(start_ms, end_ms, mtime, output)`` entries of the ``.ninja_log`` of ``build_directory``.'''
+    ninja_log = build_directory / '.ninja_log'
+    if not ninja_log.exists():
+        return set()
+    entries = set()
+    with ninja_log.open() as log:
+        for line in log:
+            fields = line.rstrip('\r\n').split('\t')
+            # Entries are "start_ms end_ms mtime output hash", the header line is a comment.
+            if line.startswith('#') or len(fields) < 4:
+                continue
+            entries.add((fields[0], fields[1], fields[2], fields[3]))
+    return entries
+
+
+def _read_ninja_log(build_directory: Path,
+                    known_entries: AbstractSet[NinjaLogEntry] = frozenset()) -> List[Tuple[str, float]]:
+    r'''
+    Returns the ``(output, seconds)`` of the edges logged in the ``.ninja_log`` of ``build_directory`` that are not
+    among the ``known_entries`` (from :func:`_ninja_log_entries`), i.e. the edges run since they were read. The
+    entries are told apart by their content rather than their position, as ninja recompacts the log when it starts.
+    '''
+    return _ninja_log_durations(_ninja_log_entries(build_directory) - known_entries)
+
 
+def _ninja_log_durations(entries: Iterable[NinjaLogEntry]) -> List[Tuple[str, float]]:
+    # The start and end times are in milliseconds since ninja started.
+    return [(output, (int(end) - int(start)) / 1000)
+            for start, end, _, output in sorted(entries, key=lambda entry: (int(entry[0]), int(entry[1]), entry[3]))]
 
-def _get_num_workers(verbose: bool) -> Optional[int]:
+
+def _read_ninja_deps(build_directory: Path, output_directory: Optional[Path] = None) -> List[str]:
+    r'''
+    Returns the dependencies ninja recorded (in its ``.ninja_deps``, from the depfiles it consumed) for the outputs
+    built in ``build_directory``, or only for those inside ``output_directory`` if it is given.
+    '''
+    result = subprocess.run(['ninja', '-t', 'deps'], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                            cwd=str(build_directory))
+    # "<output>: #deps 2, deps mtime 123 (VALID)" followed by the indented dependencies.
+    dependencies = []
+    selected = False
+    for line in result.stdout.decode(*SUBPROCESS_DECODE_ARGS).splitlines():
+        if line and not line.startswith(' '):
+            output = Path(line.rsplit(': #deps', 1)[0])
+            selected = output_directory is None or Path(output_directory) in output.parents
+        elif line.strip() and selected:
+            dependencies.append(line.strip())
+    return dependencies
+
+
+def _get_num_workers(verbose: bool) -> int:
     max_jobs = os.environ.get('MAX_JOBS')
     if max_jobs is not None and max_jobs.isdigit():
         if verbose:
             print(f'Using envvar MAX_JOBS ({max_jobs}) as the number of workers...', file=sys.stderr)
         return int(max_jobs)
+    # Same default as ninja, but within the cgroup CPU quota and the available memory.
+    num_workers = available_cpus() + 2
+    memory = available_memory()
+    if memory is not None:
+        num_workers = max(1, min(num_workers, memory // _job_memory('CXX_JOB_MEMORY_MB', CXX_JOB_MEMORY_MB)))
     if verbose:
-        print('Allowing ninja to set a default number of workers... '
+        print(f'Using {num_workers} workers for the available CPUs and memory... '
               '(overridable by setting the environment variable MAX_JOBS=N)', file=sys.stderr)
-    return None
+    return num_workers
 
 
+def _get_cuda_pool_depth(cuda_post_cflags: Optional[List[str]]) -> Optional[int]:
+    r'''
+    Returns how many CUDA compiles with ``cuda_post_cflags`` fit in the available memory (``None`` if it is unknown),
+    from the ``CUDA_JOB_MEMORY_MB`` estimate of an nvcc job times its ``--threads``.
+    '''
+    memory = available_memory()
+    if memory is None:
+        return None
+    threads = 1
+    cuda_post_cflags = [flag.strip("'\"") for flag in cuda_post_cflags or []]
+    for i, flag in enumerate(cuda_post_cflags):
+        if flag in ('-t', '--threads') and i + 1 < len(cuda_post_cflags):
+            value = cuda_post_cflags[i + 1]
+        elif flag.startswith(('-t=', '--threads=')):
+            value = flag.partition('=')[2]
+        else:
+            continue
+        if value.isdigit():
+            # nvcc uses all the cores for --threads 0.
+            threads = int(value) or available_cpus()
+    return max(1, memory // (_job_memory('CUDA_JOB_MEMORY_MB', CUDA_JOB_MEMORY_MB) * threads))
+
+
+def _job_memory(variable: str, default_mb: int) -> int:
+    memory_mb = os.environ.get(variable)
+    if memory_mb is None or not memory_mb.isdigit() or int(memory_mb) == 0:
+        memory_mb = default_mb
+    return int(memory_mb) * 2 ** 20
+
+
+def _get_nvcc_threads(cuda_cflags: List[str], num_cuda_sources: int, num_workers: int) -> int:
+    r'''
+    Returns the ``--threads`` of nvcc when ``num_cuda_sources`` CUDA sources are compiled with ``cuda_cflags`` on
+    ``num_workers`` parallel jobs. The cores the jobs leave idle are shared by the nvcc targets, so the jobs times the
+    threads stay within the CPU count.
+    '''
+    num_targets = _count_nvcc_targets(cuda_cflags)
+    num_cpus = available_cpus()
+    parallel_compiles = max(1, min(num_workers, num_cuda_sources))
+    return max(1, min(num_targets, num_cpus // parallel_compiles))
+
+
+def _count_nvcc_targets(cuda_cflags: List[str]) -> int:
+    # "-gencode=arch=compute_80,code=sm_80" has one target, "-gencode arch=compute_80,code=[sm_80,compute_80]" two.
+    num_targets = 0
+    for flag in cuda_cflags:
+        match = re.search(r'\bcode=(\S+)', flag)
+        if match is not None:
+            num_targets += len(match.group(1).strip('[]\'"').split(','))
+    return max(1, num_targets)
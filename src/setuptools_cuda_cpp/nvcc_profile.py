@@ -0,0 +1,79 @@
+r"""
+Per phase timing of the CUDA compiles, from the CSV tables written by ``nvcc --time``.
+
+Every CUDA object gets its own table (``<object>.nvcc_time.csv``). After the build the tables are merged into
+``nvcc_time.json`` in the build directory, which keeps the phases of the last compile of every source, and the tables
+are removed so the next compiles start new ones.
+"""
+import csv
+import json
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, List
+
+NVCC_TIME_SUFFIX = '.nvcc_time.csv'
+NVCC_TIME_PROFILE = 'nvcc_time.json'
+
+_UNIT_TO_MS = {'ms': 1.0, 's': 1000.0, 'us': 0.001}
+# Columns of the nvcc tables, in the order nvcc writes them when the header is missing.
+_COLUMNS = ['source file name', 'phase name', 'phase input files', 'phase output file', 'arch', 'tool', 'metric',
+            'unit']
+
+
+def nvcc_time_flags(obj: str) -> List[str]:
+    return ['--time', obj + NVCC_TIME_SUFFIX]
+
+
+def merge_nvcc_time_profiles(build_directory: Path) -> Dict[str, List[dict]]:
+    r'''
+    Merges the nvcc tables found in ``build_directory`` into its ``nvcc_time.json`` profile, and returns the profile:
+    a mapping from every source to the ``{"phase", "arch", "ms"}`` of its phases.
+    '''
+    profile_path = build_directory / NVCC_TIME_PROFILE
+    profile = json.loads(profile_path.read_text()) if profile_path.exists() else {}
+    for table in sorted(build_directory.glob(f'**/*{NVCC_TIME_SUFFIX}')):
+        phases = _read_nvcc_time_table(table)
+        for source, source_phases in phases.items():
+            profile[source] = source_phases
+        table.unlink()
+    if profile:
+        profile_path.write_text(json.dumps(profile, indent=1, sort_keys=True))
+    return profile
+
+
+def format_nvcc_time_report(profile: Dict[str, List[dict]], top: int = 20) -> List[str]:
+    r'''
+    Returns the report lines of the ``top`` slowest CUDA sources, with the time of every phase per target
+    architecture (``host`` for the phases run for all of them).
+    '''
+    totals = {source: sum(phase['ms'] for phase in phases) for source, phases in profile.items()}
+    lines = []
+    for source in sorted(totals, key=totals.get, reverse=True)[:top]:
+        lines.append(f'{totals[source] / 1000:10.2f}s  {source}')
+        by_arch = defaultdict(list)
+        for phase in profile[source]:
+            by_arch[phase['arch']].append(phase)
+        for arch in sorted(by_arch):
+            for phase in sorted(by_arch[arch], key=lambda p: p['ms'], reverse=True):
+                lines.append(f'{phase["ms"] / 1000:20.2f}s  {arch:14} {phase["phase"]}')
+    return lines
+
+
+def _read_nvcc_time_table(table: Path) -> Dict[str, List[dict]]:
+    phases = defaultdict(list)
+    with table.open(newline='') as table_file:
+        rows = [[cell.strip() for cell in row] for row in csv.reader(table_file) if row]
+    columns = _COLUMNS
+    for row in rows:
+        if row[0].lower() == columns[0]:
+            # nvcc writes the header when it starts the table.
+            columns = [cell.lower() for cell in row]
+            continue
+        cells = dict(zip(columns, row))
+        try:
+            ms = float(cells['metric']) * _UNIT_TO_MS.get(cells.get('unit', 'ms'), 1.0)
+        except (KeyError, ValueError):
+            continue
+        source = cells.get('source file name', '')
+        phases[source].append({'phase': cells.get('phase name', ''), 'arch': cells.get('arch') or 'host', 'ms': ms})
+    return phases
@@ -1,28 +1,71 @@
-from typing import List, Tuple, Union
+r"""
+Inventory of the CUDA devices: the visible GPUs, queried through NVML once per process, or a fleet inventory file for
+the build machines without GPU.
 
-from pynvml import nvmlInit, nvmlShutdown, nvmlDeviceGetCount, nvmlDeviceGetHandleByIndex, \
-    nvmlDeviceGetCudaComputeCapability
+A fleet inventory is a JSON file listing the devices the extensions are deployed to, e.g. the concatenation of the
+inventories exported on each kind of node with ``python -m setuptools_cuda_cpp.nvml --output node.json``. The
+``CUDA_DEVICE_INVENTORY`` environment variable names the inventory files (separated by ``os.pathsep``) the CUDA archs
+are taken from when ``CUDA_ARCH_LIST`` is not set.
+"""
+import argparse
+import functools
+import json
+import os
+import platform
+import re
+import sys
+from pathlib import Path
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple, Union
+
+INVENTORY_ENVIRONMENT = 'CUDA_DEVICE_INVENTORY'
+# Bumped when the format of the inventory files changes.
+INVENTORY_VERSION = 1
+
+
+class Device(NamedTuple):
+    name: str
+    # Compute capability, e.g. ``(8, 6)``.
+    capability: Tuple[int, int]
 
 
 class NVML:
     def __enter__(self):
+        # pynvml is imported on first use, so importing this module does not load it.
+        from pynvml import nvmlInit
         nvmlInit()
 
     def __exit__(self, exc_type, exc_val, exc_tb):
+        from pynvml import nvmlShutdown
         nvmlShutdown()
 
 
-def get_device_capability(device_number: int = None) -> Union[Tuple[int, int], List[Tuple[int, int]]]:
-    arch_list: List[Tuple[int, int]] = []
+@functools.lru_cache()
+def get_device_inventory() -> Tuple[Device, ...]:
+    r'''
+    Returns the visible devices, queried through NVML once per process (the visible devices do not change during a
+    build). Raises if pynvml or the driver is missing.
+    '''
+    from pynvml import nvmlDeviceGetCount, nvmlDeviceGetCudaComputeCapability, nvmlDeviceGetHandleByIndex, \
+        nvmlDeviceGetName
+
+    devices: List[Device] = []
     with NVML():
         device_count = nvmlDeviceGetCount()
         for device_index in range(device_count):
             device_ptr = nvmlDeviceGetHandleByIndex(device_index)
-            arch_list.append(nvmlDeviceGetCudaComputeCapability(device_ptr))
+            name = nvmlDeviceGetName(device_ptr)
+            # Older pynvml return bytes.
+            if isinstance(name, bytes):
+                name = name.decode()
+            devices.append(Device(name, tuple(nvmlDeviceGetCudaComputeCapability(device_ptr))))
+    return tuple(devices)
 
-        if device_number is None:
-            return arch_list
-        return arch_list[device_number]
+
+def get_device_capability(device_number: int = None) -> Union[Tuple[int, int], List[Tuple[int, int]]]:
+    arch_list = [device.capability for device in get_device_inventory()]
+    if device_number is None:
+        return arch_list
+    return arch_list[device_number]
 
 
 def get_device_capability_str(device_number: int = None) -> Union[str, List[str]]:
@@ -34,5 +77,83 @@ def get_device_capability_str(device_number: int = None) -> Union[str, List[str]
 
 
 def get_arch_list() -> List[str]:
-    # TODO Check per cuda version supported architectures
-    return []
+    r'''
+    Returns the real architectures (``sm_XY``) the installed nvcc can compile for, as listed by
+    ``nvcc --list-gpu-arch``, or an empty list if nvcc can not list them (before CUDA 11.0).
+    '''
+    from .toolchain import probe_toolchain
+    return [arch.replace('compute_', 'sm_', 1) for arch in probe_toolchain().gpu_archs or ()]
+
+
+def export_inventory(path: Union[str, os.PathLike], devices: Optional[Sequence[Device]] = None) -> None:
+    r'''Writes the inventory of ``devices`` (by default the visible ones) to the JSON file ``path``.'''
+    if devices is None:
+        devices = get_device_inventory()
+    inventory = {
+        'version': INVENTORY_VERSION,
+        'host': platform.node(),
+        'devices': [{'name': device.name, 'capability': '{}.{}'.format(*device.capability)} for device in devices],
+    }
+    Path(path).write_text(json.dumps(inventory, indent=1))
+
+
+def load_inventory(paths: Union[str, os.PathLike, Iterable[Union[str, os.PathLike]]]) -> List[Device]:
+    r'''
+    Returns the devices listed in the inventory files ``paths`` (a path, or several ones separated by
+    ``os.pathsep``, or a list of paths). Raises a ``ValueError`` for a file of another format.
+    '''
+    if isinstance(paths, (str, os.PathLike)):
+        paths = [path for path in str(paths).split(os.pathsep) if path]
+    devices: List[Device] = []
+    for path in paths:
+        try:
+            inventory = json.loads(Path(path).read_text())
+            if inventory.get('version') != INVENTORY_VERSION:
+                raise ValueError(f'unsupported version {inventory.get("version")!r}')
+            for device in inventory['devices']:
+                major, minor = str(device['capability']).split('.')
+                devices.append(Device(device.get('name', ''), (int(major), int(minor))))
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            raise ValueError(f'Invalid device inventory {path}: {e}') from e
+    return devices
+
+
+def minimal_arch_list(capabilities: Iterable[str]) -> List[str]:
+    r'''
+    Returns the fewest archs (e.g. ``['8.0', '9.0']``) whose binaries run on devices of all the ``capabilities`` (e.g.
+    ``['8.0', '8.6', '8.9', '9.0']``): the binary of an arch X.Y runs on the devices X.Z with Z >= Y, so the oldest
+    minor version of each major one is kept. The arch specific ones (e.g. ``'9.0a'``) are kept as they are.
+    '''
+    oldest_minors: Dict[int, int] = {}
+    specific_archs = set()
+    for capability in capabilities:
+        match = re.fullmatch(r'(\d+)\.(\d+)([a-z]?)', capability)
+        if match is None:
+            raise ValueError(f'Invalid compute capability {capability!r}')
+        major, minor, suffix = int(match.group(1)), int(match.group(2)), match.group(3)
+        if suffix:
+            specific_archs.add((major, minor, suffix))
+        else:
+            oldest_minors[major] = min(minor, oldest_minors.get(major, minor))
+    archs = {(major, minor, '') for major, minor in oldest_minors.items()} | specific_archs
+    return [f'{major}.{minor}{suffix}' for major, minor, suffix in sorted(archs)]
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Export the inventory of the visible CUDA devices.')
+    parser.add_argument('--output', type=Path, default=None, help='write the inventory to this JSON file')
+    args = parser.parse_args(argv)
+    try:
+        devices = get_device_inventory()
+    except Exception as e:
+        print(f'Could not query the CUDA devices through NVML: {e}', file=sys.stderr)
+        return 1
+    if args.output is not None:
+        export_inventory(args.output, devices)
+    for device in devices:
+        print('{} (compute capability {}.{})'.format(device.name, *device.capability))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
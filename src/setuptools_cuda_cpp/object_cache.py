@@ -0,0 +1,266 @@
+r"""
+Content-addressed cache of compiled objects, shared by the ninja and the distutils backends.
+
+The cache key of a compile command is computed from its preprocessed source, its command line (without the output
+paths), the identity of the compiler and, for ``nvcc``, the version of the CUDA toolkit and of its host compiler.
+The ninja backend runs every compile command through this file as a launcher::
+
+    python object_cache.py --directory DIR --max-size BYTES --stats FILE -- c++ -c src.cpp -o src.o ...
+
+This module only depends on the standard library, so it can be run as a script from any ninja build.
+"""
+import argparse
+import hashlib
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+from typing import Callable, List, Optional, Sequence, Tuple
+
+DEFAULT_MAX_SIZE = 5 * 1024 ** 3
+DEPFILE_TARGET = b'@OBJECT@'
+
+# Flags whose value is an output path, they do not take part in the cache key.
+_OUTPUT_FLAGS = ('-o', '-MF', '-MT', '-MQ', '--dependency-output', '--time')
+_DEPENDENCY_FLAGS = ('-MMD', '-MD', '--generate-dependencies-with-compile')
+_DEPFILE_FLAGS = ('-MF', '--dependency-output')
+# nvcc runs the device preprocessing once per target, so the cache does the same.
+_NVCC_ARCH_FLAGS = ('-gencode', '--generate-code', '-arch', '--gpu-architecture')
+
+
+def default_cache_directory() -> Path:
+    cache_home = os.environ.get('XDG_CACHE_HOME') or Path.home() / '.cache'
+    return Path(cache_home) / 'setuptools_cuda_cpp' / 'objects'
+
+
+class ObjectCache:
+    r'''
+    On-disk cache of object files (and their depfiles) with a size cap and least recently used eviction.
+
+    Hits and misses are appended to ``stats_file`` (if given) so the statistics of the compiles run by ninja can be
+    gathered by the process driving the build, see :meth:`read_stats`.
+    '''
+
+    def __init__(self, directory: Path, max_size: int = DEFAULT_MAX_SIZE, stats_file: Optional[Path] = None) -> None:
+        self.directory = Path(directory)
+        self.max_size = max_size
+        self.stats_file = Path(stats_file) if stats_file is not None else None
+
+    def compile(self, command: List[str], spawn: Callable[[List[str]], None]) -> None:
+        r'''
+        Produces the object (and depfile) of the compile ``command`` from the cache, otherwise ``spawn`` s it and
+        stores the result.
+        '''
+        if '-gsplit-dwarf' in command:
+            # The debug info goes to a .dwo file next to the object, which is not stored.
+            spawn(command)
+            return
+        obj = _find_output(command, '-o')
+        depfile = next((_find_output(command, flag) for flag in _DEPFILE_FLAGS if flag in command), None)
+        try:
+            key = self.key(command)
+        except (OSError, subprocess.CalledProcessError):
+            # Let the compiler itself report whatever makes the command fail.
+            spawn(command)
+            return
+        entry = self.directory / key[:2] / key
+        if obj is not None and self._restore(entry, obj, depfile):
+            self._record('hit')
+            return
+        spawn(command)
+        self._record('miss')
+        if obj is not None:
+            self._store(entry, obj, depfile)
+
+    def key(self, command: List[str]) -> str:
+        key = hashlib.sha256()
+        for arg in _key_args(command):
+            key.update(arg.encode() + b'\0')
+        key.update(_file_identity(command[0]).encode())
+        if _is_nvcc(command[0]):
+            key.update(_toolkit_version(command[0]))
+            key.update(_file_identity(_nvcc_host_compiler(command)).encode())
+        for preprocess_command in _preprocess_commands(command):
+            key.update(subprocess.check_output(preprocess_command, stderr=subprocess.DEVNULL))
+        return key.hexdigest()
+
+    def trim(self) -> None:
+        r'''Removes the least recently used entries until the cache fits in ``max_size``.'''
+        entries = []
+        total_size = 0
+        for path in self.directory.glob('*/*.o'):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total_size += stat.st_size
+        for _, size, path in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            for file in (path, path.with_suffix('.d')):
+                try:
+                    file.unlink()
+                except OSError:
+                    pass
+            total_size -= size
+
+    def read_stats(self) -> Tuple[int, int]:
+        r'''Returns the number of hits and misses recorded in ``stats_file``.'''
+        if self.stats_file is None or not self.stats_file.exists():
+            return 0, 0
+        records = self.stats_file.read_text().split()
+        return records.count('hit'), records.count('miss')
+
+    def _restore(self, entry: Path, obj: str, depfile: Optional[str]) -> bool:
+        cached_obj, cached_depfile = entry.with_suffix('.o'), entry.with_suffix('.d')
+        try:
+            if depfile is not None:
+                dependencies = cached_depfile.read_bytes()
+            shutil.copyfile(str(cached_obj), obj)
+        except OSError:
+            return False
+        if depfile is not None:
+            Path(depfile).write_bytes(dependencies.replace(DEPFILE_TARGET, obj.encode()))
+        # Refresh the entry, the eviction removes the least recently used ones first.
+        os.utime(str(cached_obj))
+        return True
+
+    def _store(self, entry: Path, obj: str, depfile: Optional[str]) -> None:
+        entry.parent.mkdir(parents=True, exist_ok=True)
+        files = [(obj, entry.with_suffix('.o'))]
+        if depfile is not None:
+            files.insert(0, (depfile, entry.with_suffix('.d')))
+        for source, target in files:
+            # Write aside and rename, so concurrent compiles never see a partial entry.
+            fd, tmp_path = tempfile.mkstemp(dir=str(entry.parent))
+            try:
+                with os.fdopen(fd, 'wb') as tmp_file:
+                    data = Path(source).read_bytes()
+                    if source == depfile:
+                        data = data.replace(obj.encode(), DEPFILE_TARGET)
+                    tmp_file.write(data)
+                os.replace(tmp_path, str(target))
+            except OSError:
+                os.unlink(tmp_path)
+                return
+
+    def _record(self, event: str) -> None:
+        if self.stats_file is not None:
+            # Short appends are atomic, so every compile process can record its own event.
+            with self.stats_file.open('a') as stats:
+                stats.write(event + '\n')
+
+
+def _find_output(command: Sequence[str], flag: str) -> Optional[str]:
+    if flag in command[:-1]:
+        return command[command.index(flag) + 1]
+    return None
+
+
+def _key_args(command: Sequence[str]) -> List[str]:
+    args = []
+    skip = False
+    for arg in command[1:]:
+        if skip:
+            skip = False
+        elif arg in _OUTPUT_FLAGS:
+            skip = True
+        else:
+            args.append(arg)
+    return args
+
+
+def _preprocess_commands(command: Sequence[str]) -> List[List[str]]:
+    preprocess_command = [command[0]]
+    skip = False
+    for arg in command[1:]:
+        if skip:
+            skip = False
+        elif arg in _OUTPUT_FLAGS:
+            skip = True
+        elif arg not in _DEPENDENCY_FLAGS:
+            preprocess_command.append('-E' if arg == '-c' else arg)
+    if not _is_nvcc(command[0]):
+        return [preprocess_command]
+
+    arch_args = []
+    common_args = []
+    args = iter(preprocess_command)
+    for arg in args:
+        if arg in _NVCC_ARCH_FLAGS:
+            arch_args.append([arg, next(args, '')])
+        elif arg.startswith(tuple(f'{flag}=' for flag in _NVCC_ARCH_FLAGS)):
+            arch_args.append([arg])
+        else:
+            common_args.append(arg)
+    if len(arch_args) <= 1:
+        return [preprocess_command]
+    return [common_args + arch for arch in arch_args]
+
+
+def _is_nvcc(compiler: str) -> bool:
+    return Path(compiler).stem == 'nvcc'
+
+
+def _nvcc_host_compiler(command: Sequence[str]) -> str:
+    for flag in ('-ccbin', '--compiler-bindir'):
+        host_compiler = _find_output(command, flag)
+        if host_compiler is not None:
+            return host_compiler
+    return 'gcc'
+
+
+def _file_identity(executable: str) -> str:
+    path = shutil.which(executable) or executable
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return executable
+    return f'{os.path.realpath(path)}:{stat.st_size}:{stat.st_mtime_ns}'
+
+
+def _toolkit_version(nvcc: str) -> bytes:
+    cuda_home = Path(shutil.which(nvcc) or nvcc).resolve().parent.parent
+    for version_file in ('version.json', 'version.txt'):
+        try:
+            return (cuda_home / version_file).read_bytes()
+        except OSError:
+            pass
+    return subprocess.check_output([nvcc, '--version'])
+
+
+def launcher_command(cache: ObjectCache) -> List[str]:
+    r'''Returns the prefix that runs a compile command through ``cache`` (see the module documentation).'''
+    command = [sys.executable, str(Path(__file__).absolute()),
+               '--directory', str(cache.directory), '--max-size', str(cache.max_size)]
+    if cache.stats_file is not None:
+        command += ['--stats', str(cache.stats_file)]
+    return command + ['--']
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Run a compile command through the object cache.')
+    parser.add_argument('--directory', type=Path, default=default_cache_directory())
+    parser.add_argument('--max-size', type=int, default=DEFAULT_MAX_SIZE)
+    parser.add_argument('--stats', type=Path, default=None)
+    parser.add_argument('command', nargs=argparse.REMAINDER)
+    args = parser.parse_args(argv)
+    command = args.command[1:] if args.command[:1] == ['--'] else args.command
+    if not command:
+        parser.error('missing compile command')
+
+    def spawn(cmd):
+        subprocess.check_call(cmd)
+
+    try:
+        ObjectCache(args.directory, args.max_size, args.stats).compile(command, spawn)
+    except subprocess.CalledProcessError as e:
+        return e.returncode
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,190 @@
+r"""
+Structured progress events of the builds, for the tools driving them: every event is a JSON serializable dict given to
+a callback (or appended as a JSON line to a file) as the compiles and links start and finish.
+
+``{"event": "edge_started", "time": <epoch>, "started": <edges started>, "total": <edges to run>, "command": ...}``
+
+``{"event": "edge_finished", "time": <epoch>, "finished": <edges finished>, "total": <edges to run>,
+"command": ..., "status": <exit status>, "duration": <seconds>, "output": <diagnostics>}``
+
+With Ninja the events are parsed from its status lines as it prints them, its started edges are only known by their
+count (``command`` is ``None``), and the duration of an edge is read from the ``.ninja_log`` (``None`` if it is not
+logged yet). ``total`` is ``None`` when it is not known, e.g. for the distutils backend.
+"""
+import json
+import queue
+import re
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import AbstractSet, Callable, Dict, IO, Iterator, List, Optional, Tuple, Union
+
+ProgressCallback = Callable[[dict], None]
+
+# NINJA_STATUS making the status lines of ninja parsable: started, finished, total and running edges.
+NINJA_STATUS = '[ninja %s/%f/%t/%r] '
+NINJA_STATUS_RE = re.compile(r'^\[ninja (\d+)/(\d+)/(\d+)/(\d+)\] (.*)$')
+# "FAILED: <outputs>", "FAILED: [code=<status>] <outputs>" since ninja 1.12.
+_NINJA_FAILED_RE = re.compile(r'^FAILED: (?:\[code=(\d+)\] )?(.*)$')
+# How long the output of ninja stays idle before the last edge it printed is reported as finished.
+_NINJA_IDLE_SECONDS = 0.1
+
+
+class JsonLinesProgress:
+    r'''Progress callback appending every event as a JSON line to ``path`` (or to ``stream``), flushed right away.'''
+
+    def __init__(self, path: Optional[Path] = None, stream: Optional[IO[str]] = None) -> None:
+        assert (path is None) != (stream is None)
+        self.path = Path(path) if path is not None else None
+        self.stream = stream
+        self._lock = threading.Lock()
+
+    def __call__(self, event: dict) -> None:
+        line = json.dumps(event) + '\n'
+        with self._lock:
+            if self.stream is not None:
+                self.stream.write(line)
+                self.stream.flush()
+                return
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with self.path.open('a') as progress_file:
+                progress_file.write(line)
+
+
+def progress_callback(progress: Union[None, bool, str, Path, ProgressCallback]) -> Optional[ProgressCallback]:
+    r'''
+    Returns the callback of the ``progress`` option: itself if it is callable, JSON lines written to the ``progress``
+    file, or to stderr if it is ``True``.
+    '''
+    if progress is None or progress is False:
+        return None
+    if progress is True:
+        return JsonLinesProgress(stream=sys.stderr)
+    if callable(progress):
+        return _locked(progress)
+    return JsonLinesProgress(path=Path(progress))
+
+
+def edge_started(started: int, total: Optional[int], command: Optional[str] = None) -> dict:
+    return {'event': 'edge_started', 'time': time.time(), 'started': started, 'total': total, 'command': command}
+
+
+def edge_finished(finished: int, total: Optional[int], command: Optional[str], status: int,
+                  duration: Optional[float], output: Optional[str]) -> dict:
+    return {'event': 'edge_finished', 'time': time.time(), 'finished': finished, 'total': total, 'command': command,
+            'status': status, 'duration': None if duration is None else round(duration, 3), 'output': output}
+
+
+class NinjaStatusParser:
+    r'''
+    Turns the output lines of ``ninja -v`` run with :data:`NINJA_STATUS` into progress events.
+
+    Ninja prints the status line and the command of an edge when it finishes, followed by the ``FAILED:`` line and the
+    command again if it failed, and then by its output. An edge is reported once the next status line (or the end of
+    the build, or :meth:`idle`) shows its output is complete. Only the output of the failed edges is kept, for
+    :attr:`failures`, along with the messages of ninja itself in :attr:`messages`.
+    '''
+
+    def __init__(self, build_directory: Path,
+                 ninja_log_entries: AbstractSet[Tuple[str, str, str, str]] = frozenset()) -> None:
+        self.build_directory = build_directory
+        # The .ninja_log entries already read (or of the previous builds), and the size of the log then.
+        self.ninja_log_entries = ninja_log_entries
+        self._ninja_log_size = None
+        self.failures: List[str] = []
+        self.messages: List[str] = []
+        self._started = 0
+        self._durations: Dict[str, float] = {}
+        self._edge: Optional[dict] = None
+
+    def feed(self, line: str) -> Iterator[dict]:
+        r'''Yields the events of an output line of ninja (without its line ending).'''
+        match = NINJA_STATUS_RE.match(line)
+        if match is None:
+            if line.startswith('ninja: '):
+                self.messages.append(line)
+                return
+            if self._edge is None:
+                return
+            failed = _NINJA_FAILED_RE.match(line)
+            if failed is not None and self._edge['status'] == 0 and not self._edge['output']:
+                self._edge['status'] = int(failed.group(1) or 1)
+                self._edge['outputs'] = failed.group(2).split()
+                # The command printed again after the "FAILED:" line.
+                self._edge['skip'] = 1
+            elif self._edge.pop('skip', 0):
+                pass
+            else:
+                self._edge['output'].append(line)
+            return
+        yield from self.idle()
+        started, finished, total, _ = map(int, match.groups()[:4])
+        for count in range(self._started + 1, started + 1):
+            yield edge_started(count, total)
+        self._started = max(self._started, started)
+        self._edge = {'finished': finished, 'total': total, 'command': match.group(5).strip(), 'status': 0, 'output': []}
+
+    def idle(self) -> Iterator[dict]:
+        r'''Yields the event of the last edge ninja printed, when its output is complete.'''
+        edge, self._edge = self._edge, None
+        if edge is None:
+            return
+        output = '\n'.join(edge['output'])
+        if edge['status'] != 0:
+            self.failures.append(f"FAILED: {' '.join(edge.get('outputs', []))}\n{edge['command']}\n{output}".strip())
+        yield edge_finished(edge['finished'], edge['total'], edge['command'], edge['status'],
+                            self._duration(edge), output)
+
+    def _duration(self, edge: dict) -> Optional[float]:
+        # Local import, ninja_build runs the parser.
+        from .ninja_build import _ninja_log_durations, _ninja_log_entries, _ninja_log_size
+        ninja_log_size = _ninja_log_size(self.build_directory)
+        if ninja_log_size != self._ninja_log_size:
+            self._ninja_log_size = ninja_log_size
+            entries = _ninja_log_entries(self.build_directory)
+            self._durations.update(_ninja_log_durations(entries - self.ninja_log_entries))
+            self.ninja_log_entries = entries
+        outputs = edge.get('outputs') or [output for output in self._durations if output in edge['command']]
+        for output in outputs:
+            if output in self._durations:
+                return self._durations.pop(output)
+        return None
+
+
+def stream_lines(stream: IO[bytes], decode_args) -> Iterator[Optional[str]]:
+    r'''
+    Yields the lines of ``stream`` as they are written (without their line ending), and ``None`` whenever it stays
+    idle for a while. Only one line is held in memory at a time.
+    '''
+    lines: 'queue.Queue[Optional[bytes]]' = queue.Queue()
+
+    def read():
+        for line in iter(stream.readline, b''):
+            lines.put(line)
+        lines.put(None)
+
+    reader = threading.Thread(target=read, daemon=True)
+    reader.start()
+    while True:
+        try:
+            line = lines.get(timeout=_NINJA_IDLE_SECONDS)
+        except queue.Empty:
+            yield None
+            continue
+        if line is None:
+            break
+        yield line.decode(*decode_args).rstrip('\r\n')
+    reader.join()
+
+
+def _locked(callback: ProgressCallback) -> ProgressCallback:
+    # The scheduler reports its events from its worker threads.
+    lock = threading.Lock()
+
+    def locked_callback(event: dict) -> None:
+        with lock:
+            callback(event)
+
+    return locked_callback
+
@@ -0,0 +1,137 @@
+r"""
+CPUs and memory available to the build, within the limits of its cgroup (e.g. a container CPU quota and memory limit),
+to size the parallel compile jobs.
+"""
+import math
+import os
+from pathlib import Path
+from typing import List, Optional, Sequence
+
+CGROUP_ROOT = Path('/sys/fs/cgroup')
+PROC_SELF_CGROUP = Path('/proc/self/cgroup')
+# cgroup v1 reports a "no limit" memory limit as a huge page aligned number.
+_CGROUP_V1_UNLIMITED = 2 ** 62
+
+
+def available_cpus() -> int:
+    r'''Returns the number of CPUs the process may use: its CPU affinity, capped by the cgroup CPU quota.'''
+    if hasattr(os, 'sched_getaffinity'):
+        num_cpus = len(os.sched_getaffinity(0))
+    else:
+        num_cpus = os.cpu_count() or 1
+    quota = _cgroup_cpu_quota()
+    if quota is not None:
+        num_cpus = min(num_cpus, max(1, math.ceil(quota)))
+    return max(1, num_cpus)
+
+
+def available_memory() -> Optional[int]:
+    r'''
+    Returns the memory (in bytes) the process may still allocate: the available system memory, capped by what is left
+    below the cgroup memory limit. Returns ``None`` if it is unknown on this platform.
+    '''
+    candidates = [_meminfo_available(), _cgroup_memory_available()]
+    candidates = [memory for memory in candidates if memory is not None]
+    if not candidates and hasattr(os, 'sysconf'):
+        try:
+            candidates.append(os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE'))
+        except (ValueError, OSError):
+            pass
+    return min(candidates) if candidates else None
+
+
+def _cgroup_cpu_quota() -> Optional[float]:
+    # The quota of a cgroup is capped by the ones of its ancestors.
+    quotas = []
+    if _is_cgroup_v2():
+        for directory in _cgroup_directories(None):
+            # cgroup v2: "<quota> <period>" or "max <period>".
+            quota, _, period = (_read_text(directory / 'cpu.max') or '').partition(' ')
+            if quota.isdigit() and period.isdigit() and int(period) > 0:
+                quotas.append(int(quota) / int(period))
+    else:
+        for directory in _cgroup_directories(('cpu', 'cpu,cpuacct')):
+            # cgroup v1: a quota of -1 means no limit.
+            quota = _read_int(directory / 'cpu.cfs_quota_us')
+            period = _read_int(directory / 'cpu.cfs_period_us')
+            if quota is not None and quota > 0 and period:
+                quotas.append(quota / period)
+    return min(quotas) if quotas else None
+
+
+def _cgroup_memory_available() -> Optional[int]:
+    # What is left below the limit of the cgroup and of each of its ancestors.
+    available = []
+    if _is_cgroup_v2():
+        files = [(directory / 'memory.max', directory / 'memory.current') for directory in _cgroup_directories(None)]
+    else:
+        files = [(directory / 'memory.limit_in_bytes', directory / 'memory.usage_in_bytes')
+                 for directory in _cgroup_directories(('memory',))]
+    for limit_file, usage_file in files:
+        limit = _read_int(limit_file)
+        if limit is None or limit >= _CGROUP_V1_UNLIMITED:
+            continue
+        available.append(max(0, limit - (_read_int(usage_file) or 0)))
+    return min(available) if available else None
+
+
+def _is_cgroup_v2() -> bool:
+    # The unified hierarchy is mounted at the root, rather than one hierarchy per controller.
+    return (CGROUP_ROOT / 'cgroup.controllers').exists()
+
+
+def _cgroup_directories(v1_controllers: Optional[Sequence[str]]) -> List[Path]:
+    r'''
+    Returns the directories of the cgroup of the process and of its ancestors, the deepest first, in the cgroup v2
+    hierarchy or, if ``v1_controllers`` are given, in the cgroup v1 hierarchy of these controllers. The last one is the
+    root of the hierarchy, which is the cgroup of the process itself when it has a cgroup namespace (e.g. most
+    containers). Without one (cgroup v1 hosts, ``docker --cgroupns=host``...) the limits are in the cgroup named by
+    ``/proc/self/cgroup``.
+    '''
+    roots = [CGROUP_ROOT] if v1_controllers is None else [CGROUP_ROOT / controller for controller in v1_controllers]
+    directories = []
+    for line in (_read_text(PROC_SELF_CGROUP) or '').splitlines():
+        # "<id>:<controllers>:<path>", the controllers are empty for cgroup v2.
+        fields = line.split(':', 2)
+        if len(fields) != 3:
+            continue
+        _, controllers, path = fields
+        if v1_controllers is None and controllers == '':
+            root = CGROUP_ROOT
+        elif v1_controllers is not None and set(controllers.split(',')) & set(v1_controllers):
+            # The hierarchy is mounted in a directory named after its controllers, e.g. "cpu,cpuacct".
+            root = next((root for root in [CGROUP_ROOT / controllers] + roots if root.is_dir()), roots[0])
+            roots = [root]
+        else:
+            continue
+        relative = Path(path.lstrip('/'))
+        directories += [root / parent for parent in [relative] + list(relative.parents) if parent != Path('.')]
+    root = next((root for root in roots if root.is_dir()), roots[0])
+    return [directory for directory in directories if directory.is_dir()] + [root]
+
+
+def _meminfo_available() -> Optional[int]:
+    meminfo = _read_text(Path('/proc/meminfo'))
+    if meminfo is None:
+        return None
+    for line in meminfo.splitlines():
+        if line.startswith('MemAvailable:'):
+            # "MemAvailable:   12345678 kB"
+            return int(line.split()[1]) * 1024
+    return None
+
+
+def _read_int(path: Path) -> Optional[int]:
+    text = _read_text(path)
+    try:
+        return int(text) if text is not None else None
+    except ValueError:
+        # e.g. "max" in cgroup v2
+        return None
+
+
+def _read_text(path: Path) -> Optional[str]:
+    try:
+        return path.read_text().strip()
+    except OSError:
+        return None
@@ -0,0 +1,163 @@
+import os
+import shlex
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from typing import Callable, Collection, List, Optional
+
+from .extension import get_cuda_home
+from .incremental import is_up_to_date, record_command
+from .ninja_build import _get_cuda_pool_depth, _get_num_workers, _nvcc_generates_dependencies
+from .nvcc_profile import NVCC_TIME_SUFFIX
+from .progress import ProgressCallback, edge_finished, edge_started
+from .toolchain import probe_toolchain
+from .utils import SUBPROCESS_DECODE_ARGS, _is_cuda_file, _write_if_changed
+
+
+def _compile_objects_with_scheduler(
+        sources: List[str],
+        objects,
+        cflags,
+        post_cflags,
+        cuda_cflags,
+        cuda_post_cflags,
+        cuda_dlink_post_cflags,
+        build_directory: Path,
+        verbose: bool,
+        with_cuda: Optional[bool],
+        launcher: Optional[List[str]] = None,
+        cuda_time_profile: bool = False,
+        precompiled_header: Optional[str] = None,
+        depends: Optional[List[str]] = None,
+        force: bool = False,
+        progress: Optional[ProgressCallback] = None) -> None:
+    r"""
+    Compiles the objects on a pool of workers, without ninja.
+
+    Takes the same (shell quoted) flags as :func:`_write_ninja_file_and_compile_objects` and runs the same commands
+    as the ``compile``, ``cuda_compile`` and ``cuda_devlink`` ninja rules would, so losing ninja does not mean a
+    serial build. Unless ``force`` is set, the objects compiled by the same command and newer than their source, their
+    headers and the ``depends`` files are not compiled again. The ``progress`` callback gets the progress events of
+    the commands.
+    """
+    if with_cuda is None:
+        with_cuda = any(map(_is_cuda_file, sources))
+    assert len(sources) == len(objects)
+    assert len(sources) > 0
+
+    launcher = ' '.join(launcher or [])
+    cxx = os.environ.get('CXX', 'c++')
+    cflags, post_cflags = ' '.join(cflags or []), ' '.join(post_cflags or [])
+    if with_cuda:
+        nvcc = str(get_cuda_home() / 'bin' / 'nvcc')
+        cuda_cflags, cuda_post_cflags = ' '.join(cuda_cflags or []), ' '.join(cuda_post_cflags or [])
+        nvcc_gendeps = ' --generate-dependencies-with-compile --dependency-output {obj}.d' \
+            if _nvcc_generates_dependencies() else ''
+        if cuda_time_profile:
+            nvcc_gendeps += f' --time {{obj}}{NVCC_TIME_SUFFIX}'
+
+    if precompiled_header is not None:
+        # Same wrapper and output as the pch rule of the ninja files.
+        pch_wrapper = build_directory.absolute() / 'pch' / Path(precompiled_header).name
+        _write_if_changed(pch_wrapper, f'#include "{Path(precompiled_header).absolute().as_posix()}"\n')
+        pch_output = str(pch_wrapper) + ('.pch' if 'clang' in (probe_toolchain().cxx_version or '') else '.gch')
+        pch_command = f'{cxx} -x c++-header -MMD -MF {shlex.quote(pch_output)}.d {cflags} ' \
+                      f'-c {shlex.quote(str(pch_wrapper))} -o {shlex.quote(pch_output)} {post_cflags}'
+        if force or not is_up_to_date(pch_output, pch_command):
+            _run_commands([pch_command], build_directory, 1, verbose,
+                          error_prefix='Error precompiling the header for extension',
+                          on_success=lambda command: record_command(pch_output, command), progress=progress)
+        cflags += f' -include {shlex.quote(str(pch_wrapper))}'
+
+    depends = depends or []
+    if precompiled_header is not None:
+        depends = depends + [pch_output]
+    commands, cuda_commands, command_objects = [], set(), {}
+    for source_file, object_file in zip(sources, objects):
+        source_file = str(Path(source_file).absolute())
+        if with_cuda and _is_cuda_file(source_file):
+            command = f'{launcher} {nvcc}{nvcc_gendeps} {cuda_cflags} -c {{src}} -o {{obj}} {cuda_post_cflags}'
+        else:
+            command = f'{launcher} {cxx} -MMD -MF {{obj}}.d {cflags} -c {{src}} -o {{obj}} {post_cflags}'
+        command = command.format(src=shlex.quote(source_file), obj=shlex.quote(object_file)).strip()
+        if not force and is_up_to_date(object_file, command, depends):
+            continue
+        commands.append(command)
+        command_objects[command] = object_file
+        if with_cuda and _is_cuda_file(source_file):
+            cuda_commands.add(command)
+
+    num_workers = _get_num_workers(verbose)
+    if verbose:
+        print(f'Compiling objects with {num_workers} workers...', file=sys.stderr)
+    # Like the cuda_pool of the ninja files.
+    cuda_pool_depth = _get_cuda_pool_depth(cuda_post_cflags.split()) if with_cuda else None
+    _run_commands(commands, build_directory, num_workers, verbose,
+                  error_prefix='Error compiling objects for extension',
+                  pooled_commands=cuda_commands, pool_depth=cuda_pool_depth,
+                  on_success=lambda command: record_command(command_objects[command], command), progress=progress)
+
+    device_objects = [obj for source, obj in zip(sources, objects) if _is_cuda_file(source)] if with_cuda else []
+    if cuda_dlink_post_cflags and device_objects:
+        devlink_out = str(Path(objects[0]).parent / 'dlink.o')
+        quoted_objects = ' '.join(map(shlex.quote, device_objects))
+        devlink_command = f'{nvcc} {quoted_objects} -o {shlex.quote(devlink_out)} {" ".join(cuda_dlink_post_cflags)}'
+        # The device objects are the depfile-less dependencies of the device link.
+        if force or not is_up_to_date(devlink_out, devlink_command, device_objects, depfile=False):
+            _run_commands([devlink_command], build_directory, 1, verbose,
+                          error_prefix='Error device linking objects for extension',
+                          on_success=lambda command: record_command(devlink_out, command), progress=progress)
+        objects += [devlink_out]
+
+
+def _run_commands(commands: List[str], build_directory: Path, num_workers: int, verbose: bool,
+                  error_prefix: str, pooled_commands: Collection[str] = (), pool_depth: Optional[int] = None,
+                  on_success: Optional[Callable[[str], None]] = None,
+                  progress: Optional[ProgressCallback] = None) -> None:
+    r"""
+    Runs ``commands`` on ``num_workers`` workers, with at most ``pool_depth`` of the ``pooled_commands`` at a time.
+    ``on_success`` is called with every command that succeeded, and ``progress`` with the progress events.
+    """
+    pool = threading.BoundedSemaphore(pool_depth) if pool_depth is not None else None
+    started = iter(range(1, len(commands) + 1))
+    durations = {}
+
+    def run_command(command):
+        if progress is not None:
+            progress(edge_started(next(started), len(commands), command))
+        start = time.perf_counter()
+        result = subprocess.run(command, shell=True, cwd=str(build_directory),
+                                stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        durations[command] = time.perf_counter() - start
+        return result
+
+    def run(command):
+        if pool is not None and command in pooled_commands:
+            with pool:
+                return run_command(command)
+        return run_command(command)
+
+    sys.stdout.flush()
+    sys.stderr.flush()
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        futures = {executor.submit(run, command): command for command in commands}
+        for finished, future in enumerate(as_completed(futures), 1):
+            result = future.result()
+            output = result.stdout.decode(*SUBPROCESS_DECODE_ARGS)
+            if progress is not None:
+                progress(edge_finished(finished, len(commands), futures[future], result.returncode,
+                                       durations[futures[future]], output))
+            if verbose:
+                # Print whole commands with their output, like ninja, so the parallel jobs do not interleave.
+                print(f'[{finished}/{len(commands)}] {futures[future]}', flush=True)
+                if output:
+                    print(output, end='', flush=True)
+            if result.returncode != 0:
+                for pending in futures:
+                    pending.cancel()
+                raise RuntimeError(f'{error_prefix}: {futures[future]}\n{output}')
+            if on_success is not None:
+                on_success(futures[future])
@@ -0,0 +1,183 @@
+r"""
+Probe of the build tools (ninja, nvcc and its GPU architectures, the host compiler, the fast linkers it can use and,
+on Windows, MSVC).
+
+The version probes run concurrently, once per process, and their result is cached on disk keyed by the environment
+and the binaries (path, size and modification time), so repeated builds in the same environment spawn no process.
+"""
+import functools
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import List, NamedTuple, Optional, Tuple
+
+from .find_cuda import get_cuda_version
+from .utils import IS_WINDOWS, SUBPROCESS_DECODE_ARGS
+
+# Environment variables that change which tools are used.
+PROBE_ENVIRONMENT = ('PATH', 'CUDA_HOME', 'CUDA_PATH', 'CXX', 'CC')
+# Number of environments kept in the cache file.
+MAX_CACHED_PROBES = 16
+# Linkers preferred to the default one (`-fuse-ld=<name>`), with their binary.
+FAST_LINKERS = (('mold', 'mold'), ('lld', 'ld.lld'))
+
+
+class Toolchain(NamedTuple):
+    ninja: Optional[str]
+    ninja_version: Optional[str]
+    nvcc: Optional[str]
+    cuda_version: Optional[Tuple[int, int]]
+    # Virtual architectures nvcc can compile for, e.g. ``('compute_80', 'compute_86')``.
+    gpu_archs: Optional[Tuple[str, ...]]
+    cxx: Optional[str]
+    cxx_version: Optional[str]
+    cl: Optional[str]
+    # First of FAST_LINKERS the host compiler links with.
+    fast_linker: Optional[str]
+
+
+def toolchain_cache_file() -> Path:
+    cache_home = os.environ.get('XDG_CACHE_HOME') or Path.home() / '.cache'
+    return Path(cache_home) / 'setuptools_cuda_cpp' / 'toolchain.json'
+
+
+@functools.lru_cache()
+def probe_toolchain() -> Toolchain:
+    r'''
+    Returns the build tools found in the current environment, with their versions. The result is memoized in the
+    process and cached in :func:`toolchain_cache_file`.
+    '''
+    binaries = _find_binaries()
+    key = _probe_key(binaries)
+    cache_file = toolchain_cache_file()
+    cached_probes = _read_cached_probes(cache_file)
+    cached = cached_probes.get(key)
+    if cached is not None and set(cached) == set(Toolchain._fields):
+        return Toolchain(**{field: tuple(value) if isinstance(value, list) else value
+                            for field, value in cached.items()})
+
+    ninja, nvcc, cxx, cl, *linkers = binaries
+    with ThreadPoolExecutor(max_workers=5) as executor:
+        ninja_version = executor.submit(_version, ninja, ['--version'])
+        cuda_version = executor.submit(get_cuda_version, Path(nvcc).parent.parent) if nvcc is not None else None
+        gpu_archs = executor.submit(_gpu_archs, nvcc)
+        cxx_version = executor.submit(_version, cxx, ['--version'] if not IS_WINDOWS else [])
+        fast_linker = executor.submit(_fast_linker, cxx, linkers)
+        toolchain = Toolchain(
+            ninja=ninja if ninja_version.result() is not None else None,
+            ninja_version=ninja_version.result(),
+            nvcc=nvcc,
+            cuda_version=cuda_version.result() if cuda_version is not None else None,
+            gpu_archs=gpu_archs.result(),
+            cxx=cxx,
+            cxx_version=cxx_version.result(),
+            cl=cl,
+            fast_linker=fast_linker.result())
+
+    cached_probes[key] = toolchain._asdict()
+    _write_cached_probes(cache_file, cached_probes)
+    return toolchain
+
+
+@functools.lru_cache()
+def host_lto_supported() -> bool:
+    r'''Returns ``True`` if the host compiler can compile and link a shared library with ``-flto``.'''
+    return _links_shared_library(probe_toolchain().cxx, ['-flto'])
+
+
+def _find_binaries() -> Tuple[Optional[str], ...]:
+    # Only looks for files, without spawning anything.
+    from .extension import get_cuda_home
+    try:
+        nvcc = get_cuda_home() / 'bin' / ('nvcc.exe' if IS_WINDOWS else 'nvcc')
+        nvcc = str(nvcc) if nvcc.exists() else None
+    except EnvironmentError:
+        nvcc = None
+    cxx = os.environ.get('CXX', 'cl' if IS_WINDOWS else 'c++')
+    linkers = [shutil.which(binary) for _, binary in FAST_LINKERS]
+    return (shutil.which('ninja'), nvcc, shutil.which(cxx) or cxx, shutil.which('cl') if IS_WINDOWS else None,
+            *linkers)
+
+
+def _probe_key(binaries) -> str:
+    key = hashlib.sha256()
+    for variable in PROBE_ENVIRONMENT:
+        key.update(f'{variable}={os.environ.get(variable)}\0'.encode())
+    for binary in binaries:
+        try:
+            stat = os.stat(binary)
+            key.update(f'{binary}:{stat.st_size}:{stat.st_mtime_ns}\0'.encode())
+        except (OSError, TypeError):
+            key.update(f'{binary}\0'.encode())
+    return key.hexdigest()
+
+
+def _version(binary: Optional[str], args) -> Optional[str]:
+    if binary is None:
+        return None
+    try:
+        output = subprocess.check_output([binary] + args, stderr=subprocess.STDOUT)
+    except Exception:
+        return None
+    lines = output.decode(*SUBPROCESS_DECODE_ARGS).strip().splitlines()
+    return lines[0].strip() if lines else ''
+
+
+def _fast_linker(cxx: Optional[str], linkers: List[Optional[str]]) -> Optional[str]:
+    # The compiler must also know the linker, e.g. gcc supports -fuse-ld=mold since 12.1.
+    for (name, _), linker in zip(FAST_LINKERS, linkers):
+        if linker is not None and _links_shared_library(cxx, [f'-fuse-ld={name}']):
+            return name
+    return None
+
+
+def _links_shared_library(cxx: Optional[str], flags: List[str]) -> bool:
+    if cxx is None or IS_WINDOWS:
+        return False
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        source = Path(tmp_dir) / 'probe.cpp'
+        source.write_text('int probe(int x) { return x + 1; }\n')
+        command = [cxx] + flags + ['-fPIC', '-shared', str(source), '-o', str(Path(tmp_dir) / 'probe.so')]
+        try:
+            subprocess.check_output(command, stderr=subprocess.STDOUT)
+        except Exception:
+            return False
+    return True
+
+
+def _gpu_archs(nvcc: Optional[str]) -> Optional[Tuple[str, ...]]:
+    # --list-gpu-arch is available since CUDA 11.0.
+    if nvcc is None:
+        return None
+    try:
+        output = subprocess.check_output([nvcc, '--list-gpu-arch'], stderr=subprocess.DEVNULL)
+    except Exception:
+        return None
+    return tuple(line.strip() for line in output.decode(*SUBPROCESS_DECODE_ARGS).splitlines()
+                 if line.strip().startswith('compute_'))
+
+
+def _read_cached_probes(cache_file: Path) -> dict:
+    try:
+        return json.loads(cache_file.read_text())
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_cached_probes(cache_file: Path, cached_probes: dict) -> None:
+    # Keep the most recent probes only, dicts preserve the insertion order.
+    cached_probes = dict(list(cached_probes.items())[-MAX_CACHED_PROBES:])
+    try:
+        cache_file.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=str(cache_file.parent))
+        with os.fdopen(fd, 'w') as tmp_file:
+            json.dump(cached_probes, tmp_file)
+        os.replace(tmp_path, str(cache_file))
+    except OSError:
+        # The cache is an optimization only, e.g. the home directory may be read-only.
+        pass
@@ -0,0 +1,67 @@
+r"""
+Unity (jumbo) builds: the sources of an extension are compiled in batches, every batch being a generated source that
+includes them, so the headers they share are parsed once per batch instead of once per source.
+"""
+from fnmatch import fnmatch
+from pathlib import Path
+from typing import Iterable, List, Tuple
+
+from .utils import _write_if_changed
+
+DEFAULT_UNITY_BATCH_SIZE = 8
+
+_HOST_SUFFIXES = ('.cpp', '.cc', '.cxx', '.c++')
+_CUDA_SUFFIXES = ('.cu',)
+
+
+def unity_sources(sources: List[str], objects: List[str], batch_size: int, exclude: Iterable[str], directory: Path,
+                  obj_extension: str) -> Tuple[List[str], List[str]]:
+    r'''
+    Returns the sources and objects to compile in place of ``sources`` and their ``objects``.
+
+    The C++ and the CUDA sources are grouped separately, in their order, into batches of ``batch_size`` written to
+    ``directory`` (only when their content changes, so the unchanged batches stay up to date). The sources matching a
+    pattern of ``exclude`` (a path or a glob on the path or on the file name), the other languages and the batches of
+    a single source are compiled on their own.
+    '''
+    exclude = list(exclude)
+    batched = {'host': [], 'cuda': []}
+    unity_sources, unity_objects = [], []
+    for source, obj in zip(sources, objects):
+        kind = _unity_kind(source)
+        if kind is None or _is_excluded(source, exclude):
+            unity_sources.append(source)
+            unity_objects.append(obj)
+        else:
+            batched[kind].append((source, obj))
+
+    for kind, suffix in (('host', '.cpp'), ('cuda', '.cu')):
+        kind_sources = batched[kind]
+        for index, start in enumerate(range(0, len(kind_sources), batch_size)):
+            batch = kind_sources[start:start + batch_size]
+            if len(batch) == 1:
+                unity_sources.append(batch[0][0])
+                unity_objects.append(batch[0][1])
+                continue
+            batch_source = directory / f'unity_{kind}_{index}{suffix}'
+            lines = ['// Generated by setuptools_cuda_cpp for a unity build, do not edit.']
+            lines += [f'#include "{Path(source).absolute().as_posix()}"' for source, _ in batch]
+            _write_if_changed(batch_source, '\n'.join(lines) + '\n')
+            unity_sources.append(str(batch_source))
+            unity_objects.append(str(batch_source.with_suffix(obj_extension)))
+    return unity_sources, unity_objects
+
+
+def _unity_kind(source: str):
+    suffix = Path(source).suffix
+    if suffix in _HOST_SUFFIXES:
+        return 'host'
+    if suffix in _CUDA_SUFFIXES:
+        return 'cuda'
+    return None
+
+
+def _is_excluded(source: str, exclude: List[str]) -> bool:
+    path = Path(source)
+    return any(fnmatch(path.as_posix(), pattern) or fnmatch(path.name, pattern)
+               or path.absolute() == Path(pattern).absolute() for pattern in exclude)
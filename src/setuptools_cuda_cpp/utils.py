@@ -21,3 +21,11 @@ def _is_cuda_file(path: str) -> bool:
         '.cuh',
     ]
     return Path(path).suffix in valid_ext
+
+
+def _write_if_changed(path: Path, content: str) -> None:
+    # Keeps the modification time of an unchanged generated file, so the build tools do not see it as out of date.
+    if path.exists() and path.read_text() == content:
+        return
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(content)
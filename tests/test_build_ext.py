@@ -0,0 +1,302 @@
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+import warnings
+from pathlib import Path
+from unittest import mock
+
+from setuptools import Distribution
+
+from setuptools_cuda_cpp import BuildExtension, CppExtension, CUDAExtension, build_ext, extension, toolchain
+from setuptools_cuda_cpp.fatbin import elf_sections
+from setuptools_cuda_cpp.ninja_build import is_ninja_available
+from setuptools_cuda_cpp.object_cache import ObjectCache
+from setuptools_cuda_cpp.toolchain import Toolchain
+
+MODULE_SOURCE = r'''
+#include <Python.h>
+
+int helper();
+
+static PyModuleDef module = {{PyModuleDef_HEAD_INIT, "{name}", nullptr, -1, nullptr}};
+PyMODINIT_FUNC PyInit_{name}() {{ return PyModule_Create(&module); }}
+'''
+
+
+@unittest.skipUnless(shutil.which('c++') and is_ninja_available(), 'needs a host compiler and ninja')
+class TestNinjaBuildExtension(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = Path(directory.name)
+        self.build_temp = self.directory / 'build_temp'
+        self.build_lib = self.directory / 'build_lib'
+        # An object not built by the ninja file, linked into the extensions.
+        helper = self.directory / 'helper.cpp'
+        helper.write_text('int helper() { return 1; }\n')
+        self.helper_object = str(self.directory / 'helper.o')
+        subprocess.check_call(['c++', '-fPIC', '-c', str(helper), '-o', self.helper_object])
+
+    def extension(self, name, sources=(), **kwargs):
+        source = self.directory / f'{name}.cpp'
+        if not source.exists():
+            source.write_text(MODULE_SOURCE.format(name=name))
+        return CppExtension(name, [source, *sources], extra_objects=[self.helper_object], **kwargs)
+
+    def build(self, extensions, force=False, **options):
+        options.setdefault('linker', False)
+        distribution = Distribution({'name': 'test', 'ext_modules': extensions,
+                                     'cmdclass': {'build_ext': BuildExtension.with_options(use_ninja=True, **options)}})
+        distribution.verbose = 0
+        command = distribution.get_command_obj('build_ext')
+        command.build_temp = str(self.build_temp)
+        command.build_lib = str(self.build_lib)
+        command.force = force
+        command.ensure_finalized()
+        command.run()
+        return [Path(command.get_ext_fullpath(extension.name)) for extension in extensions]
+
+    def ninja_dry_run(self, build_directory):
+        return subprocess.check_output(['ninja', '-n', '-C', str(build_directory)], universal_newlines=True)
+
+    def test_link_edge(self):
+        library, = self.build([self.extension('linked', extra_link_args=['-Wl,-O1'])])
+        graph = (self.build_temp / 'linked' / 'build.ninja').read_text().splitlines()
+        # The link command distutils assembled runs with its own linker.
+        linker = next(line for line in graph if line.startswith('ld = '))[len('ld = '):]
+        self.assertIsNotNone(shutil.which(linker))
+        self.assertIn('  command = $ld $in $ldflags -o $out', graph)
+        # The compiled objects and the extra objects are the inputs of the link, the rest of its command the flags.
+        object_file, = [line.split()[1][:-1] for line in graph if line.startswith('build ') and ': compile ' in line]
+        self.assertIn(f'build {library}: link {object_file} {self.helper_object}', graph)
+        ldflags = next(line for line in graph if line.startswith('ldflags = ')).split()[2:]
+        self.assertIn('-shared', ldflags)
+        self.assertIn('-Wl,-O1', ldflags)
+        self.assertNotIn(self.helper_object, ldflags)
+        self.assertIn(f'default {library}', graph)
+        self.assertTrue(library.exists())
+
+        # Nothing changed: the second build does not link again.
+        mtime = library.stat().st_mtime_ns
+        self.build([self.extension('linked', extra_link_args=['-Wl,-O1'])])
+        self.assertEqual(library.stat().st_mtime_ns, mtime)
+        self.assertIn('no work to do', self.ninja_dry_run(self.build_temp / 'linked'))
+
+    def test_build_directory_per_extension(self):
+        common = self.directory / 'common.cpp'
+        common.write_text('int common() { return 2; }\n')
+
+        def extensions():
+            return [self.extension('first', [common]), self.extension('second', [common])]
+
+        libraries = self.build(extensions())
+        build_directories = [self.build_temp / 'first', self.build_temp / 'second']
+        for build_directory in build_directories:
+            # Each extension has its own ninja file and ninja state, and its own object of the shared source.
+            self.assertTrue((build_directory / 'build.ninja').exists())
+            self.assertTrue((build_directory / '.ninja_deps').exists())
+            self.assertEqual(len(list(build_directory.rglob('common.o'))), 1)
+        self.assertFalse((self.build_temp / 'build.ninja').exists())
+
+        # The second build is a no-op for ninja, the first extension is not rebuilt for the second one.
+        ninja_logs = [(build_directory / '.ninja_log').read_text() for build_directory in build_directories]
+        mtimes = [library.stat().st_mtime_ns for library in libraries]
+        self.build(extensions())
+        self.assertEqual([(build_directory / '.ninja_log').read_text() for build_directory in build_directories],
+                         ninja_logs)
+        self.assertEqual([library.stat().st_mtime_ns for library in libraries], mtimes)
+        for build_directory in build_directories:
+            self.assertIn('no work to do', self.ninja_dry_run(build_directory))
+
+        # --force rebuilds everything.
+        self.build(extensions(), force=True)
+        self.assertTrue(all(library.stat().st_mtime_ns > mtime for library, mtime in zip(libraries, mtimes)))
+
+    def test_precompiled_header(self):
+        header = self.directory / 'common.h'
+        header.write_text('#define VALUE 1\n')
+        library, = self.build([self.extension('pch', precompiled_header=header)])
+        pch_output = self.build_temp / 'pch' / 'pch' / 'common.h.gch'
+        self.assertTrue(pch_output.exists())
+        self.assertIn('no work to do', self.ninja_dry_run(self.build_temp / 'pch'))
+
+        # Editing the header precompiles it again, then compiles the sources using it and links them.
+        header.write_text('#define VALUE 2\n')
+        mtime = header.stat().st_mtime + 10
+        os.utime(str(header), (mtime, mtime))
+        commands = [line for line in self.ninja_dry_run(self.build_temp / 'pch').splitlines() if line.startswith('[')]
+        self.assertEqual(len(commands), 3)
+        self.assertIn('-x c++-header', commands[0])
+        self.assertIn(f'-include {pch_output.parent / "common.h"}', commands[1])
+        self.assertIn(f'-o {library}', commands[2])
+
+
+class TestBuildFlags(unittest.TestCase):
+    def setUp(self):
+        self.toolchain = Toolchain(*[None] * len(Toolchain._fields))._replace(cuda_version=(12, 2))
+        for patcher in (mock.patch.object(build_ext, 'probe_toolchain', side_effect=lambda: self.toolchain),
+                        mock.patch.object(build_ext, 'host_lto_supported', return_value=True),
+                        mock.patch.object(extension, 'get_cuda_home', return_value=Path('/usr/local/cuda'))):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def command(self, extensions=(), **options):
+        command = BuildExtension(Distribution({'ext_modules': list(extensions)}), **options)
+        command.extensions = list(extensions)
+        command.compiler = mock.Mock(compiler_type='unix')
+        return command
+
+    def test_lto_support(self):
+        cuda_extension = CUDAExtension('ext', ['ext.cu'])
+        command = self.command([cuda_extension], lto=True)
+        command._check_lto_support()
+        self.assertEqual((command._host_lto, command._device_lto), (True, True))
+
+        # nvcc supports -dlto since CUDA 11.2, the host LTO does not depend on it.
+        self.toolchain = self.toolchain._replace(cuda_version=(11, 1))
+        build_ext.host_lto_supported.return_value = False
+        command = self.command([cuda_extension], lto=True)
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            command._check_lto_support()
+        self.assertEqual((command._host_lto, command._device_lto), (False, False))
+        self.assertEqual(len(caught), 2)
+
+    def test_lto_flags(self):
+        command = self.command(lto=True)
+        command._host_lto = command._device_lto = True
+        cpp_extension = CppExtension('cpp_ext', ['ext.cpp'], extra_compile_args=['-O2'])
+        command._add_lto_flags(cpp_extension)
+        # The host objects and the link get -flto, there is no device code.
+        self.assertEqual(cpp_extension.extra_compile_args, {'cxx': ['-O2', '-flto'], 'nvcc': ['-O2']})
+        self.assertEqual(cpp_extension.extra_link_args, ['-flto'])
+
+        cuda_extension = CUDAExtension('cuda_ext', ['ext.cpp', 'ext.cu'],
+                                       extra_compile_args={'cxx': ['-O2'], 'nvcc': ['-rdc=true']})
+        command._add_lto_flags(cuda_extension)
+        extension._add_cuda_paths(cuda_extension)
+        extra_compile_args = cuda_extension.extra_compile_args
+        self.assertEqual(extra_compile_args['cxx'], ['-O2', '-flto'])
+        # The CUDA objects are compiled with -dlto and relocatable device code, and device linked with -dlto.
+        self.assertEqual(extra_compile_args['nvcc'], ['-rdc=true', '-dlto'])
+        self.assertEqual(extra_compile_args['nvcc_dlink'][:2], ['-dlto', '-dlink'])
+        self.assertIn('-L/usr/local/cuda/lib64', extra_compile_args['nvcc_dlink'])
+        self.assertEqual(cuda_extension.extra_link_args, ['-flto'])
+
+        # Adding them again changes nothing.
+        command._add_lto_flags(cuda_extension)
+        self.assertEqual(cuda_extension.extra_compile_args, extra_compile_args)
+        self.assertEqual(cuda_extension.extra_link_args, ['-flto'])
+
+    def test_device_lto_only(self):
+        command = self.command(lto=True)
+        command._device_lto = True
+        cuda_extension = CUDAExtension('cuda_ext', ['ext.cu'], extra_compile_args={'cxx': [], 'nvcc': ['-dc']})
+        command._add_lto_flags(cuda_extension)
+        self.assertEqual(cuda_extension.extra_compile_args['cxx'], [])
+        self.assertEqual(cuda_extension.extra_compile_args['nvcc'], ['-dc', '-dlto'])
+        self.assertEqual(cuda_extension.extra_link_args, [])
+
+    def test_linker_flags(self):
+        cpp_extension = CppExtension('ext', ['ext.cpp'])
+        self.command(linker='auto')._add_linker_flags(cpp_extension)
+        # Neither mold nor lld.
+        self.assertEqual(cpp_extension.extra_link_args, [])
+
+        self.toolchain = self.toolchain._replace(fast_linker='mold')
+        self.command(linker='auto')._add_linker_flags(cpp_extension)
+        self.assertEqual(cpp_extension.extra_link_args, ['-fuse-ld=mold'])
+        # Only once, and never over the linker of the extension.
+        self.command(linker='auto')._add_linker_flags(cpp_extension)
+        self.command(linker='gold')._add_linker_flags(cpp_extension)
+        self.assertEqual(cpp_extension.extra_link_args, ['-fuse-ld=mold'])
+
+        cpp_extension = CppExtension('ext', ['ext.cpp'])
+        self.command(linker='gold')._add_linker_flags(cpp_extension)
+        self.assertEqual(cpp_extension.extra_link_args, ['-fuse-ld=gold'])
+
+    def test_fast_linker(self):
+        linkers = ['/usr/bin/mold', '/usr/bin/ld.lld']
+        with mock.patch.object(toolchain, '_links_shared_library', return_value=True) as links_shared_library:
+            self.assertEqual(toolchain._fast_linker('c++', linkers), 'mold')
+            links_shared_library.assert_called_once_with('c++', ['-fuse-ld=mold'])
+            self.assertEqual(toolchain._fast_linker('c++', [None, linkers[1]]), 'lld')
+            self.assertIsNone(toolchain._fast_linker('c++', [None, None]))
+        # The compiler must support the linker too, e.g. -fuse-ld=mold needs gcc 12.1.
+        with mock.patch.object(toolchain, '_links_shared_library', side_effect=lambda cxx, flags: 'lld' in flags[0]):
+            self.assertEqual(toolchain._fast_linker('c++', linkers), 'lld')
+        with mock.patch.object(toolchain, '_links_shared_library', return_value=False):
+            self.assertIsNone(toolchain._fast_linker('c++', linkers))
+
+    def test_split_debug_info_flags(self):
+        cuda_extension = CUDAExtension('ext', ['ext.cpp', 'ext.cu'], extra_compile_args=['-g'],
+                                       extra_link_args=['-fuse-ld=lld'])
+        command = self.command(split_debug_info=True)
+        command._add_split_debug_info_flags(cuda_extension)
+        command._add_split_debug_info_flags(cuda_extension)
+        # Only the host compiles, nvcc does not know the flag.
+        self.assertEqual(cuda_extension.extra_compile_args, {'cxx': ['-g', '-gsplit-dwarf'], 'nvcc': ['-g']})
+        self.assertEqual(cuda_extension.extra_link_args, ['-fuse-ld=lld', '-Wl,--gdb-index'])
+        # GNU ld does not write the index.
+        cpp_extension = CppExtension('ext', ['ext.cpp'])
+        command._add_split_debug_info_flags(cpp_extension)
+        self.assertEqual(cpp_extension.extra_link_args, [])
+
+        # The .dwo files are not cached, the objects with -gsplit-dwarf bypass the object cache.
+        with tempfile.TemporaryDirectory() as directory:
+            cache = ObjectCache(Path(directory) / 'cache', stats_file=Path(directory) / 'stats')
+            spawned = []
+            cache.compile(['c++', *cuda_extension.extra_compile_args['cxx'], '-c', 'ext.cpp', '-o', 'ext.o'],
+                          spawned.append)
+            self.assertEqual(spawned, [['c++', '-g', '-gsplit-dwarf', '-c', 'ext.cpp', '-o', 'ext.o']])
+            self.assertEqual(cache.read_stats(), (0, 0))
+
+    def test_separate_debug_file_commands(self):
+        with tempfile.TemporaryDirectory() as directory:
+            library = Path(directory) / 'ext.so'
+            library.write_bytes(b'')
+            debug_file = Path(directory) / 'ext.so.debug'
+            commands = []
+
+            def check_call(command):
+                commands.append(command)
+                if '--only-keep-debug' in command:
+                    debug_file.write_bytes(b'')
+
+            with mock.patch.object(build_ext.shutil, 'which', return_value='/usr/bin/objcopy'), \
+                    mock.patch.object(build_ext.subprocess, 'check_call', side_effect=check_call):
+                build_ext._separate_debug_file(library)
+                self.assertEqual(commands, [
+                    ['/usr/bin/objcopy', '--only-keep-debug', str(library), str(debug_file)],
+                    ['/usr/bin/objcopy', '--strip-debug', f'--add-gnu-debuglink={debug_file}', str(library)],
+                ])
+                # Nothing to do until the library is linked again.
+                build_ext._separate_debug_file(library)
+                self.assertEqual(len(commands), 2)
+
+            with mock.patch.object(build_ext.shutil, 'which', return_value=None), \
+                    warnings.catch_warnings(record=True) as caught:
+                warnings.simplefilter('always')
+                os.utime(str(debug_file), (0, 0))
+                build_ext._separate_debug_file(library)
+            self.assertIn('objcopy was not found', str(caught[0].message))
+
+    @unittest.skipUnless(shutil.which('c++') and shutil.which('objcopy'), 'needs a host compiler and objcopy')
+    def test_separate_debug_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            source = Path(directory) / 'ext.cpp'
+            source.write_text('int f(int x) { return x + 1; }\n')
+            library = Path(directory) / 'ext.so'
+            subprocess.check_call(['c++', '-g', '-shared', '-fPIC', str(source), '-o', str(library)])
+            build_ext._separate_debug_file(library)
+            library_sections = [name for name, _ in elf_sections(library.read_bytes())]
+            debug_sections = [name for name, _ in elf_sections(Path(directory, 'ext.so.debug').read_bytes())]
+        self.assertIn('.gnu_debuglink', library_sections)
+        self.assertNotIn('.debug_info', library_sections)
+        self.assertIn('.debug_info', debug_sections)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+import json
+import tempfile
+import unittest
+from pathlib import Path
+
+from setuptools_cuda_cpp.build_history import BuildHistory
+
+
+class TestBuildHistory(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = Path(directory.name)
+        self.build_temp = self.directory / 'build_temp'
+        self.path = self.directory / 'build_history.jsonl'
+
+    def record(self, build, durations):
+        BuildHistory(self.path, root=self.build_temp, build=build).record(durations)
+
+    def test_record(self):
+        library = str(self.directory / 'lib' / 'ext.so')
+        self.record(1.0, [(str(self.build_temp / 'ext' / 'a.o'), 1.5), (str(self.build_temp / 'ext' / 'dlink.o'), 0.25),
+                          (library, 0.5)])
+        # Nothing is written for a no-op build.
+        self.record(2.0, [])
+        records = [json.loads(line) for line in self.path.read_text().splitlines()]
+        self.assertEqual(records, [
+            {'build': 1.0, 'target': 'ext/a.o', 'kind': 'compile', 'seconds': 1.5},
+            {'build': 1.0, 'target': 'ext/dlink.o', 'kind': 'dlink', 'seconds': 0.25},
+            {'build': 1.0, 'target': 'ext.so', 'kind': 'link', 'seconds': 0.5},
+        ])
+
+    def test_regressions(self):
+        a, b = str(self.build_temp / 'a.o'), str(self.build_temp / 'b.o')
+        for build, seconds in enumerate([1.0, 1.2, 0.8]):
+            self.record(build, [(a, seconds), (b, 2.0)])
+        # Only a.o became slower than the median of its previous builds by more than the threshold, c.o is new.
+        self.record(3, [(a, 1.5), (b, 2.2), (str(self.build_temp / 'c.o'), 9.0)])
+        slowest, regressions = BuildHistory(self.path).report(top=2, threshold=0.2)
+        self.assertEqual(slowest, ['      9.00s  compile  c.o', '      2.20s  compile  b.o'])
+        self.assertEqual(regressions, ['      1.50s  (was 1.00s, +50%)  a.o'])
+        self.assertEqual(BuildHistory(self.path).report(threshold=0.6)[1], [])
+
+    def test_empty_history(self):
+        self.assertEqual(BuildHistory(self.path).report(), ([], []))
+
+
+if __name__ == '__main__':
+    unittest.main()
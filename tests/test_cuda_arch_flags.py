@@ -0,0 +1,65 @@
+import os
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from setuptools_cuda_cpp import build_ext, nvml
+
+
+class TestCudaArchFlags(unittest.TestCase):
+    def setUp(self):
+        build_ext._resolve_cuda_arch_flags.cache_clear()
+        patcher = mock.patch.object(build_ext, 'get_arch_list', return_value=['sm_75', 'sm_80', 'sm_86', 'sm_90'])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def arch_flags(self, arch_list, cflags=None):
+        with mock.patch.dict(os.environ, {'CUDA_ARCH_LIST': arch_list}):
+            return build_ext._get_cuda_arch_flags(cflags)
+
+    def test_arch_list(self):
+        self.assertEqual(self.arch_flags('8.0;8.6;9.0+PTX'), [
+            '-gencode=arch=compute_80,code=sm_80',
+            '-gencode=arch=compute_86,code=sm_86',
+            '-gencode=arch=compute_90,code=sm_90',
+            '-gencode=arch=compute_90,code=compute_90',
+        ])
+
+    def test_named_arches_are_deduplicated(self):
+        self.assertEqual(self.arch_flags('Ampere;8.6;8.0'), [
+            '-gencode=arch=compute_80,code=sm_80',
+            '-gencode=arch=compute_86,code=sm_86',
+            '-gencode=arch=compute_86,code=compute_86',
+        ])
+
+    def test_unsupported_arch(self):
+        with self.assertRaises(ValueError):
+            self.arch_flags('7.0')
+
+    def test_user_arch_flags(self):
+        self.assertEqual(self.arch_flags('8.0', cflags=['-arch=sm_75']), [])
+
+    def test_fleet_inventory(self):
+        with tempfile.TemporaryDirectory() as directory:
+            inventories = [Path(directory) / 'a100.json', Path(directory) / 'l4.json']
+            nvml.export_inventory(inventories[0], [nvml.Device('NVIDIA A100', (8, 0))] * 2)
+            nvml.export_inventory(inventories[1], [nvml.Device('NVIDIA L4', (8, 9)),
+                                                   nvml.Device('NVIDIA H100', (9, 0))])
+            inventory_env = os.pathsep.join(map(str, inventories))
+            with mock.patch.dict(os.environ, {'CUDA_DEVICE_INVENTORY': inventory_env}):
+                os.environ.pop('CUDA_ARCH_LIST', None)
+                flags = build_ext._get_cuda_arch_flags()
+        self.assertEqual(flags, [
+            '-gencode=arch=compute_80,code=sm_80',
+            '-gencode=arch=compute_90,code=sm_90',
+            '-gencode=arch=compute_90,code=compute_90',
+        ])
+
+    def test_minimal_arch_list(self):
+        self.assertEqual(nvml.minimal_arch_list(['8.6', '9.0a', '7.5', '8.9', '8.6', '10.0', '9.0']),
+                         ['7.5', '8.6', '9.0', '9.0a', '10.0'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,31 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+from setuptools_cuda_cpp.extension_cache import ExtensionCache
+
+
+class TestExtensionCache(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = Path(directory.name)
+        self.header = self.directory / 'common.h'
+        self.header.write_text('#define A 1\n')
+        self.library = self.directory / 'lib' / 'ext.so'
+        self.library.parent.mkdir()
+        self.library.write_bytes(b'built')
+        self.cache = ExtensionCache(self.directory / 'cache')
+        self.cache.store('key', [str(self.header)], [self.library])
+        self.library.unlink()
+
+    def test_restore(self):
+        self.assertTrue(self.cache.restore('key', [self.library]))
+        self.assertEqual(self.library.read_bytes(), b'built')
+        self.assertFalse(self.cache.restore('other key', [self.library]))
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+
+    def test_changed_header(self):
+        self.header.write_text('#define A 2\n')
+        self.assertFalse(self.cache.restore('key', [self.library]))
+        self.assertFalse(self.library.exists())
@@ -0,0 +1,73 @@
+import io
+import struct
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from setuptools_cuda_cpp.fatbin import FATBIN_MAGIC, _lz4_decompress, analyze_extension, check_size_budget, \
+    gencode_targets, main, parse_size
+
+
+def elf(sections):
+    # A little endian ELF64 with the given (name, content) sections, preceded by the null section.
+    names = b'\0' + b''.join(name.encode() + b'\0' for name, _ in sections) + b'.shstrtab\0'
+    sections = list(sections) + [('.shstrtab', names)]
+    data, headers = bytearray(64), [bytes(64)]
+    for name, content in sections:
+        headers.append(struct.pack('<IIQQQQIIQQ', names.index(name.encode() + b'\0'), 1, 0, 0, len(data),
+                                   len(content), 0, 0, 1, 0))
+        data += content
+    section_offset = len(data)
+    data += b''.join(headers)
+    data[:4] = b'\x7fELF'
+    data[4:6] = bytes([2, 1])
+    struct.pack_into('<Q', data, 0x28, section_offset)
+    struct.pack_into('<HHH', data, 0x3A, 64, len(headers), len(headers) - 1)
+    return bytes(data)
+
+
+def fatbin_entry(kind, arch, payload):
+    header = struct.pack('<HHIQIIHHIIIQQQ', kind, 0x101, 64, len(payload), 0, 0, 0, 0, arch, 0, 0, 0, 0, 0)
+    return header + payload
+
+
+class TestFatbin(unittest.TestCase):
+    def test_analyze_extension(self):
+        cubin = elf([('.text._Z6kernelPf', b'\0' * 96), ('.nv.info', b'\0' * 8)])
+        entries = fatbin_entry(2, 80, cubin) + fatbin_entry(1, 90, b'.version 8.0\0\0\0\0')
+        container = struct.pack('<IHHQ', FATBIN_MAGIC, 1, 16, len(entries)) + entries
+        with tempfile.TemporaryDirectory() as directory:
+            library = Path(directory) / 'ext.so'
+            library.write_bytes(elf([('.text', b'\0' * 16), ('.nv_fatbin', container)]))
+            report = analyze_extension(library, expected_targets=['sm_80', 'sm_86', 'compute_90'])
+        self.assertEqual(report['architectures'], {'compute_90': 64 + 16, 'sm_80': 64 + len(cubin)})
+        self.assertEqual(report['entries'][0]['kernels'], {'_Z6kernelPf': 96})
+        self.assertEqual(report['missing_targets'], ['sm_86'])
+        self.assertEqual(report['unexpected_targets'], [])
+        self.assertEqual(len(check_size_budget([report], 100)), 1)
+        self.assertEqual(check_size_budget([report], parse_size('1K')), [])
+
+    def test_not_elf(self):
+        with tempfile.TemporaryDirectory() as directory:
+            empty = Path(directory) / 'empty.so'
+            empty.write_bytes(b'')
+            with self.assertRaisesRegex(ValueError, 'empty.so is empty, not an ELF file'):
+                analyze_extension(empty)
+            pe = Path(directory) / 'ext.pyd'
+            pe.write_bytes(b'MZ' + b'\0' * 126)
+            with self.assertRaisesRegex(ValueError, r'ext.pyd is not an ELF file'):
+                analyze_extension(pe)
+            with self.assertRaises(SystemExit) as context, mock.patch('sys.stderr', new_callable=io.StringIO) as stderr:
+                main([str(pe)])
+        self.assertEqual(context.exception.code, 2)
+        self.assertIn('ext.pyd is not an ELF file', stderr.getvalue())
+
+    def test_gencode_targets(self):
+        self.assertEqual(gencode_targets(['-gencode=arch=compute_80,code=sm_80',
+                                          '-gencode=arch=compute_90,code=[sm_90,compute_90]', '-arch=sm_75']),
+                         ['sm_80', 'sm_90', 'compute_90', 'sm_75', 'compute_75'])
+
+    def test_lz4_decompress(self):
+        # The literals "ab", then a match of 6 bytes at offset 2, then the last literal "c".
+        self.assertEqual(_lz4_decompress(bytes([0x22]) + b'ab' + bytes([2, 0, 0x10]) + b'c', 9), b'abababab' + b'c')
@@ -0,0 +1,45 @@
+import os
+import tempfile
+import unittest
+from pathlib import Path
+
+from setuptools_cuda_cpp.incremental import is_up_to_date, read_depfile, record_command
+
+
+class TestIncremental(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = Path(directory.name)
+        self.header = self.directory / 'my header.h'
+        self.header.write_text('')
+        self.obj = str(self.directory / 'a.o')
+        Path(self.obj).write_text('')
+        escaped_header = str(self.header).replace(' ', '\\ ')
+        Path(self.obj + '.d').write_text(f'{self.obj}: a.cpp \\\n {escaped_header}\n')
+        self.command = ['c++', '-c', 'a.cpp', '-o', self.obj]
+        record_command(self.obj, self.command)
+        self.set_mtime(self.header, -10)
+
+    def set_mtime(self, path, delta):
+        mtime = os.stat(self.obj).st_mtime + delta
+        os.utime(path, (mtime, mtime))
+
+    def test_read_depfile(self):
+        self.assertEqual(read_depfile(Path(self.obj + '.d')), ['a.cpp', str(self.header)])
+
+    def test_up_to_date(self):
+        Path(self.directory / 'a.cpp').write_text('')
+        self.set_mtime(self.directory / 'a.cpp', -10)
+        cwd = os.getcwd()
+        os.chdir(self.directory)
+        self.addCleanup(os.chdir, cwd)
+        self.assertTrue(is_up_to_date(self.obj, self.command))
+        self.assertFalse(is_up_to_date(self.obj, self.command + ['-O2']))
+        self.set_mtime(self.header, 10)
+        self.assertFalse(is_up_to_date(self.obj, self.command))
+
+    def test_missing_depfile(self):
+        os.remove(self.obj + '.d')
+        self.assertFalse(is_up_to_date(self.obj, self.command))
+        self.assertTrue(is_up_to_date(self.obj, self.command, depfile=False))
@@ -0,0 +1,81 @@
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import setuptools_cuda_cpp
+from setuptools_cuda_cpp import jit
+
+MODULE_SOURCE = r'''
+#include <Python.h>
+#include "value.h"
+
+static PyObject *value(PyObject *self, PyObject *args) { return PyLong_FromLong(VALUE); }
+static PyMethodDef methods[] = {{"value", value, METH_NOARGS, nullptr}, {nullptr, nullptr, 0, nullptr}};
+static PyModuleDef module = {PyModuleDef_HEAD_INIT, "jit_test_ext", nullptr, -1, methods};
+PyMODINIT_FUNC PyInit_jit_test_ext() { return PyModule_Create(&module); }
+'''
+LOAD_SCRIPT = '''
+from setuptools_cuda_cpp import load
+print(load('jit_test_ext', ['{source}'], build_directory='{build_directory}', verbose=True).value())
+'''
+
+
+@unittest.skipUnless(shutil.which('c++'), 'needs a host compiler')
+class TestJit(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = Path(directory.name)
+        self.source = self.directory / 'jit_test_ext.cpp'
+        self.source.write_text(MODULE_SOURCE)
+        self.header = self.directory / 'value.h'
+        self.header.write_text('#define VALUE 1\n')
+        self.build_directory = self.directory / 'extensions'
+        self.env = dict(os.environ, XDG_CACHE_HOME=str(self.directory / 'cache'),
+                        PYTHONPATH=str(Path(setuptools_cuda_cpp.__file__).parent.parent))
+
+    def start_load(self):
+        script = LOAD_SCRIPT.format(source=self.source.as_posix(), build_directory=self.build_directory.as_posix())
+        return subprocess.Popen([sys.executable, '-c', script], env=self.env, stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE, universal_newlines=True)
+
+    def load(self):
+        # Returns the value of the loaded extension and whether it was built.
+        process = self.start_load()
+        stdout, stderr = process.communicate()
+        self.assertEqual(process.returncode, 0, stderr)
+        return int(stdout.splitlines()[-1]), 'Building extension jit_test_ext' in stderr
+
+    def test_load(self):
+        self.assertEqual(self.load(), (1, True))
+        self.assertEqual(self.load(), (1, False))
+        self.header.write_text('#define VALUE 2\n')
+        self.assertEqual(self.load(), (2, True))
+
+    def test_concurrent_loads(self):
+        processes = [self.start_load() for _ in range(2)]
+        outputs = [process.communicate() for process in processes]
+        self.assertEqual([process.returncode for process in processes], [0, 0], outputs)
+        self.assertEqual([int(stdout.splitlines()[-1]) for stdout, _ in outputs], [1, 1])
+        self.assertEqual(sum('Building extension jit_test_ext' in stderr for _, stderr in outputs), 1)
+
+    def test_rebuilt_after_import(self):
+        self.addCleanup(sys.modules.pop, 'jit_test_ext', None)
+        def load():
+            return jit.load('jit_test_ext', [self.source], build_directory=self.build_directory)
+
+        with mock.patch.dict(os.environ, {'XDG_CACHE_HOME': self.env['XDG_CACHE_HOME']}):
+            self.assertEqual(load().value(), 1)
+            self.assertEqual(load().value(), 1)
+            self.header.write_text('#define VALUE 2\n')
+            with self.assertRaises(ImportError):
+                load()
+
+
+if __name__ == '__main__':
+    unittest.main()
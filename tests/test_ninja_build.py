@@ -0,0 +1,231 @@
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from setuptools_cuda_cpp import CppExtension, ninja_build
+from setuptools_cuda_cpp.toolchain import Toolchain
+
+
+class TestSingleGraph(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.build_directory = Path(directory.name)
+        for patcher in (mock.patch.object(ninja_build, 'verify_ninja_availability'),
+                        mock.patch.object(ninja_build, '_run_ninja_build'),
+                        mock.patch.object(ninja_build, 'get_cuda_home', return_value=Path('/usr/local/cuda')),
+                        mock.patch.dict(os.environ, {'MAX_JOBS': '4'})):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def write_extension_graph(self, name):
+        extension_directory = self.build_directory / name
+        extension_directory.mkdir()
+        sources = [f'{name}.cpp', f'{name}_kernels.cu']
+        objects = [str(extension_directory / (source + '.o')) for source in sources]
+        return ninja_build._write_ninja_file_for_objects(
+            sources=sources, objects=objects, cflags=['-O2'], post_cflags=[], cuda_cflags=[], cuda_post_cflags=['-O2'],
+            cuda_dlink_post_cflags=None, build_directory=extension_directory, verbose=False, with_cuda=True,
+            subninja=True)
+
+    def test_graph_of_two_extensions(self):
+        build_files = [self.write_extension_graph('ext1'), self.write_extension_graph('ext2')]
+        for build_file in build_files:
+            # The pools are declared once, by the top level graph.
+            self.assertNotIn('pool cuda_pool', build_file.read_text())
+        ninja_build._write_ninja_file_and_compile_graphs(build_files, self.build_directory, verbose=False)
+
+        graph = (self.build_directory / 'build.ninja').read_text()
+        self.assertEqual(len(re.findall(r'^pool cuda_pool$', graph, re.MULTILINE)), 1)
+        self.assertEqual(re.findall(r'^subninja (.*)$', graph, re.MULTILINE),
+                         [str(build_file.absolute()) for build_file in build_files])
+        ninja_build._run_ninja_build.assert_called_once()
+
+
+class TestPrecompiledHeader(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.build_directory = Path(directory.name)
+        self.header = self.build_directory / 'common.h'
+        toolchain = Toolchain(*[None] * len(Toolchain._fields))._replace(cxx_version='c++ (GCC) 12.2.0')
+        for patcher in (mock.patch.object(ninja_build, 'verify_ninja_availability'),
+                        mock.patch.object(ninja_build, 'get_cuda_home', return_value=Path('/usr/local/cuda')),
+                        mock.patch.object(ninja_build, 'probe_toolchain', return_value=toolchain),
+                        mock.patch.dict(os.environ, {'MAX_JOBS': '4'})):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_prepare_extension(self):
+        self.assertEqual(CppExtension('ext', ['a.cpp'], precompiled_header=self.header).precompiled_header,
+                         str(self.header))
+        self.assertIsNone(CppExtension('ext', ['a.cpp']).precompiled_header)
+
+    def test_pch_edges(self):
+        sources = ['a.cpp', 'b.cpp', 'k.cu']
+        objects = [str(self.build_directory / (source + '.o')) for source in sources]
+        build_file = ninja_build._write_ninja_file_for_objects(
+            sources=sources, objects=objects, cflags=['-O2'], post_cflags=[], cuda_cflags=[], cuda_post_cflags=[],
+            cuda_dlink_post_cflags=None, build_directory=self.build_directory, verbose=False, with_cuda=True,
+            precompiled_header=str(self.header))
+        graph = build_file.read_text().splitlines()
+
+        # The wrapper includes the header, and is precompiled next to itself with the header dependencies.
+        wrapper = self.build_directory / 'pch' / 'common.h'
+        self.assertEqual(wrapper.read_text(), f'#include "{self.header.as_posix()}"\n')
+        pch_output = f'{wrapper}.gch'
+        self.assertIn(f'build {pch_output}: pch {wrapper}', graph)
+        self.assertIn('  command = $cxx -x c++-header -MMD -MF $out.d $cflags -c $in -o $out $post_cflags', graph)
+        self.assertIn(f'pch_cflags = -include {wrapper}', graph)
+
+        # The host objects are compiled with it, and rebuilt when it is, the CUDA objects are not.
+        for source, obj in zip(sources[:2], objects):
+            self.assertIn(f'build {obj}: compile {Path(source).absolute()} | {pch_output}', graph)
+        self.assertIn(f'build {objects[2]}: cuda_compile {Path(sources[2]).absolute()}', graph)
+        self.assertNotIn('$pch_cflags', next(line for line in graph if '$nvcc' in line and 'command' in line))
+
+
+# Fake compiler, device linker and linker: the objects are the sources without their comments, the device image the
+# device code ("__global__" lines) of the objects, and the library the objects.
+FAKE_TOOL = r'''#!{python}
+import os
+import sys
+
+args = sys.argv[1:]
+output = args[args.index('-o') + 1]
+inputs = [arg for arg in args if arg.endswith(('.cpp', '.cu', '.o')) and arg != output]
+lines = [line.split('//')[0].rstrip() for path in inputs for line in open(path).read().splitlines()]
+lines = [line for line in lines if line]
+if '-dlink' in args:
+    lines = [line for line in lines if '__global__' in line]
+with open(output, 'w') as output_file:
+    output_file.write(''.join(line + '\n' for line in lines))
+with open({log!r}, 'a') as log:
+    log.write(os.path.basename(output) + '\n')
+'''
+
+
+@unittest.skipUnless(shutil.which('ninja'), 'needs ninja')
+class TestRestat(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = Path(directory.name)
+        self.log = self.directory / 'commands.log'
+        cuda_home = self.directory / 'cuda'
+        (cuda_home / 'bin').mkdir(parents=True)
+        for tool in (self.directory / 'c++', self.directory / 'ld', cuda_home / 'bin' / 'nvcc'):
+            tool.write_text(FAKE_TOOL.format(python=sys.executable, log=str(self.log)))
+            tool.chmod(0o755)
+        toolchain = Toolchain(*[None] * len(Toolchain._fields))
+        for patcher in (mock.patch.object(ninja_build, 'verify_ninja_availability'),
+                        mock.patch.object(ninja_build, 'get_cuda_home', return_value=cuda_home),
+                        mock.patch.object(ninja_build, 'probe_toolchain', return_value=toolchain),
+                        mock.patch.dict(os.environ, {'CXX': str(self.directory / 'c++'), 'MAX_JOBS': '4'})):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.build_directory = self.directory / 'build'
+        self.build_directory.mkdir()
+        self.sources = [self.directory / name for name in ('ext.cpp', 'k1.cu', 'k2.cu')]
+        self.sources[0].write_text('int host() { return 1; }\n')
+        for source in self.sources[1:]:
+            source.write_text(f'__global__ void {source.stem}() {{}}\nint {source.stem}_host() {{ return 1; }}\n')
+        self.library = self.directory / 'ext.so'
+        ninja_build._write_ninja_file_for_objects(
+            sources=[str(source) for source in self.sources],
+            objects=[str(self.build_directory / (source.name + '.o')) for source in self.sources],
+            cflags=[], post_cflags=[], cuda_cflags=[], cuda_post_cflags=[], cuda_dlink_post_cflags=['-dlink'],
+            build_directory=self.build_directory, verbose=False, with_cuda=True, ldflags=[],
+            library_target=str(self.library), linker=str(self.directory / 'ld'))
+        self.assertEqual(self.ninja(), ['ext.cpp.o', 'k1.cu.o', 'k2.cu.o', 'dlink.o', 'ext.so'])
+
+    def ninja(self):
+        # Runs the build, and returns the outputs of the commands it ran.
+        subprocess.check_output(['ninja', '-C', str(self.build_directory)])
+        if not self.log.exists():
+            return []
+        outputs = self.log.read_text().splitlines()
+        self.log.unlink()
+        return sorted(outputs, key=['ext.cpp.o', 'k1.cu.o', 'k2.cu.o', 'dlink.o', 'ext.so'].index)
+
+    def edit(self, source, text):
+        # Not in the future: ninja records the newest input as the mtime of an output left unchanged by restat.
+        source.write_text(text)
+
+    def explain(self):
+        result = subprocess.run(['ninja', '-n', '-d', 'explain', '-C', str(self.build_directory)],
+                                stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+        return result.stdout
+
+    def test_unchanged_cuda_object(self):
+        # Only a comment changes, so does not the object: nothing depending on it runs.
+        self.edit(self.sources[1], self.sources[1].read_text() + '// comment\n')
+        self.assertRegex(self.explain(), r'k1\.cu\.o older than most recent input .*k1\.cu ')
+        self.assertEqual(self.ninja(), ['k1.cu.o'])
+        library_mtime = self.library.stat().st_mtime_ns
+        self.assertIn('no work to do', self.explain())
+        self.assertEqual(self.library.stat().st_mtime_ns, library_mtime)
+
+    def test_unchanged_device_code(self):
+        # The host code of a CUDA source changes: the device image stays the same, the library is linked again.
+        self.edit(self.sources[1], self.sources[1].read_text().replace('return 1', 'return 2'))
+        self.assertEqual(self.ninja(), ['k1.cu.o', 'dlink.o', 'ext.so'])
+        self.assertIn('k1_host() { return 2; }', self.library.read_text())
+
+    def test_changed_device_code(self):
+        self.edit(self.sources[2], self.sources[2].read_text().replace('k2()', 'k2(int)'))
+        self.assertEqual(self.ninja(), ['k2.cu.o', 'dlink.o', 'ext.so'])
+        self.assertEqual((self.build_directory / 'dlink.o').read_text(),
+                         '__global__ void k1() {}\n__global__ void k2(int) {}\n')
+
+    def test_unchanged_host_object(self):
+        self.edit(self.sources[0], '// comment\n' + self.sources[0].read_text())
+        self.assertEqual(self.ninja(), ['ext.cpp.o'])
+
+
+class TestNinjaLog(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.build_directory = Path(directory.name)
+        self.ninja_log = self.build_directory / '.ninja_log'
+
+    def write_log(self, entries):
+        lines = ['# ninja log v5'] + [f'{start}\t{end}\t{mtime}\t{output}\t0' for start, end, mtime, output in entries]
+        self.ninja_log.write_text('\n'.join(lines) + '\n')
+
+    def test_new_entries(self):
+        self.write_log([(0, 1000, 1, '/build/a.o'), (0, 500, 1, '/build/b.o')])
+        known_entries = ninja_build._ninja_log_entries(self.build_directory)
+        # The next build appends its entries, with times from its own start.
+        with self.ninja_log.open('a') as log:
+            log.write('0\t250\t2\t/build/a.o\t0\n250\t1250\t2\t/build/ext.so\t0\n')
+        self.assertEqual(ninja_build._read_ninja_log(self.build_directory, known_entries),
+                         [('/build/a.o', 0.25), ('/build/ext.so', 1.0)])
+        self.assertEqual(len(ninja_build._read_ninja_log(self.build_directory)), 4)
+
+    def test_recompacted_log(self):
+        old_entries = [(i * 10, i * 10 + 5, 1, f'/build/{i}.o') for i in range(20)]
+        self.write_log(old_entries + [(0, 5, 2, '/build/0.o')])
+        known_entries = ninja_build._ninja_log_entries(self.build_directory)
+        # Ninja recompacted the log (keeping the last entry of every output, in another order) before the build
+        # logged its edges, which are no longer after the previous end of the log.
+        new_entries = [(0, 2000, 3, '/build/1.o'), (0, 3000, 3, '/build/ext.so')]
+        self.write_log([(0, 5, 2, '/build/0.o')] + old_entries[:0:-1] + new_entries)
+        self.assertEqual(ninja_build._read_ninja_log(self.build_directory, known_entries),
+                         [('/build/1.o', 2.0), ('/build/ext.so', 3.0)])
+
+    def test_missing_log(self):
+        self.assertEqual(ninja_build._ninja_log_entries(self.build_directory), set())
+        self.assertEqual(ninja_build._read_ninja_log(self.build_directory), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
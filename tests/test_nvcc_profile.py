@@ -0,0 +1,56 @@
+import json
+import tempfile
+import unittest
+from pathlib import Path
+
+from setuptools_cuda_cpp.nvcc_profile import NVCC_TIME_PROFILE, format_nvcc_time_report, merge_nvcc_time_profiles
+
+TABLE_WITH_HEADER = '''source file name,phase name,phase input files,phase output file,arch,tool,metric,unit
+a.cu , gcc (preprocessing 1) , a.cu , a.cpp1.ii , , gcc , 12.5 , ms
+a.cu , cicc , a.cpp1.ii , a.ptx , compute_80 , cicc , 300 , ms
+a.cu , ptxas , a.ptx , a.cubin , sm_80 , ptxas , 0.5 , s
+'''
+# Without the header, when nvcc appended to a table it did not start.
+TABLE_WITHOUT_HEADER = '''b.cu , cicc , b.cpp1.ii , b.ptx , compute_90 , cicc , 1500 , us
+'''
+
+
+class TestNvccTimeProfile(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.build_temp = Path(directory.name)
+        (self.build_temp / 'ext').mkdir()
+        self.tables = [self.build_temp / 'ext' / f'{source}.o.nvcc_time.csv' for source in ('a.cu', 'b.cu')]
+        self.tables[0].write_text(TABLE_WITH_HEADER)
+        self.tables[1].write_text(TABLE_WITHOUT_HEADER)
+        # The profile of a previous build, with an older compile of a.cu.
+        (self.build_temp / NVCC_TIME_PROFILE).write_text(json.dumps({
+            'a.cu': [{'phase': 'cicc', 'arch': 'compute_80', 'ms': 1.0}],
+            'c.cu': [{'phase': 'cicc', 'arch': 'compute_80', 'ms': 2.0}],
+        }))
+
+    def test_merge(self):
+        profile = merge_nvcc_time_profiles(self.build_temp)
+        self.assertEqual(profile, {
+            'a.cu': [{'phase': 'gcc (preprocessing 1)', 'arch': 'host', 'ms': 12.5},
+                     {'phase': 'cicc', 'arch': 'compute_80', 'ms': 300.0},
+                     {'phase': 'ptxas', 'arch': 'sm_80', 'ms': 500.0}],
+            'b.cu': [{'phase': 'cicc', 'arch': 'compute_90', 'ms': 1.5}],
+            'c.cu': [{'phase': 'cicc', 'arch': 'compute_80', 'ms': 2.0}],
+        })
+        self.assertEqual(json.loads((self.build_temp / NVCC_TIME_PROFILE).read_text()), profile)
+        # The tables are removed, the next build merges its own.
+        self.assertFalse(any(table.exists() for table in self.tables))
+        self.assertEqual(merge_nvcc_time_profiles(self.build_temp), profile)
+
+    def test_report(self):
+        report = format_nvcc_time_report(merge_nvcc_time_profiles(self.build_temp), top=1)
+        self.assertEqual(report, ['      0.81s  a.cu',
+                                  '                0.30s  compute_80     cicc',
+                                  '                0.01s  host           gcc (preprocessing 1)',
+                                  '                0.50s  sm_80          ptxas'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+import unittest
+from unittest import mock
+
+from setuptools import Distribution
+
+from setuptools_cuda_cpp import CUDAExtension, build_ext, ninja_build
+from setuptools_cuda_cpp.build_ext import BuildExtension
+from setuptools_cuda_cpp.toolchain import Toolchain
+
+ARCH_FLAGS = ['-gencode=arch=compute_80,code=sm_80', '-gencode', 'arch=compute_90,code=[sm_90,compute_90]',
+              "'-gencode=arch=compute_70,code=sm_70'"]
+
+
+class TestNvccThreads(unittest.TestCase):
+    def setUp(self):
+        toolchain = Toolchain(*[None] * len(Toolchain._fields))._replace(cuda_version=(12, 2))
+        for patcher in (mock.patch.object(ninja_build, 'available_cpus', return_value=16),
+                        mock.patch.object(build_ext, 'probe_toolchain', return_value=toolchain)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def append_nvcc_threads(self, cflags, num_cuda_sources=1, num_workers=1, extension=None, **options):
+        command = BuildExtension(Distribution(), **options)
+        command._building_extension = extension
+        cflags = list(cflags)
+        command._append_nvcc_threads(cflags, num_cuda_sources, num_workers)
+        return cflags
+
+    def test_count_targets(self):
+        self.assertEqual(ninja_build._count_nvcc_targets(ARCH_FLAGS), 4)
+        self.assertEqual(ninja_build._count_nvcc_targets(['-O2']), 1)
+
+    def test_threads_budget(self):
+        # Capped by the targets of a source.
+        self.assertEqual(ninja_build._get_nvcc_threads(ARCH_FLAGS, num_cuda_sources=1, num_workers=8), 4)
+        self.assertEqual(ninja_build._get_nvcc_threads(ARCH_FLAGS[:1], num_cuda_sources=1, num_workers=8), 1)
+        # And by the cores the parallel jobs leave.
+        self.assertEqual(ninja_build._get_nvcc_threads(ARCH_FLAGS, num_cuda_sources=8, num_workers=8), 2)
+        self.assertEqual(ninja_build._get_nvcc_threads(ARCH_FLAGS, num_cuda_sources=40, num_workers=18), 1)
+        # Only as many CUDA compiles as there are CUDA sources run in parallel.
+        self.assertEqual(ninja_build._get_nvcc_threads(ARCH_FLAGS, num_cuda_sources=2, num_workers=18), 4)
+
+    def test_append_threads(self):
+        self.assertEqual(self.append_nvcc_threads(ARCH_FLAGS), ARCH_FLAGS + ['--threads', '4'])
+        self.assertEqual(self.append_nvcc_threads(ARCH_FLAGS, num_cuda_sources=8, num_workers=8),
+                         ARCH_FLAGS + ['--threads', '2'])
+        # No --threads 1, the default of nvcc.
+        self.assertEqual(self.append_nvcc_threads(ARCH_FLAGS[:1]), ARCH_FLAGS[:1])
+        self.assertEqual(self.append_nvcc_threads(ARCH_FLAGS, nvcc_threads=False), ARCH_FLAGS)
+        self.assertEqual(self.append_nvcc_threads(ARCH_FLAGS, nvcc_threads=3), ARCH_FLAGS + ['--threads', '3'])
+        extension = CUDAExtension('ext', ['ext.cu'], nvcc_threads=0)
+        self.assertEqual(self.append_nvcc_threads(ARCH_FLAGS, extension=extension, nvcc_threads=False),
+                         ARCH_FLAGS + ['--threads', '0'])
+
+    def test_user_threads(self):
+        for flags in (['--threads', '2'], ['--threads=2'], ['-t', '2'], ['-t=2']):
+            self.assertEqual(self.append_nvcc_threads(ARCH_FLAGS + flags), ARCH_FLAGS + flags)
+            extension = CUDAExtension('ext', ['ext.cu'], nvcc_threads=8)
+            self.assertEqual(self.append_nvcc_threads(ARCH_FLAGS + flags, extension=extension), ARCH_FLAGS + flags)
+
+    def test_old_cuda(self):
+        build_ext.probe_toolchain.return_value = build_ext.probe_toolchain.return_value._replace(cuda_version=(11, 1))
+        self.assertEqual(self.append_nvcc_threads(ARCH_FLAGS), ARCH_FLAGS)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+from pathlib import Path
+
+from setuptools_cuda_cpp.object_cache import ObjectCache, _preprocess_commands
+
+
+class TestObjectCache(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = Path(directory.name)
+        self.source = self.directory / 'a.cpp'
+        self.source.write_text('int f() { return 1; }\n')
+        self.obj = str(self.directory / 'a.o')
+        self.cache = ObjectCache(self.directory / 'cache', stats_file=self.directory / 'stats')
+        self.spawned = []
+
+    def spawn(self, command):
+        self.spawned.append(command)
+        subprocess.check_call(command)
+
+    def compile(self, *flags, obj=None):
+        obj = obj or self.obj
+        self.cache.compile(['c++', *flags, '-MMD', '-MF', obj + '.d', '-c', str(self.source), '-o', obj], self.spawn)
+
+    @unittest.skipUnless(shutil.which('c++'), 'needs a host compiler')
+    def test_hit_and_miss(self):
+        self.compile('-O1')
+        os.unlink(self.obj)
+        # A comment does not change the preprocessed source.
+        self.source.write_text('int f() { return 1; }  // same\n')
+        self.compile('-O1')
+        self.assertEqual(len(self.spawned), 1)
+        self.assertTrue(os.path.exists(self.obj))
+        self.compile('-O2')
+        self.assertEqual(len(self.spawned), 2)
+        self.assertEqual(self.cache.read_stats(), (1, 2))
+
+    @unittest.skipUnless(shutil.which('c++'), 'needs a host compiler')
+    def test_depfile_of_restored_object(self):
+        self.compile()
+        other_obj = str(self.directory / 'b.o')
+        self.compile(obj=other_obj)
+        self.assertEqual(len(self.spawned), 1)
+        self.assertTrue(Path(other_obj + '.d').read_text().startswith(f'{other_obj}:'))
+
+    def test_split_dwarf_is_not_cached(self):
+        self.cache.compile(['c++', '-gsplit-dwarf', '-c', str(self.source), '-o', self.obj], self.spawned.append)
+        self.assertEqual(len(self.spawned), 1)
+        self.assertEqual(self.cache.read_stats(), (0, 0))
+
+    def test_nvcc_preprocessing_per_arch(self):
+        command = ['/usr/local/cuda/bin/nvcc', '-gencode=arch=compute_80,code=sm_80', '-gencode',
+                   'arch=compute_90,code=sm_90', '-O2', '-c', 'k.cu', '-o', 'k.o']
+        self.assertEqual(_preprocess_commands(command), [
+            ['/usr/local/cuda/bin/nvcc', '-O2', '-E', 'k.cu', '-gencode=arch=compute_80,code=sm_80'],
+            ['/usr/local/cuda/bin/nvcc', '-O2', '-E', 'k.cu', '-gencode', 'arch=compute_90,code=sm_90'],
+        ])
+
+    def test_trim(self):
+        entries = []
+        for i in range(4):
+            entry = self.directory / 'cache' / f'0{i}' / f'0{i}key.o'
+            entry.parent.mkdir(parents=True)
+            entry.write_bytes(b'\0' * 100)
+            os.utime(str(entry), (1000 + i, 1000 + i))
+            entries.append(entry)
+        self.cache.max_size = 250
+        self.cache.trim()
+        self.assertEqual([entry.exists() for entry in entries], [False, False, True, True])
+
+
+if __name__ == '__main__':
+    unittest.main()
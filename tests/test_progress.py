@@ -0,0 +1,42 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+from setuptools_cuda_cpp.progress import NinjaStatusParser
+
+
+class TestNinjaStatusParser(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = Path(directory.name)
+        (self.directory / '.ninja_log').write_text('# ninja log v5\n0\t250\t0\t/build/a.o\t0\n')
+        self.parser = NinjaStatusParser(self.directory)
+
+    def events(self, *lines):
+        events = [event for line in lines for event in self.parser.feed(line)]
+        return events + list(self.parser.idle())
+
+    def test_finished_edges(self):
+        events = self.events('[ninja 2/1/3/1] c++ -c a.cpp -o /build/a.o',
+                             'a.cpp:1: warning: unused',
+                             'ninja: build stopped: interrupted by user.')
+        self.assertEqual([(event['event'], event.get('started')) for event in events],
+                         [('edge_started', 1), ('edge_started', 2), ('edge_finished', None)])
+        finished = events[-1]
+        self.assertEqual((finished['finished'], finished['total'], finished['status']), (1, 3, 0))
+        self.assertEqual(finished['duration'], 0.25)
+        self.assertEqual(finished['output'], 'a.cpp:1: warning: unused')
+        self.assertEqual(self.parser.failures, [])
+        self.assertEqual(self.parser.messages, ['ninja: build stopped: interrupted by user.'])
+
+    def test_failed_edge(self):
+        events = self.events('[ninja 1/1/1/0] c++ -c b.cpp -o /build/b.o',
+                             'FAILED: [code=2] /build/b.o',
+                             'c++ -c b.cpp -o /build/b.o',
+                             'b.cpp:1: error: boom')
+        self.assertEqual(events[-1]['status'], 2)
+        self.assertEqual(events[-1]['output'], 'b.cpp:1: error: boom')
+        self.assertIsNone(events[-1]['duration'])
+        self.assertEqual(self.parser.failures,
+                         ['FAILED: /build/b.o\nc++ -c b.cpp -o /build/b.o\nb.cpp:1: error: boom'])
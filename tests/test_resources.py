@@ -0,0 +1,70 @@
+import os
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from setuptools_cuda_cpp import resources
+from setuptools_cuda_cpp.ninja_build import _get_cuda_pool_depth
+
+GB = 1024 ** 3
+
+
+class TestCgroupResources(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.root = Path(directory.name) / 'cgroup'
+        self.proc_self_cgroup = Path(directory.name) / 'proc_self_cgroup'
+        for patcher in (mock.patch.object(resources, 'CGROUP_ROOT', self.root),
+                        mock.patch.object(resources, 'PROC_SELF_CGROUP', self.proc_self_cgroup),
+                        mock.patch.object(resources, '_meminfo_available', return_value=64 * GB),
+                        mock.patch('os.sched_getaffinity', return_value=set(range(16)), create=True),
+                        mock.patch.dict(os.environ)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        os.environ.pop('CUDA_JOB_MEMORY_MB', None)
+
+    def write(self, path, content):
+        path = self.root / path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(content)
+
+    def test_cgroup_v2_without_namespace(self):
+        self.proc_self_cgroup.write_text('0::/kubepods/pod1\n')
+        self.write('cgroup.controllers', 'cpu memory')
+        self.write('kubepods/cpu.max', 'max 100000')
+        self.write('kubepods/pod1/cpu.max', '300000 100000')
+        self.write('kubepods/memory.max', str(8 * GB))
+        self.write('kubepods/pod1/memory.max', 'max')
+        self.write('kubepods/pod1/memory.current', str(2 * GB))
+        self.assertEqual(resources.available_cpus(), 3)
+        self.assertEqual(resources.available_memory(), 8 * GB)
+        self.assertEqual(_get_cuda_pool_depth(['--threads', '2']), 2)
+
+    def test_cgroup_v1_without_namespace(self):
+        self.proc_self_cgroup.write_text('5:memory:/docker/abc\n2:cpu,cpuacct:/docker/abc\n0::/\n')
+        self.write('cpu,cpuacct/cpu.cfs_quota_us', '-1')
+        self.write('cpu,cpuacct/cpu.cfs_period_us', '100000')
+        self.write('cpu,cpuacct/docker/abc/cpu.cfs_quota_us', '150000')
+        self.write('cpu,cpuacct/docker/abc/cpu.cfs_period_us', '100000')
+        self.write('memory/memory.limit_in_bytes', str(2 ** 63 - 4096))
+        self.write('memory/docker/abc/memory.limit_in_bytes', str(4 * GB))
+        self.write('memory/docker/abc/memory.usage_in_bytes', str(GB))
+        self.assertEqual(resources.available_cpus(), 2)
+        self.assertEqual(resources.available_memory(), 3 * GB)
+        self.assertEqual(_get_cuda_pool_depth([]), 1)
+
+    def test_cgroup_namespace(self):
+        # The cgroup of the process is the root of the hierarchy.
+        self.proc_self_cgroup.write_text('0::/\n')
+        self.write('cgroup.controllers', 'cpu memory')
+        self.write('cpu.max', '400000 100000')
+        self.write('memory.max', str(16 * GB))
+        self.write('memory.current', '0')
+        self.assertEqual(resources.available_cpus(), 4)
+        self.assertEqual(_get_cuda_pool_depth([]), 8)
+
+
+if __name__ == '__main__':
+    unittest.main()
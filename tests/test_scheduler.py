@@ -0,0 +1,142 @@
+import os
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from setuptools_cuda_cpp import scheduler
+
+FAKE_COMPILER = r'''#!{python}
+# Fake compiler: fails on the sources containing "error", otherwise concatenates its inputs into the -o output and
+# logs when it ran.
+import os
+import sys
+import time
+
+args = sys.argv[1:]
+output = args[args.index('-o') + 1]
+inputs = [arg for arg in args if arg.endswith(('.cpp', '.cu', '.o')) and arg != output]
+start = time.time()
+time.sleep(0.2)
+contents = ''.join(open(path).read() for path in inputs)
+if 'error' in contents:
+    print(f'{{inputs[0]}}: error: fake error')
+    sys.exit(1)
+with open(output, 'w') as output_file:
+    output_file.write(contents)
+for depfile_flag in ('-MF', '--dependency-output'):
+    if depfile_flag in args:
+        with open(args[args.index(depfile_flag) + 1], 'w') as depfile:
+            depfile.write(f'{{output}}: {{" ".join(inputs)}}\n')
+with open({log!r}, 'a') as log:
+    log.write(f'{{os.path.basename(sys.argv[0])}} {{start}} {{time.time()}} {{" ".join(inputs)}}\n')
+'''
+
+
+class TestScheduler(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = Path(directory.name)
+        self.build_directory = self.directory / 'build'
+        self.build_directory.mkdir()
+        self.log = self.directory / 'commands.log'
+        cuda_home = self.directory / 'cuda'
+        (cuda_home / 'bin').mkdir(parents=True)
+        for compiler in (self.directory / 'c++', cuda_home / 'bin' / 'nvcc'):
+            compiler.write_text(FAKE_COMPILER.format(python=sys.executable, log=str(self.log)))
+            compiler.chmod(0o755)
+        for patcher in (mock.patch.object(scheduler, 'get_cuda_home', return_value=cuda_home),
+                        mock.patch.object(scheduler, '_nvcc_generates_dependencies', return_value=True),
+                        mock.patch.object(scheduler, '_get_cuda_pool_depth', return_value=None),
+                        mock.patch.dict(os.environ, {'CXX': str(self.directory / 'c++'), 'MAX_JOBS': '4'})):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def write_sources(self, names):
+        sources = []
+        for name in names:
+            source = self.directory / name
+            source.write_text(f'// {name}\n')
+            sources.append(str(source))
+        return sources
+
+    def compile(self, sources, cuda_dlink_post_cflags=None):
+        objects = [str(self.build_directory / (Path(source).name + '.o')) for source in sources]
+        scheduler._compile_objects_with_scheduler(
+            sources=sources, objects=objects, cflags=[], post_cflags=[], cuda_cflags=[], cuda_post_cflags=[],
+            cuda_dlink_post_cflags=cuda_dlink_post_cflags, build_directory=self.build_directory, verbose=False,
+            with_cuda=None)
+        return objects
+
+    def set_older(self, obj, source):
+        # As if the source was changed after the object was compiled.
+        mtime = os.stat(source).st_mtime - 10
+        os.utime(obj, (mtime, mtime))
+
+    def commands(self):
+        # The compiler, start, end and inputs of the commands run since the last call.
+        if not self.log.exists():
+            return []
+        lines = self.log.read_text().splitlines()
+        self.log.unlink()
+        return [(compiler, float(start), float(end), inputs.split())
+                for compiler, start, end, inputs in (line.split(' ', 3) for line in lines)]
+
+    def test_parallel_compiles(self):
+        objects = self.compile(self.write_sources(['a.cpp', 'b.cpp', 'c.cpp', 'd.cpp']))
+        commands = self.commands()
+        self.assertEqual(len(commands), 4)
+        # All of them ran at the same time.
+        self.assertLess(max(start for _, start, _, _ in commands), min(end for _, _, end, _ in commands))
+        self.assertTrue(all(Path(obj).exists() for obj in objects))
+
+    def test_failing_command(self):
+        sources = self.write_sources(['a.cpp', 'b.cpp'])
+        Path(sources[1]).write_text('error\n')
+        with self.assertRaises(RuntimeError) as context:
+            self.compile(sources)
+        message = str(context.exception)
+        self.assertIn('Error compiling objects for extension', message)
+        self.assertIn(sources[1], message)
+        self.assertIn(f'{sources[1]}: error: fake error', message)
+
+    def test_device_link_after_cuda_objects(self):
+        sources = self.write_sources(['a.cpp', 'k1.cu', 'k2.cu', 'k3.cu'])
+        objects = self.compile(sources, cuda_dlink_post_cflags=['-dlink'])
+        devlink_out = str(self.build_directory / 'dlink.o')
+        self.assertEqual(objects[-1], devlink_out)
+        commands = self.commands()
+        cuda_commands = [command for command in commands if command[3][0].endswith('.cu')]
+        devlink, = [command for command in commands if command[3][0].endswith('.o')]
+        self.assertEqual(len(cuda_commands), 3)
+        # Only the CUDA objects are device linked, once all of them are compiled.
+        self.assertEqual(devlink[0], 'nvcc')
+        self.assertEqual(devlink[3], objects[1:4])
+        self.assertGreaterEqual(devlink[1], max(end for _, _, end, _ in cuda_commands))
+
+    def test_incremental(self):
+        sources = self.write_sources(['a.cpp', 'b.cpp', 'k.cu'])
+        objects = self.compile(sources, cuda_dlink_post_cflags=['-dlink'])
+        self.assertEqual(len(self.commands()), 4)
+        # Nothing changed, nothing runs.
+        self.compile(sources, cuda_dlink_post_cflags=['-dlink'])
+        self.assertEqual(self.commands(), [])
+
+        # Only the changed source is compiled again, and the device link does not depend on host objects.
+        self.set_older(objects[1], sources[1])
+        self.compile(sources, cuda_dlink_post_cflags=['-dlink'])
+        self.assertEqual([inputs for _, _, _, inputs in self.commands()], [[sources[1]]])
+
+        self.set_older(objects[2], sources[2])
+        self.compile(sources, cuda_dlink_post_cflags=['-dlink'])
+        self.assertEqual([compiler for compiler, _, _, _ in self.commands()], ['nvcc', 'nvcc'])
+
+        # A changed command line compiles again.
+        self.compile(sources, cuda_dlink_post_cflags=['-dlink', '-lcudadevrt'])
+        self.assertEqual([inputs for _, _, _, inputs in self.commands()], [[str(self.build_directory / 'k.cu.o')]])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+import json
+import os
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from setuptools_cuda_cpp import toolchain
+
+FAKE_TOOL = '''#!{python}
+print({version!r})
+'''
+
+
+class TestToolchainCache(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = Path(directory.name)
+        self.ninja = self.directory / 'ninja'
+        self.cxx = self.directory / 'c++'
+        self.write_tool(self.ninja, '1.11.1')
+        self.write_tool(self.cxx, 'c++ (GCC) 12.2.0')
+        binaries = (str(self.ninja), None, str(self.cxx), None, None, None)
+        for patcher in (mock.patch.object(toolchain, '_find_binaries', return_value=binaries),
+                        mock.patch.object(toolchain, '_version', wraps=toolchain._version),
+                        mock.patch.dict(os.environ, {'XDG_CACHE_HOME': str(self.directory / 'cache')})):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.addCleanup(toolchain.probe_toolchain.cache_clear)
+
+    def write_tool(self, path, version):
+        path.write_text(FAKE_TOOL.format(python=sys.executable, version=version))
+        path.chmod(0o755)
+
+    def probe(self):
+        # A new process, as far as the memoization is concerned.
+        toolchain.probe_toolchain.cache_clear()
+        toolchain._version.reset_mock()
+        return toolchain.probe_toolchain()
+
+    def test_cached_probe(self):
+        probed = self.probe()
+        self.assertEqual((probed.ninja, probed.ninja_version), (str(self.ninja), '1.11.1'))
+        self.assertEqual(probed.cxx_version, 'c++ (GCC) 12.2.0')
+        self.assertEqual(toolchain._version.call_count, 2)
+        self.assertTrue(toolchain.toolchain_cache_file().exists())
+        # Nothing is spawned for the same environment and binaries.
+        self.assertEqual(self.probe(), probed)
+        toolchain._version.assert_not_called()
+
+    def test_probe_key(self):
+        binaries = toolchain._find_binaries()
+        key = toolchain._probe_key(binaries)
+        self.assertEqual(toolchain._probe_key(binaries), key)
+        with mock.patch.dict(os.environ, {'CUDA_HOME': str(self.directory / 'cuda')}):
+            self.assertNotEqual(toolchain._probe_key(binaries), key)
+        # A binary replaced in place, with another size or modification time.
+        mtime = self.cxx.stat().st_mtime + 10
+        os.utime(str(self.cxx), (mtime, mtime))
+        mtime_key = toolchain._probe_key(binaries)
+        self.assertNotEqual(mtime_key, key)
+        self.write_tool(self.cxx, 'c++ (GCC) 13.10.0')
+        os.utime(str(self.cxx), (mtime, mtime))
+        self.assertNotEqual(toolchain._probe_key(binaries), mtime_key)
+
+    def test_stale_cache(self):
+        self.probe()
+        # An upgraded ninja is probed again.
+        self.write_tool(self.ninja, '1.13.0.git')
+        self.assertEqual(self.probe().ninja_version, '1.13.0.git')
+        self.assertEqual(toolchain._version.call_count, 2)
+
+        # So is the entry of an older version of the package, without all the fields.
+        cache_file = toolchain.toolchain_cache_file()
+        cached_probes = json.loads(cache_file.read_text())
+        for cached in cached_probes.values():
+            del cached['fast_linker']
+        cache_file.write_text(json.dumps(cached_probes))
+        self.assertEqual(self.probe().ninja_version, '1.13.0.git')
+        self.assertEqual(toolchain._version.call_count, 2)
+
+        # And a corrupted cache file, which is then replaced.
+        cache_file.write_text('{')
+        self.assertEqual(self.probe().ninja_version, '1.13.0.git')
+        self.assertEqual(toolchain._version.call_count, 2)
+        self.assertEqual(len(json.loads(cache_file.read_text())), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
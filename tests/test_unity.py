@@ -0,0 +1,37 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+from setuptools_cuda_cpp.unity import unity_sources
+
+
+class TestUnitySources(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = Path(directory.name)
+
+    def unity_sources(self, sources, batch_size, exclude=()):
+        return unity_sources(sources, [source + '.o' for source in sources], batch_size, exclude, self.directory,
+                             '.o')
+
+    def test_batches(self):
+        sources = ['a.cpp', 'b.cpp', 'k1.cu', 'c.cpp', 'k2.cu', 'x.c']
+        batch_sources, batch_objects = self.unity_sources(sources, 2)
+        host_batch, cuda_batch = str(self.directory / 'unity_host_0.cpp'), str(self.directory / 'unity_cuda_0.cu')
+        # The host and CUDA sources are batched separately, the last host batch has a single source.
+        self.assertEqual(batch_sources, ['x.c', host_batch, 'c.cpp', cuda_batch])
+        self.assertEqual(batch_objects, ['x.c.o', str(self.directory / 'unity_host_0.o'), 'c.cpp.o',
+                                         str(self.directory / 'unity_cuda_0.o')])
+        self.assertEqual(Path(host_batch).read_text().splitlines()[1:],
+                         [f'#include "{Path(source).absolute().as_posix()}"' for source in ('a.cpp', 'b.cpp')])
+
+    def test_exclude(self):
+        sources = ['src/legacy/old.cpp', 'src/special.cpp', 'src/main.cpp', 'src/a.cpp', 'src/b.cpp', 'src/c.cpp']
+        exclude = ['src/legacy/*.cpp', 'special.cpp', str(Path('src/main.cpp').absolute())]
+        batch_sources, _ = self.unity_sources(sources, 8, exclude)
+        self.assertEqual(batch_sources, sources[:3] + [str(self.directory / 'unity_host_0.cpp')])
+
+
+if __name__ == '__main__':
+    unittest.main()
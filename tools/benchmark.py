@@ -0,0 +1,368 @@
+r"""
+Build benchmark of setuptools_cuda_cpp: builds synthetic projects with the ninja and the fallback backends and saves
+the timings, to compare them between versions.
+
+The projects have N extensions of M sources each, a part of them CUDA sources, every source including a number of
+the shared headers (the header fan-out). They are built against a stub CUDA toolkit whose ``bin/nvcc`` forwards to the
+host compiler, so the benchmark runs on machines without CUDA and measures the build system rather than nvcc.
+
+For each backend it measures the wall time of a clean ``build_ext``, of a no-op rebuild and of a rebuild after
+touching a header, the CPU time of the ``setup.py`` process itself (the time spent in Python, the compilers run in
+child processes) and, from a profiled clean build, the time spent in the functions of the package (flag assembly,
+writing the ninja files...). The setuptools_cuda_cpp benchmarked is the one of this checkout (``--package-path``)::
+
+    python tools/benchmark.py --extensions 4 --sources 16 --output before.json
+    git checkout my-branch
+    python tools/benchmark.py --extensions 4 --sources 16 --output after.json --compare before.json
+"""
+import argparse
+import json
+import os
+import platform
+import pstats
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+# Bumped when the measurements change, results of another version are not compared.
+RESULTS_VERSION = 1
+BACKENDS = ('ninja', 'scheduler', 'distutils')
+PACKAGE_PATH = Path(__file__).absolute().parent.parent / 'src'
+# Functions of the package reported by name, besides the ones with the most time of their own.
+PROFILED_FUNCTIONS = ('_write_ninja_file', '_get_cuda_arch_flags', 'build_extensions')
+
+STUB_NVCC = r'''#!{python}
+# Stub nvcc: compiles the CUDA sources as C++ with the host compiler, ignores the device flags.
+import os
+import subprocess
+import sys
+
+args = sys.argv[1:]
+if '--version' in args:
+    print('Cuda compilation tools, release 12.2, V12.2.140')
+    sys.exit(0)
+if '--list-gpu-arch' in args:
+    print('\n'.join('compute_' + arch for arch in ('50', '60', '70', '75', '80', '86', '89', '90')))
+    sys.exit(0)
+compiler = os.environ.get('CXX', 'c++')
+command = ['-D__CUDACC__', '-D__global__=', '-D__device__=', '-D__host__=']
+device_link = False
+args_with_value = ('-Xcudafe', '-Xptxas', '-Xnvlink', '--threads', '-t', '--time', '-gencode', '-arch')
+i = 0
+while i < len(args):
+    arg = args[i]
+    if arg in ('--compiler-options', '-Xcompiler'):
+        command += [flag.strip("'\"") for flag in args[i + 1].split(',')]
+        i += 2
+        continue
+    if arg == '-ccbin':
+        compiler = args[i + 1]
+        i += 2
+        continue
+    if arg in ('--dependency-output', '-MF'):
+        command += ['-MMD', '-MF', args[i + 1]]
+        i += 2
+        continue
+    if arg in args_with_value:
+        i += 2
+        continue
+    if arg == '-dlink':
+        device_link = True
+    elif arg.endswith('.cu'):
+        command += ['-x', 'c++', arg, '-x', 'none']
+    elif arg.startswith('-') and (arg.startswith('--') or arg.startswith(('-gencode', '-arch', '-rdc', '-dlto'))):
+        pass
+    else:
+        command.append(arg)
+    i += 1
+if device_link:
+    output = args[args.index('-o') + 1]
+    command = ['-x', 'c++', '-c', '-fPIC', '-o', output, os.devnull]
+sys.exit(subprocess.call([compiler] + command))
+'''
+
+SETUP_PY = r'''import atexit
+import json
+import os
+import time
+
+from setuptools import setup
+from setuptools_cuda_cpp import BuildExtension, CppExtension, CUDAExtension
+
+project = json.load(open('project.json'))
+backend = os.environ['BENCHMARK_BACKEND']
+
+
+class Build(BuildExtension.with_options(use_ninja=backend == 'ninja')):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # The fallback backend when ninja is missing, without hiding ninja from the PATH.
+        self.use_scheduler = backend == 'scheduler'
+
+
+@atexit.register
+def write_times():
+    if os.environ.get('BENCHMARK_TIMES'):
+        with open(os.environ['BENCHMARK_TIMES'], 'w') as times_file:
+            json.dump({'process_time': time.process_time()}, times_file)
+
+
+extensions = []
+for name, sources in project['extensions'].items():
+    extension = CUDAExtension if any(source.endswith('.cu') for source in sources) else CppExtension
+    extensions.append(extension(name, sources, include_dirs=[os.path.abspath('include')],
+                                extra_compile_args={'cxx': ['-O1'], 'nvcc': ['-O1']}))
+setup(name='benchmark_project', ext_modules=extensions, cmdclass={'build_ext': Build})
+'''
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Benchmark the builds of synthetic projects with a stub CUDA toolkit.')
+    parser.add_argument('--extensions', type=int, default=4, help='number of extensions')
+    parser.add_argument('--sources', type=int, default=8, help='number of sources per extension')
+    parser.add_argument('--cuda-ratio', type=float, default=0.5, help='fraction of CUDA sources')
+    parser.add_argument('--headers', type=int, default=16, help='number of shared headers')
+    parser.add_argument('--fan-out', type=int, default=4, help='number of headers included by each source')
+    parser.add_argument('--functions', type=int, default=20, help='number of functions per source and header')
+    parser.add_argument('--backends', default='ninja,scheduler', help=f'comma separated, among {", ".join(BACKENDS)}')
+    parser.add_argument('--repeat', type=int, default=3, help='runs of each measurement, the median is kept')
+    parser.add_argument('--jobs', type=int, default=None, help='MAX_JOBS of the builds')
+    parser.add_argument('--package-path', type=Path, default=PACKAGE_PATH,
+                        help='directory of the setuptools_cuda_cpp benchmarked (default: the one of this checkout)')
+    parser.add_argument('--workdir', type=Path, default=None, help='keep the projects in this directory')
+    parser.add_argument('--output', type=Path, default=None, help='save the results to this JSON file')
+    parser.add_argument('--compare', type=Path, default=None, help='compare with the results of this JSON file')
+    args = parser.parse_args(argv)
+    backends = [backend for backend in args.backends.split(',') if backend]
+    unknown_backends = set(backends) - set(BACKENDS)
+    if unknown_backends:
+        parser.error(f'unknown backends: {", ".join(sorted(unknown_backends))}')
+    if shutil.which('ninja') is None and 'ninja' in backends:
+        parser.error('ninja is not installed')
+
+    workdir = args.workdir or Path(tempfile.mkdtemp(prefix='setuptools_cuda_cpp_benchmark_'))
+    try:
+        results = run_benchmark(args, backends, workdir.absolute())
+    finally:
+        if args.workdir is None:
+            shutil.rmtree(str(workdir), ignore_errors=True)
+    print('\n'.join(format_results(results)))
+    if args.output is not None:
+        args.output.write_text(json.dumps(results, indent=1))
+    if args.compare is not None:
+        print('\n'.join(compare_results(json.loads(args.compare.read_text()), results)))
+    return 0
+
+
+def run_benchmark(args: argparse.Namespace, backends: List[str], workdir: Path) -> dict:
+    cuda_home = make_stub_cuda_home(workdir / 'cuda')
+    env = dict(os.environ)
+    env.update({
+        'CUDA_HOME': str(cuda_home),
+        'CUDA_ARCH_LIST': '8.0',
+        # The toolchain probe and the caches of the package stay in the working directory.
+        'XDG_CACHE_HOME': str(workdir / 'cache'),
+        'PYTHONPATH': os.pathsep.join([str(args.package_path.absolute())] + [os.environ.get('PYTHONPATH', '')]),
+    })
+    env.pop('CUDA_PATH', None)
+    if args.jobs is not None:
+        env['MAX_JOBS'] = str(args.jobs)
+
+    results = {
+        'version': RESULTS_VERSION,
+        'environment': describe_environment(args.package_path, env),
+        'parameters': {parameter: getattr(args, parameter) for parameter in (
+            'extensions', 'sources', 'cuda_ratio', 'headers', 'fan_out', 'functions', 'repeat', 'jobs')},
+        'backends': {},
+    }
+    for backend in backends:
+        project = workdir / backend
+        generate_project(project, args.extensions, args.sources, args.cuda_ratio, args.headers, args.fan_out,
+                         args.functions)
+        print(f'Benchmarking the {backend} backend in {project}...', file=sys.stderr)
+        results['backends'][backend] = benchmark_backend(project, dict(env, BENCHMARK_BACKEND=backend), args.repeat)
+    return results
+
+
+def make_stub_cuda_home(cuda_home: Path) -> Path:
+    r'''Creates a CUDA toolkit with a ``bin/nvcc`` forwarding to the host compiler and an empty ``libcudart.so``.'''
+    for directory in ('bin', 'include', 'lib64'):
+        (cuda_home / directory).mkdir(parents=True, exist_ok=True)
+    nvcc = cuda_home / 'bin' / 'nvcc'
+    nvcc.write_text(STUB_NVCC.format(python=sys.executable))
+    nvcc.chmod(0o755)
+    subprocess.check_call([os.environ.get('CXX', 'c++'), '-shared', '-fPIC', '-x', 'c++', '-o',
+                           str(cuda_home / 'lib64' / 'libcudart.so'), os.devnull])
+    return cuda_home
+
+
+def generate_project(project: Path, num_extensions: int, num_sources: int, cuda_ratio: float, num_headers: int,
+                     fan_out: int, num_functions: int) -> None:
+    r'''
+    Writes a project of ``num_extensions`` extensions of ``num_sources`` sources (``cuda_ratio`` of them CUDA ones),
+    each including ``fan_out`` of the ``num_headers`` shared headers.
+    '''
+    shutil.rmtree(str(project), ignore_errors=True)
+    (project / 'include').mkdir(parents=True)
+    (project / 'src').mkdir()
+    for header in range(num_headers):
+        functions = ''.join(f'template <typename T> inline T header{header}_f{i}(T x) '
+                            f'{{ return x * {i + 1} + {header}; }}\n' for i in range(num_functions))
+        (project / 'include' / f'header{header}.h').write_text(f'#pragma once\n{functions}')
+
+    num_cuda_sources = round(num_sources * cuda_ratio)
+    extensions: Dict[str, List[str]] = {}
+    for extension in range(num_extensions):
+        name = f'bench_ext{extension}'
+        sources = []
+        for source in range(num_sources):
+            is_cuda = source >= num_sources - num_cuda_sources
+            path = f'src/{name}_{source}.{"cu" if is_cuda else "cpp"}'
+            headers = [(source + extension + i) % num_headers for i in range(min(fan_out, num_headers))]
+            lines = [f'#include "header{header}.h"' for header in headers]
+            if source == 0:
+                lines += ['#include <Python.h>',
+                          f'static PyModuleDef module = {{PyModuleDef_HEAD_INIT, "{name}", nullptr, -1, nullptr}};',
+                          f'PyMODINIT_FUNC PyInit_{name}() {{ return PyModule_Create(&module); }}']
+            for i in range(num_functions):
+                body = ' + '.join([f'header{header}_f{i}(x)' for header in headers] or ['x'])
+                if is_cuda:
+                    lines.append(f'__global__ void {name}_{source}_kernel{i}(float *out, float x) {{ *out = {body}; }}')
+                else:
+                    lines.append(f'double {name}_{source}_f{i}(double x) {{ return {body}; }}')
+            (project / path).write_text('\n'.join(lines) + '\n')
+            sources.append(path)
+        extensions[name] = sources
+    (project / 'project.json').write_text(json.dumps({'extensions': extensions}, indent=1))
+    (project / 'setup.py').write_text(SETUP_PY)
+
+
+def benchmark_backend(project: Path, env: Dict[str, str], repeat: int) -> dict:
+    measurements: Dict[str, List[dict]] = {'clean': [], 'no_op': [], 'touch_header': []}
+    for _ in range(repeat):
+        clean_project(project)
+        measurements['clean'].append(run_build(project, env))
+        measurements['no_op'].append(run_build(project, env))
+        os.utime(str(project / 'include' / 'header0.h'))
+        measurements['touch_header'].append(run_build(project, env))
+    result = {
+        measurement: {
+            'wall_time': statistics.median(run['wall_time'] for run in runs),
+            'python_time': statistics.median(run['python_time'] for run in runs),
+        } for measurement, runs in measurements.items()
+    }
+    clean_project(project)
+    result['profile'] = profile_build(project, env)
+    return result
+
+
+def clean_project(project: Path) -> None:
+    shutil.rmtree(str(project / 'build'), ignore_errors=True)
+    for library in project.glob('bench_ext*'):
+        library.unlink()
+
+
+def run_build(project: Path, env: Dict[str, str], profile: Optional[Path] = None) -> dict:
+    r'''Runs ``setup.py build_ext --inplace`` in ``project``, returns its wall time and its own CPU time.'''
+    times_file = project / 'times.json'
+    command = [sys.executable] + (['-m', 'cProfile', '-o', str(profile)] if profile is not None else [])
+    command += ['setup.py', 'build_ext', '--inplace']
+    start = time.perf_counter()
+    completed = subprocess.run(command, cwd=str(project), env=dict(env, BENCHMARK_TIMES=str(times_file)),
+                               stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    wall_time = time.perf_counter() - start
+    if completed.returncode != 0:
+        sys.stderr.write(completed.stdout.decode(errors='replace'))
+        raise RuntimeError(f'The build of {project} failed.')
+    return {'wall_time': wall_time, 'python_time': json.loads(times_file.read_text())['process_time']}
+
+
+def profile_build(project: Path, env: Dict[str, str], top: int = 10) -> dict:
+    r'''
+    Profiles a build and returns the time spent in the functions of the package: their own time in total, the
+    cumulative time of :data:`PROFILED_FUNCTIONS` and the ``top`` functions with the most time of their own.
+    '''
+    profile = project / 'build.prof'
+    run_build(project, env, profile)
+    stats = pstats.Stats(str(profile)).stats
+    package_functions = {function: stat for function, stat in stats.items()
+                         if f'{os.sep}setuptools_cuda_cpp{os.sep}' in function[0]}
+    cumulative_times = {name: 0.0 for name in PROFILED_FUNCTIONS}
+    for (_, _, name), (_, _, _, cumulative_time, _) in package_functions.items():
+        if name in cumulative_times:
+            cumulative_times[name] += cumulative_time
+    own_times = sorted(((stat[2], f'{Path(function[0]).name}:{function[2]}')
+                        for function, stat in package_functions.items()), reverse=True)
+    return {
+        'package_time': sum(stat[2] for stat in package_functions.values()),
+        'functions': cumulative_times,
+        'top': [[name, own_time] for own_time, name in own_times[:top]],
+    }
+
+
+def describe_environment(package_path: Path, env: Dict[str, str]) -> dict:
+    def output(command: List[str]) -> Optional[str]:
+        try:
+            return subprocess.check_output(command, env=env, stderr=subprocess.DEVNULL).decode().strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    cxx_version = output([env.get('CXX', 'c++'), '--version'])
+    return {
+        'package_version': output([sys.executable, '-c',
+                                   'import setuptools_cuda_cpp; print(setuptools_cuda_cpp.__version__)']),
+        'git_revision': output(['git', '-C', str(package_path), 'describe', '--always', '--dirty']),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'cxx': cxx_version.splitlines()[0] if cxx_version else None,
+        'ninja': output(['ninja', '--version']),
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+
+
+def format_results(results: dict) -> List[str]:
+    environment = results['environment']
+    lines = [f'setuptools_cuda_cpp {environment["package_version"]} ({environment["git_revision"]}), '
+             f'Python {environment["python"]}, {environment["cpu_count"]} CPUs',
+             f'{"backend":<10} {"clean":>8} {"no-op":>8} {"header":>8} {"python":>8} {"package":>8} {"ninja":>8}']
+    for backend, result in results['backends'].items():
+        lines.append(f'{backend:<10} {result["clean"]["wall_time"]:>7.2f}s {result["no_op"]["wall_time"]:>7.2f}s '
+                     f'{result["touch_header"]["wall_time"]:>7.2f}s {result["clean"]["python_time"]:>7.2f}s '
+                     f'{result["profile"]["package_time"]:>7.3f}s '
+                     f'{result["profile"]["functions"]["_write_ninja_file"]:>7.3f}s')
+    lines.append('clean/no-op/header: wall time of a clean build, of a no-op rebuild and of a rebuild after touching '
+                 'a header; python: CPU time of setup.py in the clean build; package/ninja: time spent in the package '
+                 'and in _write_ninja_file (profiled).')
+    return lines
+
+
+def compare_results(baseline: dict, results: dict) -> List[str]:
+    r'''Returns the lines comparing the ``results`` with the ``baseline`` ones, as ratios (lower is faster).'''
+    if baseline.get('version') != results['version']:
+        return ['The results to compare with are from another version of the benchmark.']
+    lines = []
+    if baseline['parameters'] != results['parameters']:
+        lines.append('Warning: the results to compare with were measured with other parameters.')
+    lines.append(f'Compared with {baseline["environment"]["package_version"]} '
+                 f'({baseline["environment"]["git_revision"]}):')
+    for backend, result in results['backends'].items():
+        if backend not in baseline['backends']:
+            continue
+        ratios = []
+        for measurement in ('clean', 'no_op', 'touch_header'):
+            for metric in ('wall_time', 'python_time'):
+                previous = baseline['backends'][backend][measurement][metric]
+                ratio = result[measurement][metric] / previous if previous else float('nan')
+                ratios.append(f'{measurement}.{metric} x{ratio:.2f}')
+        lines.append(f'{backend:<10} ' + ', '.join(ratios))
+    return lines
+
+
+if __name__ == '__main__':
+    sys.exit(main())